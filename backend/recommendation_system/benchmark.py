@@ -0,0 +1,356 @@
+"""Benchmark and recall evaluation for FAISSRecommender.
+
+Builds synthetic course/blog/forum catalogues, indexes them with each ANN
+backend and reports build time, index size, query latency percentiles and
+recall@k against exact search. Embeddings come from a deterministic stub,
+so no model is downloaded and runs are reproducible. The "more like this"
+neighbour table is left out of the build time; with --neighbours-k it is
+built and timed as a stage of its own (slow for exact search at 1M items).
+
+With --encoders, the real embedding model is also run on each encoder
+backend over synthetic catalogue texts, reporting encode throughput,
+single-text latency and cosine parity with the fp32 model.
+
+    python benchmark.py --sizes 1000,10000 --output bench.json
+    python benchmark.py --sizes 1000,10000 --compare bench.json
+    python benchmark.py --sizes "" --encoders torch,torch_int8,onnx --encode-threads 4
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+from bson import ObjectId
+
+from config import EMBEDDING_MODEL, EMBEDDING_ONNX_FILE
+from embeddings import EmbeddingGenerator
+from encoders import encode_throughput, load_encoder, parity_check
+from recommender import FAISSRecommender, SearchQuery
+from index_factory import default_index_params
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+DEFAULT_BACKENDS = "flat,hnsw,ivf_flat,ivf_sq8,ivf_pq"
+
+TOPICS = {
+    "AI": ["neural", "networks", "transformers", "llm", "agents", "reasoning", "vision", "nlp"],
+    "Machine Learning": ["regression", "classification", "features", "training", "models", "sklearn", "boosting"],
+    "Web Development": ["react", "javascript", "css", "html", "frontend", "backend", "node", "api"],
+    "Data Science": ["pandas", "statistics", "visualization", "analysis", "python", "notebooks", "sql"],
+    "Cloud": ["aws", "azure", "gcp", "serverless", "kubernetes", "docker", "terraform"],
+    "Cybersecurity": ["security", "encryption", "pentest", "network", "malware", "firewall", "auth"],
+    "DevOps": ["ci", "cd", "pipelines", "monitoring", "deployment", "containers", "automation"],
+    "Mobile": ["android", "ios", "flutter", "kotlin", "swift", "apps", "ui"],
+    "Design": ["ux", "ui", "figma", "prototyping", "typography", "accessibility", "research"],
+    "Databases": ["mongodb", "postgres", "indexes", "queries", "transactions", "replication", "nosql"],
+}
+FILLER = ["introduction", "guide", "advanced", "basics", "complete", "practical", "deep", "dive",
+          "tips", "patterns", "best", "practices", "hands", "on", "project", "question", "help", "error"]
+DIFFICULTIES = ["Débutant", "Intermédiaire", "Avancé"]
+
+
+class StubEmbeddingModel:
+    """Deterministic bag-of-words encoder: each word maps to a fixed pseudo-random vector"""
+
+    def __init__(self, dimension: int, seed: int = 0):
+        self.dimension = dimension
+        self.seed = seed
+        self._word_vectors = {}
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            digest = hashlib.blake2b(f"{self.seed}:{word}".encode("utf-8"), digest_size=8).digest()
+            rng = np.random.default_rng(int.from_bytes(digest, "little"))
+            vector = rng.standard_normal(self.dimension).astype('float32')
+            self._word_vectors[word] = vector
+        return vector
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts, **kwargs) -> np.ndarray:
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        embeddings = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                embeddings[row] += self._word_vector(word)
+        return embeddings
+
+
+class StubEmbeddingGenerator(EmbeddingGenerator):
+    """EmbeddingGenerator backed by StubEmbeddingModel (no model download)"""
+
+    def __init__(self, dimension: int = 384, seed: int = 0):
+        self.model_name = f"stub-{dimension}"
+        self.query_cache = None
+        self.model = StubEmbeddingModel(dimension, seed)
+        self.embedding_dim = dimension
+
+    def process_pool(self, processes: int = 1):
+        return nullcontext()  # the stub is cheaper than shipping texts to worker processes
+
+
+def synthetic_document(i: int, rng: random.Random) -> Dict:
+    """A document shaped like the courses / blogs / forums collections"""
+    topic = rng.choice(list(TOPICS))
+    words = TOPICS[topic]
+    title = " ".join(rng.sample(words, 2) + rng.sample(FILLER, 2))
+    body = " ".join(rng.choices(words, k=6) + rng.choices(FILLER, k=6))
+    doc = {"_id": ObjectId(f"{i:024x}"), "title": title.title()}
+    kind = rng.random()
+    if kind < 0.5:
+        doc.update(
+            content_type="course", description=body, category=topic, tags=rng.sample(words, 3),
+            author=f"Author {rng.randrange(500)}", difficulty=rng.choice(DIFFICULTIES),
+            duration_hours=rng.randrange(1, 60), images={"cover_image": f"https://example.com/{i}.jpg"},
+        )
+    elif kind < 0.8:
+        doc.update(content_type="blog", desc=body, tags=rng.sample(words, 3), author=f"Author {rng.randrange(500)}")
+    else:
+        doc.update(
+            content_type="forum", description=body, labels=[topic] + rng.sample(words, 1),
+            views=rng.randrange(5000), replies=rng.randrange(100),
+        )
+    return doc
+
+
+def synthetic_batches(size: int, batch_size: int = 512, seed: int = 0):
+    rng = random.Random(seed)
+    for start in range(0, size, batch_size):
+        yield [synthetic_document(i, rng) for i in range(start, min(start + batch_size, size))]
+
+
+def synthetic_queries(count: int, seed: int = 1) -> List[List[str]]:
+    """Topic selections like the frontend sends (1-3 topics, sometimes with a keyword)"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        topics = rng.sample(list(TOPICS), rng.randint(1, 3))
+        if rng.random() < 0.5:
+            topics.append(rng.choice(TOPICS[topics[0]]))
+        queries.append(topics)
+    return queries
+
+
+def percentiles(samples_ms: List[float]) -> Dict:
+    values = np.asarray(samples_ms)
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+    }
+
+
+def resident_memory_mb() -> Optional[float]:
+    """Current RSS (Linux only)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError):
+        return None
+
+
+def index_size_mb(rec: FAISSRecommender) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        rec.index.write(tmp)
+        total = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+    return round(total / (1024 * 1024), 2)
+
+
+def exact_neighbours(rec: FAISSRecommender, query_vectors: np.ndarray, k: int) -> np.ndarray:
+    """Ground-truth content ids from brute-force search over the stored vectors"""
+    vectors = np.ascontiguousarray(rec.vectors.vectors)
+    index = faiss.IndexFlatIP(vectors.shape[1]) if rec.metric == "cosine" else faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    _, rows = index.search(query_vectors, k)
+    return np.where(rows >= 0, rec.vectors.ids[np.maximum(rows, 0)], -1)
+
+
+def recall_at_k(approx: np.ndarray, exact: np.ndarray) -> float:
+    hits = [len(set(a[a >= 0].tolist()) & set(e[e >= 0].tolist())) / max((e >= 0).sum(), 1)
+            for a, e in zip(approx, exact)]
+    return round(float(np.mean(hits)), 4)
+
+
+def run_backend(gen: StubEmbeddingGenerator, size: int, backend: str, queries: List[List[str]],
+                k: int, batch_size: int, index_params: Dict, neighbours_k: int = 0) -> Dict:
+    params = dict(index_params, index_type=backend)
+    rec = FAISSRecommender(gen, index_params=params, neighbours_k=0)
+
+    rss_before = resident_memory_mb()
+    started = time.perf_counter()
+    rec.build_index_streaming(synthetic_batches(size), expected_total=size)
+    build_seconds = time.perf_counter() - started
+    rss_after = resident_memory_mb()
+
+    neighbours_seconds = None
+    if neighbours_k > 0:
+        rec.neighbours_k = neighbours_k
+        started = time.perf_counter()
+        rec.neighbours = rec._build_neighbours(rec.index, rec.vectors)
+        neighbours_seconds = time.perf_counter() - started
+
+    query_vectors = rec._prepare_vectors(gen.generate_query_embeddings(queries))
+    _, approx = rec.index.search(query_vectors, k)
+    exact = exact_neighbours(rec, query_vectors, k)
+
+    # Single-query latency: encode + search + hydrate, as served by /api/recommend
+    single_ms = []
+    for topics in queries:
+        started = time.perf_counter()
+        rec.search_batch([SearchQuery(topics, k)])
+        single_ms.append((time.perf_counter() - started) * 1000)
+
+    # Batched latency, as produced by the query micro-batcher
+    batch_ms = []
+    for start in range(0, len(queries), batch_size):
+        chunk = [SearchQuery(topics, k) for topics in queries[start:start + batch_size]]
+        started = time.perf_counter()
+        rec.search_batch(chunk)
+        batch_ms.append((time.perf_counter() - started) * 1000)
+
+    result = {
+        "size": size,
+        "backend": backend,
+        "index": rec.index.describe(),
+        "build_seconds": round(build_seconds, 3),
+        "neighbours_seconds": round(neighbours_seconds, 3) if neighbours_seconds is not None else None,
+        "index_size_mb": index_size_mb(rec),
+        "vector_store_mb": round(rec.vectors.vectors.nbytes / (1024 * 1024), 2),
+        "rss_delta_mb": round(rss_after - rss_before, 1) if rss_before is not None else None,
+        f"recall_at_{k}": recall_at_k(approx, exact),
+        "single_query": percentiles(single_ms),
+        "batched_query": dict(
+            percentiles(batch_ms), batch_size=batch_size,
+            per_query_ms=round(float(np.sum(batch_ms)) / len(queries), 3),
+        ),
+    }
+    logger.info(f"{size} x {backend}: {json.dumps(result)}")
+    return result
+
+
+def run_encoder(model_name: str, backend: str, texts: List[str], reference, threads: int, batch_size: int) -> Dict:
+    started = time.perf_counter()
+    model = load_encoder(model_name, backend, threads, EMBEDDING_ONNX_FILE)
+    load_seconds = time.perf_counter() - started
+    result = dict(
+        encode_throughput(model, texts, batch_size), backend=backend, model=model_name, threads=threads,
+        load_seconds=round(load_seconds, 3), parity=parity_check(model, reference),
+    )
+    logger.info(f"encoder {backend}: {json.dumps(result)}")
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict], baseline: List[Dict], k: int):
+    """Print latency / recall changes against a previous run"""
+    previous = {(r["size"], r["backend"]): r for r in baseline}
+    recall_key = f"recall_at_{k}"
+    for r in results:
+        old = previous.get((r["size"], r["backend"]))
+        if old is None:
+            continue
+        p50, old_p50 = r["single_query"]["p50_ms"], old["single_query"]["p50_ms"]
+        change = (p50 - old_p50) / old_p50 * 100 if old_p50 else 0.0
+        print(
+            f"{r['size']:>8} {r['backend']:<9} p50 {old_p50:8.3f} -> {p50:8.3f} ms ({change:+.1f}%)  "
+            f"recall {old.get(recall_key)} -> {r.get(recall_key)}  "
+            f"build {old['build_seconds']}s -> {r['build_seconds']}s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISSRecommender index backends")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated catalogue sizes")
+    parser.add_argument("--backends", default=DEFAULT_BACKENDS, help="Comma-separated index types")
+    parser.add_argument("--dimension", type=int, default=384, help="Stub embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Number of benchmark queries")
+    parser.add_argument("--k", type=int, default=10, help="Results per query (recall@k)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Queries per batched search")
+    parser.add_argument("--neighbours-k", type=int, default=0, help="Also build and time the neighbour table "
+                        "with this many neighbours per item (0 = skip)")
+    parser.add_argument("--encoders", default="", help="Comma-separated encoder backends to benchmark "
+                        "(torch,torch_int8,onnx); loads the real model")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Model for --encoders")
+    parser.add_argument("--encode-texts", type=int, default=2000, help="Catalogue texts encoded per backend")
+    parser.add_argument("--encode-batch-size", type=int, default=64)
+    parser.add_argument("--encode-threads", type=int, default=0, help="Encoder CPU threads (0 = library default)")
+    parser.add_argument("--output", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    gen = StubEmbeddingGenerator(args.dimension)
+    queries = synthetic_queries(args.queries)
+    index_params = default_index_params()
+    results = []
+    for size in (int(s) for s in args.sizes.split(",") if s):
+        for backend in args.backends.split(","):
+            results.append(run_backend(gen, size, backend, queries, args.k, args.batch_size, index_params,
+                                       args.neighbours_k))
+
+    encoder_results = []
+    if args.encoders:
+        texts = [gen.create_content_text(doc) for batch in synthetic_batches(args.encode_texts) for doc in batch]
+        texts += [" ".join(topics) for topics in queries]
+        reference = load_encoder(args.model, "torch", args.encode_threads)
+        for backend in args.encoders.split(","):
+            try:
+                encoder_results.append(run_encoder(args.model, backend, texts, reference, args.encode_threads,
+                                                   args.encode_batch_size))
+            except ImportError as e:
+                logger.warning(f"Skipping encoder {backend}: {e}")
+                encoder_results.append({"backend": backend, "error": str(e)})
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "faiss": faiss.__version__,
+        "dimension": args.dimension,
+        "queries": args.queries,
+        "k": args.k,
+        "index_params": index_params,
+        "results": results,
+        "encoders": encoder_results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        compare(results, baseline["results"], args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Bulk recommendations for offline jobs such as the weekly digest emails.
+
+    python bulk.py queries.jsonl > results.ndjson
+
+Each input line is a JSON object with an optional "id" (echoed back),
+"topics" and/or "user_id"; each output line is
+{"id": ..., "recommendations": [...], "total": n} in input order, or
+{"id": ..., "error": "..."} for a query that can't be answered. Queries are
+processed in chunks of BULK_CHUNK_SIZE: user profiles for a chunk come from
+one users query, topics are encoded in one model call, and queries sharing
+search settings go through one FAISS search, so throughput is close to raw
+batched search rather than one HTTP request per user.
+
+The same stream is served over HTTP by POST /api/recommend/bulk; jobs that
+run next to the index can call `iter_ndjson` directly.
+"""
+import argparse
+import itertools
+import json
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+import orjson
+from models import BulkQuery
+from payloads import render_recommendations
+from recommender import FAISSRecommender, SearchQuery
+from config import BULK_CHUNK_SIZE, RETRIEVAL_MODE, MMR_DEFAULT_DIVERSITY
+
+logger = logging.getLogger(__name__)
+
+
+def recommend_bulk(recommender: FAISSRecommender, queries: Iterable[BulkQuery], user_profiles=None,
+                   limit: int = 10, min_score: Optional[float] = None, filters: Optional[Dict[str, List[str]]] = None,
+                   exclude_seen: bool = True, retrieval: str = RETRIEVAL_MODE, diversity: float = MMR_DEFAULT_DIVERSITY,
+                   chunk_size: int = BULK_CHUNK_SIZE, payloads: bool = False) -> Iterator[Tuple[BulkQuery, Optional[List[Tuple[Dict, float]]], Optional[str]]]:
+    """Yield (query, hits, error) for every query, in order, one chunk at a time.
+
+    Exactly one of hits / error is set. `user_profiles` (a UserProfileStore)
+    is required for queries with a user_id. Results bypass the result cache.
+    """
+    queries = iter(queries)
+    while True:
+        chunk = list(itertools.islice(queries, chunk_size))
+        if not chunk:
+            return
+        user_ids = [query.user_id for query in chunk if query.user_id]
+        profiles = user_profiles.get_many(user_ids) if user_ids and user_profiles is not None else {}
+
+        errors = [None] * len(chunk)
+        search_queries, rows = [], []
+        for row, query in enumerate(chunk):
+            profile = None
+            if query.user_id:
+                profile = profiles.get(query.user_id)
+                if profile is None:
+                    errors[row] = "Unknown user"
+                    continue
+            topics = query.topics or (profile.interests if profile is not None else [])
+            if not topics and (profile is None or profile.vector is None):
+                errors[row] = "No topics provided"
+                continue
+            search_queries.append(SearchQuery(topics, limit, min_score, filters=filters,
+                                              profile=profile, exclude_seen=exclude_seen, retrieval=retrieval,
+                                              diversity=diversity))
+            rows.append(row)
+
+        hits = [None] * len(chunk)
+        if search_queries:
+            for row, row_hits in zip(rows, recommender.search_batch(search_queries, payloads=payloads, cache=False)):
+                hits[row] = row_hits
+        for query, row_hits, error in zip(chunk, hits, errors):
+            yield query, row_hits, error
+
+
+def iter_ndjson(recommender: FAISSRecommender, queries: Iterable[BulkQuery], user_profiles=None,
+                **kwargs) -> Iterator[bytes]:
+    """recommend_bulk rendered as NDJSON lines (same item format as /api/recommend)"""
+    for query, hits, error in recommend_bulk(recommender, queries, user_profiles, payloads=True, **kwargs):
+        if error is not None:
+            yield orjson.dumps({"id": query.id, "error": error}) + b"\n"
+        else:
+            yield b'{"id":' + orjson.dumps(query.id) + b',' + render_recommendations(hits)[1:] + b"\n"
+
+
+def read_queries(lines: Iterable[str]) -> Iterator[BulkQuery]:
+    for line in lines:
+        if line.strip():
+            yield BulkQuery(**json.loads(line))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write recommendations for many topic sets / users as NDJSON")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL file of queries (default: stdin)")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--min-score", type=float, default=None)
+    parser.add_argument("--filters", type=json.loads, default=None, help='e.g. \'{"content_type": ["course"]}\'')
+    parser.add_argument("--include-seen", action="store_true", help="Don't leave out users' enrolled courses")
+    parser.add_argument("--retrieval", choices=("semantic", "lexical", "hybrid"), default=RETRIEVAL_MODE)
+    parser.add_argument("--diversity", type=float, default=MMR_DEFAULT_DIVERSITY, help="MMR re-ranking, 0..1")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    # Serve from the latest published snapshot, like a worker
+    from db import db, users_coll
+    from embeddings import EmbeddingGenerator
+    from user_profiles import UserProfileStore
+    from config import SNAPSHOT_DIR, SNAPSHOT_MMAP
+    recommender = FAISSRecommender(EmbeddingGenerator())
+    if not recommender.load_snapshot(SNAPSHOT_DIR, None, mmap=SNAPSHOT_MMAP):
+        sys.exit(f"No index snapshot in {SNAPSHOT_DIR}; start the API once to build one")
+    user_profiles = UserProfileStore(db, users_coll, lambda: recommender)
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    out = sys.stdout.buffer
+    try:
+        lines = iter_ndjson(recommender, read_queries(source), user_profiles, limit=args.limit,
+                            min_score=args.min_score, filters=args.filters,
+                            exclude_seen=not args.include_seen, retrieval=args.retrieval, diversity=args.diversity,
+                            chunk_size=args.chunk_size)
+        for count, line in enumerate(lines, 1):
+            out.write(line)
+            if count % 10000 == 0:
+                logger.info(f"{count} queries done")
+        out.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import json
+import os
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+from index_factory import AnnIndex
+from lazy_imports import lazy_import
+
+faiss = lazy_import("faiss")
+
+logger = logging.getLogger(__name__)
+
+CHUNKS_DIR = "chunks"
+CHUNKS_META_FILE = "chunks.json"
+AGGREGATIONS = ("max", "sum")
+
+
+def split_chunks(text: str, words: int, overlap: int, max_chunks: int) -> List[str]:
+    """Overlapping windows of `words` words, each starting `words - overlap` words after the previous one"""
+    tokens = text.split()
+    if len(tokens) <= words:
+        return [" ".join(tokens)]
+    step = max(words - overlap, 1)
+    starts = range(0, len(tokens) - overlap, step)[:max_chunks]
+    return [" ".join(tokens[start:start + words]) for start in starts]
+
+
+def aggregate_hits(scores: np.ndarray, parents: np.ndarray, k: int, how: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-row chunk hits collapsed to their items: (scores, item ids), best first, -1 padded to k.
+
+    An item scores the max or the sum of its retrieved chunks' scores.
+    """
+    n, width = parents.shape
+    out_scores = np.zeros((n, k), dtype='float32')
+    out_ids = np.full((n, k), -1, dtype='int64')
+    rows = np.repeat(np.arange(n), width)
+    items, values = parents.ravel(), scores.ravel()
+    valid = items >= 0
+    rows, items, values = rows[valid], items[valid], values[valid]
+    if not len(rows):
+        return out_scores, out_ids
+
+    # Group by (row, item), then rank the groups of each row by score
+    order = np.lexsort((items, rows))
+    rows, items, values = rows[order], items[order], values[order]
+    starts = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (items[1:] != items[:-1])])
+    reduce = np.maximum if how == "max" else np.add
+    group_rows, group_items, group_scores = rows[starts], items[starts], reduce.reduceat(values, starts)
+    order = np.lexsort((-group_scores, group_rows))
+    group_rows, group_items, group_scores = group_rows[order], group_items[order], group_scores[order]
+    rank = np.arange(len(group_rows)) - np.searchsorted(group_rows, group_rows)
+    keep = rank < k
+    out_scores[group_rows[keep], rank[keep]] = group_scores[keep]
+    out_ids[group_rows[keep], rank[keep]] = group_items[keep]
+    return out_scores, out_ids
+
+
+class ChunkIndex:
+    """Chunk vectors of long items, searched and collapsed back to their items.
+
+    Chunk ids are dense row numbers: chunk i belongs to item `parents[i]`
+    (-1 once the item is removed or re-chunked) and its vector is
+    `vectors[i]`, so the chunk -> item mapping costs 8 bytes per chunk and a
+    lookup is one array gather. The ANN index (same type and parameters as
+    the item index) is addressed by chunk id. Re-chunked items get new ids
+    at the end; the holes they leave are reclaimed by the next full build.
+    """
+
+    def __init__(self, index: AnnIndex, parents: np.ndarray, vectors: np.ndarray, aggregation: str = "max",
+                 overfetch: int = 4):
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unsupported chunk aggregation: {aggregation}")
+        self.index = index
+        self._parents = parents
+        self._vectors = vectors
+        self._size = len(parents)
+        self.aggregation = aggregation
+        self.overfetch = overfetch  # chunks fetched per requested item
+        self.read_only = False
+
+    def __len__(self) -> int:
+        """Live chunks"""
+        return self.index.ntotal
+
+    @property
+    def parents(self) -> np.ndarray:
+        return self._parents[:self._size]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:self._size]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._parents.nbytes + self._vectors.nbytes)
+
+    @classmethod
+    def build(cls, parents: np.ndarray, vectors: np.ndarray, metric: str, index_params: Dict,
+              aggregation: str = "max", overfetch: int = 4) -> "ChunkIndex":
+        index = AnnIndex.create(vectors.shape[1], len(vectors), metric, index_params)
+        if not index.is_trained:
+            index.train(vectors[:max(index.train_size, 1)])
+        index.add(np.arange(len(vectors), dtype='int64'), vectors)
+        return cls(index, parents, vectors, aggregation, overfetch)
+
+    def chunks_of(self, item_ids: np.ndarray) -> np.ndarray:
+        """Chunk ids of the given items"""
+        return np.flatnonzero(np.isin(self.parents, item_ids)).astype('int64')
+
+    def upsert(self, item_ids: np.ndarray, counts: np.ndarray, vectors: np.ndarray):
+        """Replace the chunks of `item_ids`; item i has the next `counts[i]` rows of `vectors`"""
+        self._make_writable()
+        self.remove(item_ids)
+        start = self._size
+        self._grow(start + len(vectors))
+        chunk_ids = np.arange(start, start + len(vectors), dtype='int64')
+        self._parents[start:start + len(vectors)] = np.repeat(item_ids, counts)
+        self._vectors[start:start + len(vectors)] = vectors
+        self._size += len(vectors)
+        self.index.add(chunk_ids, vectors)
+
+    def remove(self, item_ids: np.ndarray) -> int:
+        self._make_writable()
+        chunk_ids = self.chunks_of(item_ids)
+        if len(chunk_ids):
+            self._parents[chunk_ids] = -1
+            self.index.remove(chunk_ids)
+        return len(chunk_ids)
+
+    def search(self, queries: np.ndarray, k: int, score: Callable[[np.ndarray], np.ndarray],
+               chunk_ids: Optional[np.ndarray] = None, selector=None, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k items per query by aggregated chunk score: (scores, item ids), -1 padded.
+
+        `score` turns index distances into similarities. `chunk_ids` restricts
+        the search to a filter's chunks: exactly over their vectors, or
+        through `selector` when one is given. Rows that come back with fewer
+        than k distinct items (one item's chunks crowding the others out)
+        are searched again, deeper.
+        """
+        available = len(self) if chunk_ids is None else len(chunk_ids)
+        depth = min(k * self.overfetch, available)
+        scores = np.zeros((len(queries), k), dtype='float32')
+        ids = np.full((len(queries), k), -1, dtype='int64')
+        rows = np.arange(len(queries))
+        while len(rows) and depth > 0:
+            if chunk_ids is not None and selector is None:
+                metric = faiss.METRIC_INNER_PRODUCT if self.index.metric == "cosine" else faiss.METRIC_L2
+                distances, hits = faiss.knn(queries[rows], self.vectors[chunk_ids], depth, metric=metric)
+                hits = np.where(hits >= 0, chunk_ids[np.maximum(hits, 0)], -1)
+            else:
+                distances, hits = self.index.search(queries[rows], depth, nprobe=nprobe, ef_search=ef_search,
+                                                    selector=selector)
+            items = np.where(hits >= 0, self.parents[np.maximum(hits, 0)], -1)
+            scores[rows], ids[rows] = aggregate_hits(score(distances), items, k, self.aggregation)
+            if depth >= available:
+                break
+            rows = rows[ids[rows, -1] < 0]
+            depth = min(depth * 4, available)
+        return scores, ids
+
+    def copy(self) -> "ChunkIndex":
+        return ChunkIndex(self.index.clone(), np.array(self.parents), np.array(self.vectors), self.aggregation,
+                          self.overfetch)
+
+    def _grow(self, needed: int):
+        capacity = len(self._parents)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        parents = np.empty(capacity, dtype='int64')
+        vectors = np.empty((capacity, self._vectors.shape[1]), dtype='float32')
+        parents[:self._size] = self.parents
+        vectors[:self._size] = self.vectors
+        self._parents, self._vectors = parents, vectors
+
+    def _make_writable(self):
+        # Snapshot arrays and index may be read-only memory maps
+        if self.read_only:
+            self.index = self.index.clone()
+            self._parents, self._vectors = np.array(self.parents), np.array(self.vectors)
+            self.read_only = False
+
+    def write(self, path: str):
+        chunks_dir = os.path.join(path, CHUNKS_DIR)
+        os.makedirs(chunks_dir, exist_ok=True)
+        self.index.write(chunks_dir)
+        np.save(os.path.join(chunks_dir, "parents.npy"), np.ascontiguousarray(self.parents))
+        np.save(os.path.join(chunks_dir, "vectors.npy"), np.ascontiguousarray(self.vectors))
+        with open(os.path.join(chunks_dir, CHUNKS_META_FILE), "w") as f:
+            json.dump({"aggregation": self.aggregation, "overfetch": self.overfetch}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> Optional["ChunkIndex"]:
+        """The snapshot's chunk index, or None if it was written without one"""
+        chunks_dir = os.path.join(path, CHUNKS_DIR)
+        if not os.path.isdir(chunks_dir):
+            return None
+        with open(os.path.join(chunks_dir, CHUNKS_META_FILE)) as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        parents = np.load(os.path.join(chunks_dir, "parents.npy"), mmap_mode=mmap_mode)
+        vectors = np.load(os.path.join(chunks_dir, "vectors.npy"), mmap_mode=mmap_mode)
+        chunks = cls(AnnIndex.read(chunks_dir, mmap=mmap), parents, vectors, meta["aggregation"], meta["overfetch"])
+        chunks.read_only = mmap
+        return chunks
+
+    def get_stats(self) -> Dict:
+        live = self.parents[self.parents >= 0]
+        return {
+            "chunks": len(self),
+            "items": int(len(np.unique(live))),
+            "dead_rows": int(self._size - len(live)),
+            "aggregation": self.aggregation,
+            "bytes": self.nbytes,
+            "index": self.index.describe(),
+        }
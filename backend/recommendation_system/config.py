@@ -0,0 +1,127 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Embedding model
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# Encoder backend: "torch" (fp32 reference), "torch_int8" (dynamic int8 quantization) or "onnx" (ONNX Runtime)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # CPU threads for the encoder, 0 = library default
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "")  # e.g. onnx/model_qint8_avx512_vnni.onnx
+# Non-torch backends must agree with the fp32 model to at least this cosine on every parity text,
+# or the fp32 model is used instead; 0 skips the check (and loading the reference model)
+EMBEDDING_PARITY_THRESHOLD = float(os.getenv("EMBEDDING_PARITY_THRESHOLD", "0.98"))
+# Pooled encoding: texts are sorted by estimated token length and sent to workers in batches
+# of at most this many padded tokens (and texts)
+EMBEDDING_TOKEN_BUDGET = int(os.getenv("EMBEDDING_TOKEN_BUDGET", "4096"))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "128"))
+# Full builds of at least EMBEDDING_POOL_MIN_ITEMS items encode on this many worker processes
+# (each loads its own model copy); 1 = in-process, 0 = one per CPU core
+EMBEDDING_PROCESSES = int(os.getenv("EMBEDDING_PROCESSES", "1"))
+EMBEDDING_POOL_MIN_ITEMS = int(os.getenv("EMBEDDING_POOL_MIN_ITEMS", "20000"))
+
+# Index similarity: "cosine" (inner product over normalized vectors) or "l2"
+INDEX_METRIC = os.getenv("INDEX_METRIC", "cosine")
+
+# ANN index: "auto" (by catalogue size and memory budget), "flat", "hnsw", "ivf_flat", "ivf_sq8" or "ivf_pq"
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+INDEX_MEMORY_BUDGET_MB = int(os.getenv("INDEX_MEMORY_BUDGET_MB", "0"))  # index + float32 vector store, 0 = unlimited
+INDEX_NLIST = int(os.getenv("INDEX_NLIST", "0"))  # IVF clusters, 0 = ~4*sqrt(n)
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "10"))  # IVF clusters searched per query
+INDEX_HNSW_M = int(os.getenv("INDEX_HNSW_M", "32"))
+INDEX_HNSW_EF_CONSTRUCTION = int(os.getenv("INDEX_HNSW_EF_CONSTRUCTION", "80"))
+INDEX_HNSW_EF_SEARCH = int(os.getenv("INDEX_HNSW_EF_SEARCH", "64"))
+INDEX_PQ_M = int(os.getenv("INDEX_PQ_M", "0"))  # PQ sub-quantizers (code bytes), 0 = dimension / 8
+INDEX_PQ_NBITS = int(os.getenv("INDEX_PQ_NBITS", "8"))
+
+# Filtered search: filters matching at most this many items are searched exactly over
+# just those vectors; larger matches use an id selector inside the ANN index
+FILTER_BRUTE_FORCE_MAX = int(os.getenv("FILTER_BRUTE_FORCE_MAX", "4096"))
+
+# Index snapshots (saved FAISS index + embeddings, reused across restarts)
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "index_snapshots")
+SNAPSHOT_MMAP = os.getenv("SNAPSHOT_MMAP", "1") == "1"
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "2"))
+
+# Multi-process serving (see serve.py): "standalone" builds and serves in one process;
+# "builder" builds, syncs and publishes snapshots; "worker" serves the published snapshot read-only
+SERVE_ROLE = os.getenv("SERVE_ROLE", "standalone")
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0"))  # 0 = one per CPU core
+SERVE_BUILDER_PORT = int(os.getenv("SERVE_BUILDER_PORT", "8001"))
+SERVE_PRELOAD_MODEL = os.getenv("SERVE_PRELOAD_MODEL", "1") == "1"  # load the model once, before forking (torch backends)
+SNAPSHOT_PUBLISH_INTERVAL = float(os.getenv("SNAPSHOT_PUBLISH_INTERVAL", "30"))  # snapshot synced changes
+SNAPSHOT_FOLLOW_INTERVAL = float(os.getenv("SNAPSHOT_FOLLOW_INTERVAL", "2"))  # worker: check for a new snapshot
+
+# Streaming ingestion: documents read from Mongo and embedded per batch
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "512"))
+
+# Embedding cache (content-hash -> vector); set to an empty string to disable
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "index_snapshots/embedding_cache.sqlite3")
+
+# Incremental index sync (change streams, or polling when unavailable). Polling syncs inserts, edits only
+# of documents that carry updatedAt, and deletes only on the id sweep (a full _id scan per sweep interval)
+INDEX_SYNC_ENABLED = os.getenv("INDEX_SYNC_ENABLED", "1") == "1"
+INDEX_SYNC_POLL_INTERVAL = float(os.getenv("INDEX_SYNC_POLL_INTERVAL", "5"))
+INDEX_SYNC_SWEEP_INTERVAL = float(os.getenv("INDEX_SYNC_SWEEP_INTERVAL", "30"))
+# Opt-in: create the updatedAt index on the content collections at startup. They belong to the Node app,
+# which doesn't set updatedAt, so only enable this (or create the index as a migration) once writers do
+ENSURE_UPDATED_AT_INDEX = os.getenv("ENSURE_UPDATED_AT_INDEX", "0") == "1"
+
+# Chunked embedding: long items are split into overlapping word windows (each prefixed with the title)
+# that are embedded and searched separately; an item scores the max or sum of its retrieved chunks, and its
+# own vector (profiles, "more like this") is the mean of its chunk vectors. MiniLM truncates at 256 tokens,
+# so keep CHUNK_WORDS well below that.
+CHUNKING_ENABLED = os.getenv("CHUNKING_ENABLED", "0") == "1"
+CHUNK_WORDS = int(os.getenv("CHUNK_WORDS", "160"))
+CHUNK_OVERLAP_WORDS = int(os.getenv("CHUNK_OVERLAP_WORDS", "32"))
+CHUNK_MAX_PER_ITEM = int(os.getenv("CHUNK_MAX_PER_ITEM", "32"))
+# "max" keeps scores cosine similarities; "sum" scores aren't, so min_score is not applied under it
+CHUNK_AGGREGATION = os.getenv("CHUNK_AGGREGATION", "max")  # "max" or "sum"
+CHUNK_OVERFETCH = int(os.getenv("CHUNK_OVERFETCH", "4"))  # chunks searched per requested item
+
+# Lexical (BM25) retrieval next to the embeddings; requests pick semantic, lexical or hybrid (RRF-fused)
+LEXICAL_INDEX_ENABLED = os.getenv("LEXICAL_INDEX_ENABLED", "1") == "1"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "semantic")  # default for requests that don't set one
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))  # per retriever, before fusion
+RRF_K = int(os.getenv("RRF_K", "60"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Diversity re-ranking (MMR) of semantic results: default `diversity` for requests that don't set one (0 = off),
+# and candidates re-ranked per query, as a multiple of k and in total
+MMR_DEFAULT_DIVERSITY = float(os.getenv("MMR_DEFAULT_DIVERSITY", "0"))
+MMR_CANDIDATE_FACTOR = int(os.getenv("MMR_CANDIDATE_FACTOR", "4"))
+MMR_MAX_CANDIDATES = int(os.getenv("MMR_MAX_CANDIDATES", "200"))
+
+# "More like this" (/api/similar): precomputed top-K neighbours per item, 0 (default) = always search live.
+# Opt-in: the n x K table is built on every full build and snapshot, and deletes scan it for referencing rows
+NEIGHBOURS_K = int(os.getenv("NEIGHBOURS_K", "0"))
+NEIGHBOURS_BATCH_SIZE = int(os.getenv("NEIGHBOURS_BATCH_SIZE", "1024"))
+
+# Personalized recommendations (/api/recommend with user_id): profile vectors from enrolled courses
+USER_PROFILE_WEIGHT = float(os.getenv("USER_PROFILE_WEIGHT", "0.5"))  # profile share of the blended query vector
+USER_PROFILE_CACHE_SIZE = int(os.getenv("USER_PROFILE_CACHE_SIZE", "10000"))
+USER_PROFILE_TTL = float(os.getenv("USER_PROFILE_TTL", "3600"))  # evict profiles unused for this long
+USER_PROFILE_REFRESH_INTERVAL = float(os.getenv("USER_PROFILE_REFRESH_INTERVAL", "30"))  # re-check updatedAt after
+
+# Bulk recommendations (/api/recommend/bulk, bulk.py): queries per encode + search chunk, and per request
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "512"))
+BULK_MAX_QUERIES = int(os.getenv("BULK_MAX_QUERIES", "50000"))
+
+# Startup: "blocking" loads the model and index before the port is bound; "background" binds at once
+# and loads them afterwards (/health/live vs /health/ready tell the two states apart)
+STARTUP_MODE = os.getenv("STARTUP_MODE", "blocking")
+
+# Observability: share of /api/recommend requests answered with a Server-Timing trace header (0 = off)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+# Query micro-batching: concurrent /api/recommend queries share one encode + search
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "3"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+
+# Query caches: topic-set -> query embedding, and (index version, topics, k) -> result ids
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "4096"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
@@ -0,0 +1,458 @@
+import json
+import math
+import os
+import sys
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+from bson import ObjectId, json_util
+from payloads import encode_payload
+
+logger = logging.getLogger(__name__)
+
+# Descriptions are served truncated to this length, so only that much is kept
+DESCRIPTION_MAX_CHARS = 200
+
+STRING_FIELDS = ("title", "description", "cover_image", "image", "object_id")
+BYTES_FIELDS = ("payload",)
+CATEGORICAL_FIELDS = ("content_type", "category", "difficulty", "language", "author")
+LIST_FIELDS = ("tags", "labels")
+COUNT_FIELDS = ("views", "replies")
+
+# Content fields that can be used in search filters
+FILTER_FIELDS = ("content_type", "category", "difficulty", "tags", "labels", "language")
+
+FilterKey = Tuple[Tuple[str, Tuple[str, ...]], ...]
+
+COLUMNS_DIR = "contents"
+COLUMNS_META_FILE = "columns.json"
+
+# object_id column encoding
+_ID_NONE, _ID_OBJECT_ID, _ID_JSON = 0, 1, 2
+
+
+def truncate_description(text: str) -> str:
+    if len(text) > DESCRIPTION_MAX_CHARS:
+        return text[:DESCRIPTION_MAX_CHARS - 3] + '...'
+    return text
+
+
+def _scalar(value):
+    """First element of list-valued scalar fields"""
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    return value
+
+
+def normalize_value(value) -> str:
+    return str(value).strip().lower()
+
+
+def attribute_values(content: Dict, field: str) -> List[str]:
+    """Normalized values of one filterable field (list fields yield several)"""
+    raw = content.get(field)
+    if raw is None or raw == "":
+        return []
+    values = raw if isinstance(raw, (list, tuple)) else [raw]
+    return [normalize_value(v) for v in values if v is not None and str(v).strip()]
+
+
+def make_filter_key(filters: Optional[Dict[str, Iterable[str]]]) -> FilterKey:
+    """Canonical, hashable form of a filter: fields and values normalized and sorted"""
+    if not filters:
+        return ()
+    return tuple(sorted(
+        (field, tuple(sorted({normalize_value(v) for v in values})))
+        for field, values in filters.items() if values
+    ))
+
+
+def _intern(value) -> Optional[str]:
+    value = _scalar(value)
+    if value is None or value == "":
+        return None
+    return sys.intern(str(value))
+
+
+def _pack(values: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """One byte buffer plus row offsets"""
+    offsets = np.zeros(len(values) + 1, dtype='int64')
+    offsets[1:] = np.cumsum([len(v) for v in values])
+    return np.frombuffer(b"".join(values), dtype='uint8'), offsets
+
+
+def _count(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class ContentRecord:
+    """The serving fields of one content item.
+
+    Supports read-only dict access (`get`, `[]`, `in`); absent fields
+    behave like missing keys. `payload` is the ready-to-serve JSON item
+    for /api/recommend, encoded once when the record is created.
+    """
+    __slots__ = (
+        "_id", "title", "description", "cover_image", "image", "content_type", "category",
+        "difficulty", "language", "author", "tags", "labels", "duration_hours", "views", "replies",
+        "payload",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_document(cls, content: Dict) -> "ContentRecord":
+        images = content.get('images')
+        cover = images.get('cover_image') if isinstance(images, dict) else None
+        description = _scalar(content.get('description'))
+        tags = content.get('tags')
+        labels = content.get('labels')
+        duration = content.get('duration_hours')
+        record = cls(
+            _id=content.get('_id'),
+            title=str(content['title']) if content.get('title') is not None else None,
+            description=truncate_description(str(description)) if description is not None else None,
+            cover_image=str(cover) if cover else None,
+            image=str(content['image']) if content.get('image') else None,
+            content_type=_intern(content.get('content_type')),
+            category=_intern(content.get('category')),
+            difficulty=_intern(content.get('difficulty')),
+            language=_intern(content.get('language')),
+            author=_intern(content.get('author')),
+            tags=tuple(sys.intern(str(t)) for t in (tags if isinstance(tags, list) else [tags]) if t) if tags else None,
+            labels=tuple(sys.intern(str(l)) for l in (labels if isinstance(labels, list) else [labels]) if l) if labels else None,
+            duration_hours=duration if isinstance(duration, (int, float)) and not isinstance(duration, bool) else None,
+            views=_count(content.get('views')),
+            replies=_count(content.get('replies')),
+        )
+        record.payload = encode_payload(record)
+        return record
+
+    def get(self, key: str, default=None):
+        if key == 'images':
+            return {'cover_image': self.cover_image} if self.cover_image else default
+        if key not in self.__slots__:
+            return default
+        value = getattr(self, key)
+        if value is None:
+            return default
+        return list(value) if isinstance(value, tuple) else value
+
+    def __getitem__(self, key: str):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def keys(self) -> List[str]:
+        return list(self.to_dict())
+
+    def to_dict(self) -> Dict:
+        doc = {}
+        for key in self.__slots__ + ('images',):
+            value = self.get(key)
+            if value is not None and key not in ('cover_image', 'payload'):
+                doc[key] = value
+        return doc
+
+
+class ContentColumns:
+    """Immutable columnar storage for ContentRecords, sorted by content id.
+
+    Strings are packed into one utf-8 buffer per field with row offsets;
+    low-cardinality fields and tags/labels are dictionary-encoded. Every
+    column is a plain .npy file, so a snapshot can be memory-mapped and
+    rows are only decoded when a search result is hydrated.
+    """
+
+    def __init__(self, ids: np.ndarray, arrays: Dict[str, np.ndarray], vocabularies: Dict[str, List[str]]):
+        self.ids = ids
+        self.arrays = arrays
+        self.vocabularies = vocabularies
+        # Filters are case-insensitive: vocabulary code -> normalized value
+        self._normalized = {
+            field: [normalize_value(v) for v in vocab] for field, vocab in vocabularies.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.ids.nbytes + sum(a.nbytes for a in self.arrays.values()))
+
+    @classmethod
+    def from_records(cls, items: Iterable[Tuple[int, ContentRecord]]) -> "ContentColumns":
+        items = sorted(items, key=lambda item: item[0])
+        n = len(items)
+        ids = np.fromiter((i for i, _ in items), dtype='int64', count=n)
+        records = [r for _, r in items]
+        arrays, vocabularies = {}, {}
+
+        id_kinds = np.zeros(n, dtype='uint8')
+        id_strings = []
+        for row, record in enumerate(records):
+            if record._id is None:
+                id_strings.append("")
+            elif isinstance(record._id, ObjectId):
+                id_kinds[row] = _ID_OBJECT_ID
+                id_strings.append(str(record._id))
+            else:
+                id_kinds[row] = _ID_JSON
+                id_strings.append(json_util.dumps(record._id))
+        arrays["object_id_kind"] = id_kinds
+
+        for field in STRING_FIELDS:
+            values = id_strings if field == "object_id" else [getattr(r, field) or "" for r in records]
+            arrays[f"{field}_data"], arrays[f"{field}_offsets"] = _pack([v.encode("utf-8") for v in values])
+
+        for field in BYTES_FIELDS:
+            arrays[f"{field}_data"], arrays[f"{field}_offsets"] = _pack([getattr(r, field) or b"" for r in records])
+
+        for field in CATEGORICAL_FIELDS:
+            vocab = {}
+            codes = np.fromiter(
+                (-1 if getattr(r, field) is None else vocab.setdefault(getattr(r, field), len(vocab)) for r in records),
+                dtype='int32', count=n,
+            )
+            arrays[f"{field}_codes"] = codes
+            vocabularies[field] = list(vocab)
+
+        for field in LIST_FIELDS:
+            vocab = {}
+            flat, offsets = [], np.zeros(n + 1, dtype='int64')
+            for row, record in enumerate(records):
+                for value in getattr(record, field) or ():
+                    flat.append(vocab.setdefault(value, len(vocab)))
+                offsets[row + 1] = len(flat)
+            arrays[f"{field}_codes"] = np.array(flat, dtype='int32')
+            arrays[f"{field}_offsets"] = offsets
+            vocabularies[field] = list(vocab)
+
+        arrays["duration_hours"] = np.array(
+            [math.nan if r.duration_hours is None else r.duration_hours for r in records], dtype='float64'
+        )
+        for field in COUNT_FIELDS:
+            arrays[field] = np.array([-1 if getattr(r, field) is None else getattr(r, field) for r in records], dtype='int64')
+
+        return cls(ids, arrays, vocabularies)
+
+    def row_of(self, content_id: int) -> Optional[int]:
+        row = int(np.searchsorted(self.ids, content_id))
+        return row if row < len(self.ids) and self.ids[row] == content_id else None
+
+    def _bytes(self, field: str, row: int) -> Optional[bytes]:
+        offsets = self.arrays[f"{field}_offsets"]
+        start, end = offsets[row], offsets[row + 1]
+        return self.arrays[f"{field}_data"][start:end].tobytes() if end > start else None
+
+    def _string(self, field: str, row: int) -> Optional[str]:
+        data = self._bytes(field, row)
+        return data.decode("utf-8") if data is not None else None
+
+    def payload(self, row: int) -> Optional[bytes]:
+        return self._bytes("payload", row)
+
+    def _categorical(self, field: str, row: int) -> Optional[str]:
+        code = self.arrays[f"{field}_codes"][row]
+        return self.vocabularies[field][code] if code >= 0 else None
+
+    def _list(self, field: str, row: int) -> Optional[Tuple[str, ...]]:
+        offsets = self.arrays[f"{field}_offsets"]
+        codes = self.arrays[f"{field}_codes"][offsets[row]:offsets[row + 1]]
+        vocab = self.vocabularies[field]
+        return tuple(vocab[c] for c in codes.tolist()) or None
+
+    def object_id(self, row: int):
+        kind = self.arrays["object_id_kind"][row]
+        if kind == _ID_NONE:
+            return None
+        raw = self._string("object_id", row)
+        return ObjectId(raw) if kind == _ID_OBJECT_ID else json_util.loads(raw)
+
+    def record(self, row: int) -> ContentRecord:
+        fields = {field: self._string(field, row) for field in STRING_FIELDS if field != "object_id"}
+        fields.update((field, self._bytes(field, row)) for field in BYTES_FIELDS)
+        fields.update((field, self._categorical(field, row)) for field in CATEGORICAL_FIELDS)
+        fields.update((field, self._list(field, row)) for field in LIST_FIELDS)
+        duration = float(self.arrays["duration_hours"][row])
+        fields["duration_hours"] = None if math.isnan(duration) else (int(duration) if duration.is_integer() else duration)
+        for field in COUNT_FIELDS:
+            value = int(self.arrays[field][row])
+            fields[field] = None if value < 0 else value
+        return ContentRecord(_id=self.object_id(row), **fields)
+
+    def match_rows(self, field: str, values: Iterable[str]) -> np.ndarray:
+        """Boolean row mask: rows having any of the (normalized) values in `field`"""
+        wanted = set(values)
+        codes_wanted = np.array([c for c, v in enumerate(self._normalized[field]) if v in wanted], dtype='int32')
+        codes = self.arrays[f"{field}_codes"]
+        if field in CATEGORICAL_FIELDS:
+            return np.isin(codes, codes_wanted)
+        offsets = self.arrays[f"{field}_offsets"]
+        hits = np.concatenate([[0], np.cumsum(np.isin(codes, codes_wanted))])
+        return hits[offsets[1:]] > hits[offsets[:-1]]
+
+    def value_counts(self, field: str, alive: Optional[np.ndarray]) -> Dict[str, int]:
+        codes = self.arrays[f"{field}_codes"]
+        if field in LIST_FIELDS:
+            if alive is not None:
+                codes = codes[np.repeat(alive, np.diff(self.arrays[f"{field}_offsets"]))]
+        else:
+            codes = codes[codes >= 0] if alive is None else codes[(codes >= 0) & alive]
+        counts = np.bincount(codes, minlength=len(self.vocabularies[field]))
+        return {value: int(count) for value, count in zip(self.vocabularies[field], counts.tolist()) if count}
+
+    def write(self, path: str):
+        columns_dir = os.path.join(path, COLUMNS_DIR)
+        os.makedirs(columns_dir, exist_ok=True)
+        np.save(os.path.join(columns_dir, "ids.npy"), np.ascontiguousarray(self.ids))
+        for name, array in self.arrays.items():
+            np.save(os.path.join(columns_dir, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(columns_dir, COLUMNS_META_FILE), "w") as f:
+            json.dump({"vocabularies": self.vocabularies, "columns": sorted(self.arrays)}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "ContentColumns":
+        columns_dir = os.path.join(path, COLUMNS_DIR)
+        with open(os.path.join(columns_dir, COLUMNS_META_FILE)) as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        ids = np.load(os.path.join(columns_dir, "ids.npy"), mmap_mode=mmap_mode)
+        arrays = {
+            name: np.load(os.path.join(columns_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in meta["columns"]
+        }
+        return cls(ids, arrays, meta["vocabularies"])
+
+
+class ContentStore:
+    """Content id -> ContentRecord, replacing a dict of full Mongo documents.
+
+    Most items live in an immutable ContentColumns base (built at the end of
+    an index build, or memory-mapped from a snapshot); items upserted since
+    then are kept as ContentRecords in a small overlay, and removed base rows
+    are masked out. `freeze()` folds the overlay back into new columns.
+    """
+
+    def __init__(self, columns: Optional[ContentColumns] = None):
+        self._columns = columns if columns is not None else ContentColumns.from_records([])
+        self._alive = None  # bool mask over base rows, None while all are alive
+        self._overlay = {}  # content id -> ContentRecord
+        self._base_size = len(self._columns)
+
+    def __len__(self) -> int:
+        return self._base_size + len(self._overlay)
+
+    def __contains__(self, content_id: int) -> bool:
+        return self.get(content_id) is not None
+
+    def get(self, content_id: int, default=None) -> Optional[ContentRecord]:
+        record = self._overlay.get(content_id)
+        if record is not None:
+            return record
+        row = self._columns.row_of(content_id)
+        if row is None or (self._alive is not None and not self._alive[row]):
+            return default
+        return self._columns.record(row)
+
+    def payload(self, content_id: int) -> Optional[bytes]:
+        """Pre-encoded response item, without decoding the rest of the record"""
+        record = self._overlay.get(content_id)
+        if record is not None:
+            return record.payload
+        row = self._columns.row_of(content_id)
+        if row is None or (self._alive is not None and not self._alive[row]):
+            return None
+        return self._columns.payload(row)
+
+    def upsert(self, content_id: int, content: Dict):
+        self._kill_base_row(content_id)
+        self._overlay[content_id] = ContentRecord.from_document(content)
+
+    def remove(self, content_id: int) -> bool:
+        return self._overlay.pop(content_id, None) is not None or self._kill_base_row(content_id)
+
+    def _kill_base_row(self, content_id: int) -> bool:
+        row = self._columns.row_of(content_id)
+        if row is None or (self._alive is not None and not self._alive[row]):
+            return False
+        if self._alive is None:
+            self._alive = np.ones(len(self._columns), dtype=bool)
+        self._alive[row] = False
+        self._base_size -= 1
+        return True
+
+    def _live_rows(self) -> np.ndarray:
+        return np.arange(len(self._columns)) if self._alive is None else np.flatnonzero(self._alive)
+
+    def ids(self) -> np.ndarray:
+        base = self._columns.ids if self._alive is None else self._columns.ids[self._alive]
+        overlay = np.fromiter(self._overlay, dtype='int64', count=len(self._overlay))
+        return np.union1d(base, overlay) if len(overlay) else np.asarray(base)
+
+    def items(self) -> Iterator[Tuple[int, ContentRecord]]:
+        for row in self._live_rows().tolist():
+            yield int(self._columns.ids[row]), self._columns.record(row)
+        yield from self._overlay.items()
+
+    def match(self, filter_key: FilterKey) -> np.ndarray:
+        """Sorted ids of items matching every clause of the filter"""
+        mask = np.ones(len(self._columns), dtype=bool) if self._alive is None else self._alive.copy()
+        for field, values in filter_key:
+            mask &= self._columns.match_rows(field, values)
+        overlay = [
+            content_id for content_id, record in self._overlay.items()
+            if all(set(attribute_values(record, field)) & set(values) for field, values in filter_key)
+        ]
+        base = self._columns.ids[mask]
+        if not overlay:
+            return np.asarray(base)
+        return np.union1d(base, np.array(overlay, dtype='int64'))
+
+    def ids_for(self, field: str, value: str) -> np.ndarray:
+        return self.match(((field, (normalize_value(value),)),))
+
+    def object_ids(self, content_type: str) -> List:
+        """Mongo _ids of the indexed items of one content_type"""
+        rows = self._live_rows()
+        rows = rows[self._columns.match_rows("content_type", [normalize_value(content_type)])[rows]]
+        object_ids = [self._columns.object_id(row) for row in rows.tolist()]
+        object_ids.extend(
+            r._id for r in self._overlay.values()
+            if r.content_type is not None and normalize_value(r.content_type) == normalize_value(content_type)
+        )
+        return [o for o in object_ids if o is not None]
+
+    def value_counts(self, field: str) -> Dict[str, int]:
+        counts = self._columns.value_counts(field, self._alive)
+        for record in self._overlay.values():
+            for value in (getattr(record, field) or ()) if field in LIST_FIELDS else [getattr(record, field)]:
+                if value is not None:
+                    counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def freeze(self) -> ContentColumns:
+        """Fold overlay and removals into new immutable columns and return them"""
+        if self._overlay or self._alive is not None:
+            self._columns = ContentColumns.from_records(self.items())
+            self._overlay = {}
+            self._alive = None
+            self._base_size = len(self._columns)
+        return self._columns
+
+    def get_stats(self) -> Dict:
+        return {
+            "items": len(self),
+            "columnar_items": self._base_size,
+            "overlay_items": len(self._overlay),
+            "columnar_bytes": self._columns.nbytes,
+        }
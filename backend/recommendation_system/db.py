@@ -1,9 +1,12 @@
 import os
+import logging
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Environment variables
 MONGO_URI = os.getenv("MONGODB_URI")
 DB_NAME = os.getenv("DATABASE_NAME")  
@@ -18,8 +21,8 @@ INDEX_COLL = os.getenv("INDEX_COLL", "mfacodes")
 if MONGO_URI is None:
     raise RuntimeError("Please set MONGODB_URI in .env")
 
-# Create MongoDB client and access database
-client = MongoClient(MONGO_URI)
+# Create MongoDB client and access database (connect=False: no connection until the first operation)
+client = MongoClient(MONGO_URI, connect=False)
 db = client[DB_NAME]
 
 # Export collection names (as strings) - used by main.py
@@ -36,5 +39,4 @@ forums_collection = db[FORUMS_COL]
 users_collection = db[USERS_COL]
 index_collection = db[INDEX_COLL]
 
-print(f"✅ Connected to MongoDB: {DB_NAME}")
-print(f"📊 Collections: {', '.join([COURSES_COL, BLOGS_COL, FORUMS_COL])}")
\ No newline at end of file
+logger.info(f"📊 MongoDB client for {DB_NAME} ({', '.join([COURSES_COL, BLOGS_COL, FORUMS_COL])}), connects on first use")
\ No newline at end of file
@@ -0,0 +1,49 @@
+import numpy as np
+
+
+def mmr(relevance: np.ndarray, vectors: np.ndarray, k: int, diversity: np.ndarray) -> np.ndarray:
+    """Maximal marginal relevance: a diverse top-k of each row's candidates.
+
+    `relevance` is (queries, candidates), -inf where a row has no candidate;
+    `vectors` is (queries, candidates, dim); `diversity` (queries,) in [0, 1]
+    trades relevance for novelty. Each step picks, for every row at once,
+    the candidate maximizing
+
+        (1 - diversity) * relevance - diversity * max similarity to the picks so far
+
+    The candidate-candidate cosines are one batched matmul up front, so a
+    step is a handful of (queries, candidates) array ops; only the k steps
+    themselves are sequential. Returns (queries, k) candidate positions in
+    pick order, -1 padded.
+    """
+    n_queries, n_candidates = relevance.shape
+    k = min(k, n_candidates)
+    picks = np.full((n_queries, k), -1, dtype='int64')
+    if k == 0:
+        return picks
+
+    norms = np.linalg.norm(vectors, axis=2, keepdims=True)
+    unit = vectors / np.maximum(norms, 1e-12)
+    similarity = np.matmul(unit, unit.transpose(0, 2, 1), dtype='float32')
+
+    # Both terms pre-scaled by their weight, so a step is a subtract, an argmax and a running max
+    weight = np.asarray(diversity, dtype='float32')[:, None]
+    finite = np.isfinite(relevance)
+    relevance = (np.where(finite, relevance, 0) * (1 - weight)).astype('float32')
+    relevance[~finite] = -np.inf  # padding; picked candidates are set to -inf too
+    similarity *= weight[:, :, None]
+    penalty = np.zeros((n_queries, n_candidates), dtype='float32')
+    score = np.empty_like(relevance)
+    rows = np.arange(n_queries)
+    for step in range(k):
+        np.subtract(relevance, penalty, out=score)
+        pick = score.argmax(axis=1)
+        picks[:, step] = pick
+        relevance[rows, pick] = -np.inf
+        if step == 0:
+            penalty = similarity[rows, pick]
+        else:
+            np.maximum(penalty, similarity[rows, pick], out=penalty)
+    # Rows run out of candidates after their finite ones
+    picks[np.arange(k) >= finite.sum(axis=1)[:, None]] = -1
+    return picks
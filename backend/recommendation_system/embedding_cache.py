@@ -0,0 +1,96 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from typing import Dict, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+# SQLite caps the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+class EmbeddingCache:
+    """On-disk cache of content embeddings keyed by a hash of (model name, content text).
+
+    Unchanged documents produce the same text and therefore the same key, so a
+    rebuild only has to run the model over new or edited content.
+    """
+
+    def __init__(self, path: str, model_name: str, dimension: int):
+        self.path = path
+        self.model_name = model_name
+        self.dimension = dimension
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, vector BLOB NOT NULL, touched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        logger.info(f"Embedding cache opened at {path}")
+
+    def key(self, text: str) -> bytes:
+        """Cache key for a content text under the current model"""
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Return cached vectors for the given keys, marking them as recently used"""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype='float32')
+                    if vector.shape[0] == self.dimension:
+                        found[key] = vector
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET touched_at = ? WHERE key IN ({placeholders})",
+                        [now, *batch],
+                    )
+            self._conn.commit()
+        return found
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        """Store freshly computed vectors"""
+        if not keys:
+            return
+        now = time.time()
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, touched_at) VALUES (?, ?, ?)",
+                [(key, vectors[i].tobytes(), now) for i, key in enumerate(keys)],
+            )
+            self._conn.commit()
+
+    def prune(self, older_than: float) -> int:
+        """Drop entries not used since `older_than` (e.g. deleted or edited documents)"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM embeddings WHERE touched_at < ?", (older_than,))
+            self._conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Pruned {cursor.rowcount} stale cached embeddings")
+        return cursor.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
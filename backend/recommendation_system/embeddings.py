@@ -1,33 +1,103 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
+from concurrent.futures import Future
+from contextlib import contextmanager
 from typing import List, Dict
 import logging
+import time
+from config import (
+    EMBEDDING_MODEL, EMBEDDING_BACKEND, EMBEDDING_THREADS, EMBEDDING_ONNX_FILE, EMBEDDING_PARITY_THRESHOLD,
+    EMBEDDING_TOKEN_BUDGET, EMBEDDING_MAX_BATCH, EMBEDDING_PROCESSES, CHUNK_WORDS, CHUNK_OVERLAP_WORDS,
+    CHUNK_MAX_PER_ITEM,
+)
+from chunks import split_chunks
+from encoders import EncoderPool, backend_model_name, load_encoder, parity_check, pool_size
+from metrics import EMBEDDED_TEXTS, EMBEDDING_SECONDS
+from query_cache import TTLCache, normalize_topics
 
 logger = logging.getLogger(__name__)
 
 class EmbeddingGenerator:
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
-        """Initialize with a lightweight sentence transformer model"""
-        logger.info(f"Loading embedding model: {model_name}")
-        self.model = SentenceTransformer(model_name)
+    backend = "torch"
+    parity = None  # cosine agreement with the fp32 model, for non-torch backends
+    pool = None  # EncoderPool while a process_pool() block is open
+
+    def __init__(self, model_name=EMBEDDING_MODEL, query_cache: TTLCache = None, backend: str = EMBEDDING_BACKEND,
+                 threads: int = EMBEDDING_THREADS, parity_threshold: float = EMBEDDING_PARITY_THRESHOLD):
+        """Initialize with a lightweight sentence transformer model on the configured encoder backend"""
+        logger.info(f"Loading embedding model: {model_name} ({backend})")
+        self.query_cache = query_cache  # normalized topic set -> query embedding
+        self.model = load_encoder(model_name, backend, threads, EMBEDDING_ONNX_FILE)
+        if backend != "torch" and parity_threshold > 0:
+            reference = load_encoder(model_name, "torch", threads)
+            self.parity = parity_check(self.model, reference)
+            if self.parity["min_cosine"] < parity_threshold:
+                logger.error(f"❌ {backend} encoder fails the parity check ({self.parity}, threshold "
+                             f"{parity_threshold}); falling back to the fp32 model")
+                self.model, backend = reference, "torch"
+            else:
+                logger.info(f"{backend} encoder parity with fp32: {self.parity}")
+        self.backend = backend
+        self.source_model = model_name
+        self.threads = threads
+        # Embedding caches and snapshots are keyed by model and backend
+        self.model_name = backend_model_name(model_name, backend, EMBEDDING_ONNX_FILE)
         self.embedding_dim = self.model.get_sentence_embedding_dimension()
         logger.info(f"Model loaded. Embedding dimension: {self.embedding_dim}")
     
+    def get_stats(self) -> Dict:
+        return {"model": self.model_name, "backend": self.backend, "dimension": self.embedding_dim,
+                "parity": self.parity}
+    
     def generate_embedding(self, text: str) -> np.ndarray:
         """Generate embedding for a single text"""
         return self.model.encode(text, convert_to_numpy=True)
     
     def generate_batch_embeddings(self, texts: List[str]) -> np.ndarray:
         """Generate embeddings for a batch of texts"""
-        return self.model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
+        return self.submit_batch_embeddings(texts).result()
+    
+    def submit_batch_embeddings(self, texts: List[str], show_progress_bar: bool = False):
+        """Start embedding a batch of texts; `.result()` returns the embeddings in input order.
+
+        Runs on the worker processes while a process_pool() block is open,
+        otherwise right away in this process (model.encode already sorts a
+        call's texts by length, so there is nothing to gain from bucketing here).
+        `show_progress_bar` is meant for full builds, not incremental updates.
+        """
+        if self.pool is not None:
+            return self.pool.submit(texts)
+        started = time.perf_counter()
+        done = Future()
+        done.set_result(self.model.encode(texts, convert_to_numpy=True, show_progress_bar=show_progress_bar))
+        EMBEDDING_SECONDS.inc(time.perf_counter() - started, "content")
+        EMBEDDED_TEXTS.inc(len(texts), "content")
+        return done
+    
+    @contextmanager
+    def process_pool(self, processes: int = EMBEDDING_PROCESSES):
+        """Encode content batches on `processes` worker processes inside this block (0 = one per core)"""
+        processes = pool_size(processes)
+        if processes is None or self.pool is not None:
+            yield
+            return
+        self.pool = EncoderPool(self.model, self.source_model, self.backend, processes, self.threads,
+                                EMBEDDING_ONNX_FILE, EMBEDDING_TOKEN_BUDGET, EMBEDDING_MAX_BATCH)
+        try:
+            yield
+        finally:
+            pool, self.pool = self.pool, None
+            pool.close()
     
-    def create_content_text(self, content: Dict) -> str:
-        """Create searchable text from content document - UPDATED FOR YOUR SCHEMA"""
+    def create_content_text(self, content: Dict, emphasis: bool = True) -> str:
+        """Create searchable text from content document - UPDATED FOR YOUR SCHEMA
+
+        With `emphasis` the title and category are repeated for weight.
+        """
         parts = []
         
         # Add title with higher weight (repeat for importance)
         if 'title' in content:
-            parts.append(f"{content['title']} {content['title']}")
+            parts.append(f"{content['title']} {content['title']}" if emphasis else content['title'])
         
         # Add description
         if 'description' in content:
@@ -47,7 +117,7 @@ class EmbeddingGenerator:
         
         # Add category (repeat for importance)
         if 'category' in content:
-            parts.append(f"{content['category']} {content['category']}")
+            parts.append(f"{content['category']} {content['category']}" if emphasis else content['category'])
         
         # Add author for credibility signal
         if 'author' in content:
@@ -61,7 +131,55 @@ class EmbeddingGenerator:
         
         return ' '.join(parts).strip()
     
+    def create_chunk_texts(self, content: Dict) -> List[str]:
+        """Overlapping chunks of a content document's full text, each prefixed with its title.
+
+        Besides the create_content_text fields this covers the long bodies:
+        a blog's `content` and a course's chapter titles and transcriptions.
+        """
+        parts = [self.create_content_text({k: v for k, v in content.items() if k != 'title'}, emphasis=False)]
+        if content.get('content'):
+            parts.append(str(content['content']))
+        for chapter in content.get('chapters') or []:
+            if isinstance(chapter, dict):
+                parts.extend(str(chapter[field]) for field in ('title', 'transcription') if chapter.get(field))
+        body = ' '.join(part for part in parts if part)
+        chunks = split_chunks(body, CHUNK_WORDS, CHUNK_OVERLAP_WORDS, CHUNK_MAX_PER_ITEM)
+        title = content.get('title')
+        return [f"{title}. {chunk}" if chunk else str(title) for chunk in chunks] if title else chunks
+    
     def generate_query_embedding(self, topics: List[str]) -> np.ndarray:
         """Generate embedding for user-selected topics"""
-        query_text = ' '.join(topics)
-        return self.generate_embedding(query_text)
\ No newline at end of file
+        return self.generate_query_embeddings([topics])[0]
+    
+    def generate_query_embeddings(self, topic_lists: List[List[str]]) -> np.ndarray:
+        """Generate embeddings for several topic queries in one model call.
+
+        Topics are normalized (trimmed, lowercased, de-duplicated, sorted) so
+        the same selection in any order maps to one cached embedding; the
+        model is uncased, so lowercasing doesn't change the vector.
+        """
+        keys = [normalize_topics(topics) for topics in topic_lists]
+        embeddings = np.empty((len(keys), self.embedding_dim), dtype='float32')
+        
+        missing = {}  # key -> rows waiting for it
+        for row, key in enumerate(keys):
+            cached = self.query_cache.get(key) if self.query_cache is not None else None
+            if cached is None:
+                missing.setdefault(key, []).append(row)
+            else:
+                embeddings[row] = cached
+        
+        if missing:
+            miss_keys = list(missing)
+            started = time.perf_counter()
+            vectors = self.model.encode(
+                [' '.join(key) for key in miss_keys], convert_to_numpy=True, batch_size=max(len(miss_keys), 1)
+            )
+            EMBEDDING_SECONDS.inc(time.perf_counter() - started, "query")
+            EMBEDDED_TEXTS.inc(len(miss_keys), "query")
+            for key, vector in zip(miss_keys, vectors):
+                embeddings[missing[key]] = vector
+                if self.query_cache is not None:
+                    self.query_cache.set(key, vector.astype('float32'))
+        return embeddings
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""Encoder backends behind EmbeddingGenerator.
+
+Every backend is a SentenceTransformer (same tokenizer, pooling and
+normalization), so callers only ever use `encode()` and
+`get_sentence_embedding_dimension()`:
+
+- "torch": the reference fp32 PyTorch model
+- "torch_int8": the same model with its Linear layers dynamically quantized to int8
+- "onnx": ONNX Runtime through sentence-transformers' ONNX backend (needs
+  sentence-transformers>=3.2 and optimum[onnxruntime]); EMBEDDING_ONNX_FILE
+  picks a pre-quantized export such as onnx/model_qint8_avx512_vnni.onnx
+
+Non-reference backends are checked against the fp32 model with
+`parity_check` before they are used.
+
+Large builds can encode on an `EncoderPool` of worker processes, each with
+its own model copy. Texts are sorted by (estimated) token length and cut
+into batches of at most a padded token budget (`length_batches`), so short
+forum titles aren't padded out to the length of course descriptions, batch
+size grows as texts get shorter, and every task sent to a worker costs
+about the same.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+import logging
+from metrics import EMBEDDED_TEXTS, EMBEDDING_SECONDS
+
+logger = logging.getLogger(__name__)
+
+ENCODER_BACKENDS = ("torch", "torch_int8", "onnx")
+
+# Representative catalogue and query texts for the parity check
+PARITY_TEXTS = [
+    "Introduction to Machine Learning Introduction to Machine Learning Learn regression, classification "
+    "and model evaluation with scikit-learn Machine Learning Machine Learning Débutant",
+    "Building REST APIs with FastAPI and MongoDB",
+    "Deep dive into transformers: attention, tokenization and fine-tuning large language models",
+    "Pourquoi mon conteneur Docker redémarre-t-il en boucle ? docker kubernetes",
+    "react hooks state management frontend",
+    "Sécurité des applications web : XSS, CSRF et authentification",
+    "pandas data analysis visualization notebooks",
+    "ai",
+    "cloud devops",
+    "How do I fix 'CUDA out of memory' when training a model on a small GPU? pytorch training error help",
+    "Figma prototyping for mobile apps UX design accessibility",
+    "SQL vs NoSQL: choosing a database, indexes, transactions and replication explained",
+]
+
+
+def load_encoder(model_name: str, backend: str = "torch", threads: int = 0, onnx_file: str = ""):
+    """A SentenceTransformer running on `backend`, using `threads` CPU threads (0 = library default)"""
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}; expected one of {', '.join(ENCODER_BACKENDS)}")
+    # Imported here: sentence_transformers pulls in torch, which dominates import time
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "onnx":
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        model_kwargs = {"provider": "CPUExecutionProvider", "session_options": options}
+        if onnx_file:
+            model_kwargs["file_name"] = onnx_file
+        return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+    import torch
+    if threads > 0:
+        torch.set_num_threads(threads)
+    model = SentenceTransformer(model_name, device="cpu")
+    if backend == "torch_int8":
+        # Weights stored as int8, activations quantized on the fly; CPU only
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def parity_check(model, reference, texts: List[str] = PARITY_TEXTS) -> Dict:
+    """Cosine agreement between `model`'s and `reference`'s embeddings of the same texts"""
+    a = np.asarray(model.encode(texts, convert_to_numpy=True), dtype='float32')
+    b = np.asarray(reference.encode(texts, convert_to_numpy=True), dtype='float32')
+    cosines = (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+    return {
+        "texts": len(texts),
+        "min_cosine": round(float(cosines.min()), 5),
+        "mean_cosine": round(float(cosines.mean()), 5),
+    }
+
+
+def encode_throughput(model, texts: List[str], batch_size: int = 64, repeats: int = 3) -> Dict:
+    """Texts per second for batched encoding, plus single-text latency (best of `repeats`)"""
+    model.encode(texts[:batch_size], convert_to_numpy=True, batch_size=batch_size)  # warm up
+    batch_seconds = min(_timed(lambda: model.encode(texts, convert_to_numpy=True, batch_size=batch_size))
+                        for _ in range(repeats))
+    single_ms = [_timed(lambda: model.encode(text, convert_to_numpy=True)) * 1000 for text in texts[:100]]
+    return {
+        "texts": len(texts),
+        "batch_size": batch_size,
+        "texts_per_second": round(len(texts) / batch_seconds, 1),
+        "single_p50_ms": round(float(np.percentile(single_ms, 50)), 3),
+        "single_p95_ms": round(float(np.percentile(single_ms, 95)), 3),
+    }
+
+
+def _timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def backend_model_name(model_name: str, backend: str, onnx_file: str = "") -> str:
+    """Model identity for embedding cache keys and snapshot manifests.
+
+    Quantized backends produce slightly different vectors than the fp32
+    model, so their embeddings are cached and snapshotted separately.
+    """
+    if backend == "torch":
+        return model_name
+    if backend == "onnx" and onnx_file:
+        return f"{model_name}@onnx:{onnx_file}"
+    return f"{model_name}@{backend}"
+
+
+
+def token_lengths(model, texts: List[str]) -> np.ndarray:
+    """Estimated tokens per text, capped at the model's max_seq_length.
+
+    About 4 characters per WordPiece token; close enough to bucket by, and
+    unlike running the tokenizer it doesn't make the parent process a
+    bottleneck in front of the workers.
+    """
+    max_length = getattr(model, "max_seq_length", None) or 512
+    chars = np.fromiter(map(len, texts), dtype='int64', count=len(texts))
+    return np.minimum(chars // 4 + 2, max_length)
+
+
+def length_batches(lengths: np.ndarray, token_budget: int, max_batch: int) -> List[np.ndarray]:
+    """Row indices grouped into batches of similar length, longest first.
+
+    A batch is padded to its longest text, so each batch holds at most
+    `token_budget // longest` texts (and at most `max_batch`).
+    """
+    order = np.argsort(-lengths, kind='stable')
+    batches, start = [], 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        size = min(max(token_budget // longest, 1), max_batch)
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+# Worker process state for EncoderPool
+_worker_model = None
+
+
+def _init_worker(model_name: str, backend: str, threads: int, onnx_file: str):
+    global _worker_model
+    _worker_model = load_encoder(model_name, backend, threads, onnx_file)
+
+
+def _encode_batch(texts: List[str]) -> Tuple[np.ndarray, float]:
+    started = time.perf_counter()
+    vectors = _worker_model.encode(texts, convert_to_numpy=True, batch_size=len(texts))
+    return np.asarray(vectors, dtype='float32'), time.perf_counter() - started
+
+
+class PendingEmbeddings:
+    """Embeddings of one `EncoderPool.submit` call, assembled in input order by `result()`"""
+
+    def __init__(self, count: int, dimension: int, parts: List[Tuple[np.ndarray, Future]]):
+        self.count = count
+        self.dimension = dimension
+        self.parts = parts
+        self._embeddings = None
+
+    def result(self) -> np.ndarray:
+        if self._embeddings is None:
+            embeddings = np.empty((self.count, self.dimension), dtype='float32')
+            seconds = 0.0
+            for rows, future in self.parts:
+                vectors, batch_seconds = future.result()
+                embeddings[rows] = vectors
+                seconds += batch_seconds
+            EMBEDDING_SECONDS.inc(seconds, "content")
+            EMBEDDED_TEXTS.inc(self.count, "content")
+            self._embeddings = embeddings
+        return self._embeddings
+
+
+class EncoderPool:
+    """Worker processes each holding a copy of the encoder, fed length-bucketed batches.
+
+    Workers are spawned (not forked), so a parent that has already run torch
+    can't deadlock them; each loads its own model, which takes a few seconds
+    and one model's worth of memory per process, so the pool only pays off
+    for large builds. Batches of one `submit` run in parallel across the
+    workers, and several submits can be in flight at once.
+    """
+
+    def __init__(self, model, model_name: str, backend: str, processes: int, threads: int = 0,
+                 onnx_file: str = "", token_budget: int = 8192, max_batch: int = 256):
+        self.model = model  # local copy, for its max_seq_length and dimension
+        self.processes = processes
+        self.token_budget = token_budget
+        self.max_batch = max_batch
+        self.dimension = model.get_sentence_embedding_dimension()
+        # Split the cores between workers instead of letting each one claim all of them
+        threads = threads or max((os.cpu_count() or 1) // processes, 1)
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(model_name, backend, threads, onnx_file),
+        )
+        logger.info(f"Started {processes} encoder processes ({backend}, {threads} threads each)")
+
+    def submit(self, texts: List[str]) -> PendingEmbeddings:
+        batches = length_batches(token_lengths(self.model, texts), self.token_budget, self.max_batch)
+        parts = [(rows, self._executor.submit(_encode_batch, [texts[i] for i in rows])) for rows in batches]
+        return PendingEmbeddings(len(texts), self.dimension, parts)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def pool_size(processes: int) -> Optional[int]:
+    """EMBEDDING_PROCESSES resolved to a worker count (0 = one per core), or None for in-process encoding"""
+    processes = processes or os.cpu_count() or 1
+    return processes if processes > 1 else None
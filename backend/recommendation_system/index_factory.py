@@ -0,0 +1,357 @@
+import json
+import math
+import os
+import numpy as np
+from typing import Dict, Optional, Tuple
+import logging
+from lazy_imports import lazy_import
+from config import (
+    INDEX_TYPE, INDEX_MEMORY_BUDGET_MB, INDEX_NLIST, INDEX_NPROBE,
+    INDEX_HNSW_M, INDEX_HNSW_EF_CONSTRUCTION, INDEX_HNSW_EF_SEARCH, INDEX_PQ_M, INDEX_PQ_NBITS,
+)
+
+faiss = lazy_import("faiss")
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("auto", "flat", "hnsw", "ivf_flat", "ivf_sq8", "ivf_pq")
+
+# Below this many vectors exact search is both fast and perfectly accurate
+FLAT_MAX_VECTORS = 10_000
+
+INDEX_FILE = "index.faiss"
+LABELS_FILE = "labels.npy"
+ANN_META_FILE = "ann.json"
+
+
+def default_index_params() -> Dict:
+    """Index construction parameters from the environment"""
+    return {
+        "index_type": INDEX_TYPE,
+        "memory_budget_mb": INDEX_MEMORY_BUDGET_MB,
+        "nlist": INDEX_NLIST,
+        "nprobe": INDEX_NPROBE,
+        "hnsw_m": INDEX_HNSW_M,
+        "hnsw_ef_construction": INDEX_HNSW_EF_CONSTRUCTION,
+        "hnsw_ef_search": INDEX_HNSW_EF_SEARCH,
+        "pq_m": INDEX_PQ_M,
+        "pq_nbits": INDEX_PQ_NBITS,
+    }
+
+
+def estimate_bytes_per_vector(index_type: str, dimension: int, params: Dict) -> float:
+    """Approximate resident bytes per vector for each index type.
+
+    Includes the exact float32 copy (plus id) that the vector store keeps
+    next to every index, so compressed indexes only shrink the index part.
+    """
+    store = 4 * dimension + 8
+    if index_type == "flat":
+        return store + 4 * dimension + 8  # vector + id map entry
+    if index_type == "hnsw":
+        return store + 4 * dimension + 8 * params["hnsw_m"] + 8  # vector + ~2*M int32 links + label
+    if index_type == "ivf_flat":
+        return store + 4 * dimension + 8
+    if index_type == "ivf_sq8":
+        return store + dimension + 8
+    if index_type == "ivf_pq":
+        return store + pq_code_size(dimension, params) * params["pq_nbits"] / 8 + 8
+    raise ValueError(f"Unknown index type: {index_type}")
+
+
+def pq_code_size(dimension: int, params: Dict) -> int:
+    """Number of PQ sub-quantizers: configured value, or dimension/8 rounded to a divisor"""
+    m = params.get("pq_m") or max(1, dimension // 8)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def choose_index_type(n: int, dimension: int, params: Dict) -> str:
+    """Pick an index type for `n` vectors that fits the memory budget (0 = unlimited).
+
+    Exact search for small catalogues, HNSW when it fits (best latency and
+    recall), then scalar-quantized IVF, then IVF-PQ as the most compact.
+    """
+    budget = params.get("memory_budget_mb", 0) * 1024 * 1024
+    candidates = ["flat"] if n < FLAT_MAX_VECTORS else []
+    candidates += ["hnsw", "ivf_sq8", "ivf_pq"]
+    for index_type in candidates:
+        if not budget or n * estimate_bytes_per_vector(index_type, dimension, params) <= budget:
+            return index_type
+    logger.warning(f"No index type fits {params['memory_budget_mb']} MB for {n} vectors (the float32 vector "
+                   f"store alone needs {n * (4 * dimension + 8) / 2**20:.0f} MB); using ivf_pq")
+    return "ivf_pq"
+
+
+class AnnIndex:
+    """A FAISS index addressed by stable int64 content ids, whatever its type.
+
+    - flat: IndexIDMap2 over IndexFlat (exact, supports removal)
+    - ivf_*: IVF index storing the content ids natively (hashtable direct map
+      so removals don't scan every list)
+    - hnsw: HNSW cannot remove vectors, so it keeps its own internal->content
+      id labels; replaced/removed entries are tombstoned and masked out of
+      searches with a bitmap selector until the next rebuild.
+
+    Read from a snapshot with mmap, the index data stays in the page cache
+    shared by every process mapping the file (`mapped`); without faiss'
+    in-place mmap support flat and HNSW indexes are private copies instead.
+    """
+
+    def __init__(self, index, index_type: str, metric: str, params: Dict,
+                 labels: Optional[np.ndarray] = None, mapped: bool = False):
+        self.index = index
+        self.index_type = index_type
+        self.metric = metric
+        self.params = params
+        self.mapped = mapped
+        self._labels = None  # internal id -> content id, -1 when tombstoned (hnsw only)
+        self._live = None  # content id -> internal id (hnsw only), built on the first update
+        self._live_count = 0
+        self._bitmap = None
+        self._selector = None
+        if index_type == "hnsw":
+            self._labels = labels if labels is not None else np.empty(0, dtype='int64')
+            self._live_count = int(np.count_nonzero(self._labels >= 0))
+
+    @classmethod
+    def create(cls, dimension: int, expected_total: int, metric: str, params: Dict) -> "AnnIndex":
+        index_type = params.get("index_type", "auto")
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {index_type}")
+        if index_type == "auto":
+            index_type = choose_index_type(expected_total, dimension, params)
+        if index_type == "ivf_pq" and expected_total < (1 << params["pq_nbits"]) * 39:
+            # Not enough vectors to train the PQ codebooks
+            logger.warning(f"Catalogue too small for ivf_pq ({expected_total} vectors), using ivf_sq8")
+            index_type = "ivf_sq8"
+        faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "cosine" else faiss.METRIC_L2
+
+        if index_type == "flat":
+            base = faiss.IndexFlatIP(dimension) if metric == "cosine" else faiss.IndexFlatL2(dimension)
+            index = faiss.IndexIDMap2(base)
+        elif index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dimension, params["hnsw_m"], faiss_metric)
+            index.hnsw.efConstruction = params["hnsw_ef_construction"]
+            index.hnsw.efSearch = params["hnsw_ef_search"]
+        else:
+            nlist = params.get("nlist") or int(min(65536, max(16, 4 * math.sqrt(max(expected_total, 1)))))
+            nlist = max(1, min(nlist, expected_total // 39 or 1))  # k-means needs ~39 points per centroid
+            encoding = {
+                "ivf_flat": "Flat",
+                "ivf_sq8": "SQ8",
+                "ivf_pq": f"PQ{pq_code_size(dimension, params)}x{params['pq_nbits']}",
+            }[index_type]
+            index = faiss.index_factory(dimension, f"IVF{nlist},{encoding}", faiss_metric)
+            index.nprobe = min(params["nprobe"], nlist)
+
+        ann = cls(index, index_type, metric, params)
+        logger.info(f"Created {index_type} index ({type(ann.base_index).__name__}) for ~{expected_total} vectors")
+        return ann
+
+    @property
+    def base_index(self):
+        return faiss.downcast_index(self.index.index) if self.index_type == "flat" else self.index
+
+    @property
+    def is_trained(self) -> bool:
+        return self.index.is_trained
+
+    @property
+    def train_size(self) -> int:
+        """Vectors to buffer before training (0 when no training is needed)"""
+        if self.is_trained:
+            return 0
+        ivf = faiss.extract_index_ivf(self.index)
+        size = ivf.nlist * 64
+        if self.index_type == "ivf_pq":
+            size = max(size, (1 << self.params["pq_nbits"]) * 64)
+        return size
+
+    @property
+    def ntotal(self) -> int:
+        """Number of live (searchable) vectors"""
+        if self._labels is not None:
+            return self._live_count
+        return self.index.ntotal
+
+    def train(self, vectors: np.ndarray):
+        if self.is_trained:
+            return
+        ivf = faiss.extract_index_ivf(self.index)
+        logger.info(f"Training {self.index_type} index with {ivf.nlist} clusters on {len(vectors)} vectors")
+        self.index.train(vectors)
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        """Add or replace vectors by content id"""
+        ids = np.ascontiguousarray(ids, dtype='int64')
+        if self._labels is None:
+            self.remove(ids)
+            self.index.add_with_ids(vectors, ids)
+            return
+        self._tombstone(ids)
+        start = self.index.ntotal
+        self.index.add(vectors)
+        self._labels = np.concatenate([self._labels, ids])
+        live = self._live_map()
+        for offset, content_id in enumerate(ids.tolist()):
+            live[content_id] = start + offset
+        self._live_count = len(live)
+        self._bitmap = None
+
+    def remove(self, ids: np.ndarray) -> int:
+        ids = np.ascontiguousarray(ids, dtype='int64')
+        if len(ids) == 0:
+            return 0
+        if self._labels is not None:
+            return self._tombstone(ids)
+        if self.index_type == "flat":
+            return self.index.remove_ids(ids)
+        # Hashtable direct maps only accept an explicit id array
+        return self.index.remove_ids(faiss.IDSelectorArray(len(ids), faiss.swig_ptr(ids)))
+
+    def _tombstone(self, ids: np.ndarray) -> int:
+        live = self._live_map()
+        if not self._labels.flags.writeable:
+            self._labels = np.array(self._labels)
+        removed = 0
+        for content_id in ids.tolist():
+            internal = live.pop(content_id, None)
+            if internal is not None:
+                self._labels[internal] = -1
+                removed += 1
+        if removed:
+            self._live_count = len(live)
+            self._bitmap = None
+        return removed
+
+    def _live_map(self) -> Dict[int, int]:
+        # Only updates need it; searches work off the (possibly memory-mapped) labels
+        if self._live is None:
+            live_ids = np.flatnonzero(self._labels >= 0)
+            self._live = dict(zip(self._labels[live_ids].tolist(), live_ids.tolist()))
+        return self._live
+
+    def search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None, selector=None):
+        """Per-query search parameters (recall/speed overrides, id filter and tombstone mask)"""
+        if self.index_type.startswith("ivf"):
+            ivf = faiss.extract_index_ivf(self.index)
+            params = faiss.SearchParametersIVF(nprobe=min(nprobe or ivf.nprobe, ivf.nlist))
+        elif self.index_type == "hnsw":
+            params = faiss.SearchParametersHNSW(efSearch=ef_search or self.index.hnsw.efSearch)
+            if selector is None and self._live_count < self.index.ntotal:
+                selector = self._tombstone_selector()
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        if selector is not None:
+            params.sel = selector
+        return params
+
+    def id_selector(self, ids: np.ndarray):
+        """Selector restricting searches to the given content ids.
+
+        IVF and flat indexes are addressed by content id directly; HNSW gets a
+        bitmap over its internal ids (live entries only, so tombstones stay hidden).
+        """
+        ids = np.ascontiguousarray(ids, dtype='int64')
+        if self._labels is None:
+            return faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+        mask = np.isin(self._labels, ids)  # tombstones are -1, never a content id
+        bitmap = np.packbits(mask, bitorder='little')
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        selector.referenced_objects = [bitmap]  # keep the bitmap alive as long as the selector
+        return selector
+
+    def _tombstone_selector(self):
+        if self._bitmap is None:
+            self._bitmap = np.packbits(self._labels >= 0, bitorder='little')
+            self._selector = faiss.IDSelectorBitmap(len(self._labels), faiss.swig_ptr(self._bitmap))
+        return self._selector
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, selector=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (distances, content ids); missing results have id -1.
+
+        `selector` (from `id_selector`) limits results to a subset of the items.
+        """
+        params = self.search_params(nprobe, ef_search, selector)
+        if params is None:
+            distances, ids = self.index.search(queries, k)
+        else:
+            distances, ids = self.index.search(queries, k, params=params)
+        if self._labels is not None:
+            ids = np.where(ids >= 0, self._labels[np.maximum(ids, 0)], -1)
+        return distances, ids
+
+    def clone(self) -> "AnnIndex":
+        """In-memory copy (e.g. of a read-only memory-mapped index)"""
+        if self.index_type.startswith("ivf"):
+            self._load_inverted_lists()
+        index = faiss.deserialize_index(faiss.serialize_index(self.index))
+        labels = None if self._labels is None else np.array(self._labels)
+        return AnnIndex(index, self.index_type, self.metric, self.params, labels)
+
+    def _load_inverted_lists(self):
+        """Swap memory-mapped (on-disk) IVF lists for in-memory ones, which can be serialized and modified"""
+        ivf = faiss.extract_index_ivf(self.index)
+        source = faiss.downcast_InvertedLists(ivf.invlists)
+        if isinstance(source, faiss.ArrayInvertedLists):
+            return
+        invlists = faiss.ArrayInvertedLists(ivf.nlist, ivf.code_size)
+        for list_no in range(ivf.nlist):
+            size = source.list_size(list_no)
+            if size:
+                invlists.add_entries(list_no, size, source.get_ids(list_no), source.get_codes(list_no))
+        ivf.replace_invlists(invlists, True)
+        invlists.this.disown()
+
+    def describe(self) -> Dict:
+        info = {"type": self.index_type, "metric": self.metric, "faiss_class": type(self.base_index).__name__}
+        if self.index_type.startswith("ivf"):
+            ivf = faiss.extract_index_ivf(self.index)
+            info.update(nlist=ivf.nlist, nprobe=ivf.nprobe)
+        elif self.index_type == "hnsw":
+            info.update(M=self.params["hnsw_m"], efSearch=self.index.hnsw.efSearch,
+                        tombstones=int(self.index.ntotal - self._live_count))
+        info["mapped"] = self.mapped
+        return info
+
+    def write(self, path: str):
+        faiss.write_index(self.index, os.path.join(path, INDEX_FILE))
+        if self._labels is not None:
+            np.save(os.path.join(path, LABELS_FILE), self._labels)
+        with open(os.path.join(path, ANN_META_FILE), "w") as f:
+            json.dump({"index_type": self.index_type, "metric": self.metric, "params": self.params}, f)
+
+    @classmethod
+    def read(cls, path: str, mmap: bool = True) -> "AnnIndex":
+        with open(os.path.join(path, ANN_META_FILE)) as f:
+            meta = json.load(f)
+        index_path = os.path.join(path, INDEX_FILE)
+        index = None
+        if mmap:
+            # IVF lists map as on-disk inverted lists; flat and HNSW need in-place mmap (faiss>=1.11),
+            # IO_FLAG_MMAP alone would silently read them into memory
+            if meta["index_type"].startswith("ivf"):
+                flag = faiss.IO_FLAG_MMAP
+            else:
+                flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+            try:
+                if flag is not None:
+                    index = faiss.read_index(index_path, flag | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                logger.info(f"mmap read failed: {e}")
+            if index is None:
+                logger.warning(f"This faiss build can't memory-map {meta['index_type']} indexes; "
+                               f"every process reading the snapshot holds a private copy")
+        mapped = index is not None
+        if index is None:
+            index = faiss.read_index(index_path)
+        labels = None
+        if meta["index_type"] == "hnsw":
+            labels = np.load(os.path.join(path, LABELS_FILE), mmap_mode='r' if mmap else None)
+        return cls(index, meta["index_type"], meta["metric"], meta["params"], labels, mapped=mapped)
@@ -0,0 +1,91 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class IndexJobManager:
+    """Runs index rebuilds on a single background worker thread.
+
+    Only one rebuild runs at a time: submitting while one is queued or
+    running returns the existing job instead of starting another. Job state
+    is kept in memory for the last `max_history` jobs so clients can poll it.
+    """
+
+    def __init__(self, max_history: int = 20):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-rebuild")
+        self._jobs = OrderedDict()
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._max_history = max_history
+
+    def submit(self, build_fn: Callable[[Callable[[int, int], None]], Dict]) -> Dict:
+        """Schedule `build_fn(progress)`; its return value becomes the job result"""
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job["status"] in ("queued", "running"):
+                    return dict(job)
+            job_id = uuid.uuid4().hex[:12]
+            job = {
+                "job_id": job_id,
+                "status": "queued",
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "progress": {"processed": 0, "total": None},
+                "result": None,
+                "error": None,
+            }
+            self._jobs[job_id] = job
+            while len(self._jobs) > self._max_history:
+                old_id, _ = self._jobs.popitem(last=False)
+                self._futures.pop(old_id, None)
+            self._futures[job_id] = self._executor.submit(self._run, job_id, build_fn)
+            return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job, progress=dict(job["progress"])) if job else None
+
+    def future(self, job_id: str) -> Optional[Future]:
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def latest(self) -> Optional[Dict]:
+        with self._lock:
+            if not self._jobs:
+                return None
+            job = next(reversed(self._jobs.values()))
+            return dict(job, progress=dict(job["progress"]))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job_id: str, build_fn: Callable) -> Dict:
+        self._update(job_id, status="running", started_at=time.time())
+        logger.info(f"Index rebuild job {job_id} started")
+
+        def progress(processed: int, total: int):
+            self._update(job_id, progress={"processed": processed, "total": total})
+
+        try:
+            result = build_fn(progress)
+        except Exception as e:
+            logger.error(f"Index rebuild job {job_id} failed: {e}")
+            self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+            raise
+        self._update(job_id, status="succeeded", result=result, finished_at=time.time())
+        logger.info(f"Index rebuild job {job_id} finished")
+        return result
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
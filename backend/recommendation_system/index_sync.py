@@ -0,0 +1,312 @@
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import logging
+from pymongo.errors import OperationFailure, PyMongoError
+from ingest import CONTENT_FIELDS, CONTENT_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+
+def _mongo_now() -> datetime:
+    """Current UTC time truncated to the millisecond precision MongoDB stores dates with"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+class IndexWatcher:
+    """Keeps the live recommender in sync with the content collections.
+
+    Uses a MongoDB change stream when the server supports it (replica sets),
+    otherwise falls back to polling. Polling is a degraded mode: inserts are
+    picked up via `_id`, but edits only for documents whose writers set
+    `updatedAt` (the app's courses, blogs and forums don't), and deletes only
+    on the next id sweep, a full `_id` scan of every collection each
+    `sweep_interval`. Changes are applied in small batches through
+    `update_index` / `remove_from_index`, so no rebuild is needed.
+
+    The resume token of the last change applied to a recommender is stored
+    on it (`sync_token`) and saved with its snapshots, so after a restart the
+    stream resumes from the snapshot actually served, never from a later
+    point. When that position has fallen off the oplog, `on_stale` is called
+    so the caller can rebuild the index.
+
+    `get_recommender` is called for every batch so a recommender swapped in
+    by a rebuild is picked up automatically.
+    """
+
+    def __init__(self, db, collections: Dict[str, str], get_recommender: Callable,
+                 poll_interval: float = 5.0, sweep_interval: float = 30.0,
+                 on_stale: Optional[Callable[[], None]] = None, max_batch: int = 256,
+                 batch_window: float = 0.5):
+        self.db = db
+        # collection name -> content_type
+        self.collections = {name: ctype for ctype, name in collections.items() if name}
+        self.get_recommender = get_recommender
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.on_stale = on_stale
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.mode = None  # "change_stream" or "polling" once running
+        self.applied_changes = 0
+        self._recorded = None  # _id -> latest document (None if deleted) while a rebuild runs
+        self._token = None  # resume token of the last change applied or recorded
+        self._stale = False  # the live index missed changes; don't stamp it with newer tokens
+        self._apply_lock = threading.Lock()
+        self._poll_since = None
+        self._newest_ids = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        # Take the polling baseline now so changes made while the thread spins up aren't missed
+        self._capture_poll_baseline()
+        self._thread = threading.Thread(target=self._run, name="index-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            self._watch_change_stream()
+        except (OperationFailure, NotImplementedError) as e:
+            # Standalone mongod (no replica set) and mongomock don't support change streams
+            logger.warning(f"Change streams unavailable ({e}); polling every {self.poll_interval}s instead: "
+                           f"edits to documents without updatedAt are not synced and deletes only land "
+                           f"on the id sweep every {self.sweep_interval}s (run MongoDB as a replica set)")
+            self._poll()
+        except Exception as e:
+            logger.error(f"Index watcher stopped: {e}")
+
+    # ------------------------------------------------------------------
+    # Change streams
+    # ------------------------------------------------------------------
+
+    def _pipeline(self) -> List[Dict]:
+        return [{"$match": {
+            "ns.coll": {"$in": list(self.collections)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+        }}, {"$project": {
+            "operationType": 1, "ns": 1, "documentKey": 1, "fullDocument._id": 1,
+            **{f"fullDocument.{field}": 1 for field in CONTENT_FIELDS},
+        }}]
+
+    def current_token(self):
+        """Resume token for the present, to stamp an index about to be built; None without change streams"""
+        if not hasattr(type(self.db), "watch"):
+            return None
+        try:
+            with self.db.watch(self._pipeline(), max_await_time_ms=1) as stream:
+                return stream.resume_token
+        except PyMongoError as e:
+            logger.info(f"No change stream position available: {e}")
+            return None
+
+    def _watch_change_stream(self):
+        if not hasattr(type(self.db), "watch"):
+            raise NotImplementedError("database client has no change stream support")
+        pipeline = self._pipeline()
+        recommender = self.get_recommender()
+        resume_token = recommender.sync_token if recommender is not None else None
+        rebuild = False
+        while not self._stop.is_set():
+            try:
+                with self.db.watch(pipeline, full_document="updateLookup",
+                                   resume_after=resume_token, max_await_time_ms=500) as stream:
+                    self.mode = "change_stream"
+                    logger.info("👀 Watching content collections via change stream")
+                    with self._apply_lock:
+                        if self._token is None:
+                            self._token = resume_token if resume_token is not None else stream.resume_token
+                    if rebuild:
+                        # Only now: a rebuild reading the catalogue from here misses nothing
+                        rebuild = False
+                        if self.on_stale is not None:
+                            self.on_stale()
+                    while not self._stop.is_set() and stream.alive:
+                        events = self._next_batch(stream)
+                        if events:
+                            resume_token = stream.resume_token
+                            self._apply_events(events, resume_token)
+            except OperationFailure as e:
+                if resume_token is None and self.mode is None:
+                    raise
+                # e.g. the resume token fell off the oplog: the changes since are lost to this index
+                logger.warning(f"Change stream can't resume ({e}); the index must be rebuilt")
+                resume_token = None
+                rebuild = True
+                self._mark_stale()
+            except PyMongoError as e:
+                logger.warning(f"Change stream error ({e}); retrying")
+                self._stop.wait(self.poll_interval)
+
+    def _next_batch(self, stream) -> List[Dict]:
+        events = []
+        deadline = time.monotonic() + self.batch_window
+        while len(events) < self.max_batch and not self._stop.is_set():
+            event = stream.try_next()
+            if event is not None:
+                events.append(event)
+            elif events and time.monotonic() >= deadline:
+                break
+            elif not events:
+                # Nothing pending: keep the stream open without spinning
+                return events
+        return events
+
+    def _apply_events(self, events: List[Dict], token=None):
+        upserts = {}
+        deletes = {}
+        for event in events:
+            content_type = self.collections.get(event["ns"]["coll"])
+            object_id = event["documentKey"]["_id"]
+            if event["operationType"] == "delete":
+                upserts.pop(object_id, None)
+                deletes[object_id] = True
+            else:
+                doc = event.get("fullDocument")
+                if doc is None:
+                    # Document was deleted before the lookup ran
+                    deletes[object_id] = True
+                    continue
+                doc["content_type"] = content_type
+                deletes.pop(object_id, None)
+                upserts[object_id] = doc
+        self._apply(list(upserts.values()), list(deletes), token)
+
+    def _mark_stale(self):
+        """The live index missed changes: drop its position until a rebuild replaces it"""
+        with self._apply_lock:
+            self._stale = True
+            self._token = None
+            recommender = self.get_recommender()
+            if recommender is not None:
+                # Snapshots of it must not claim to be current
+                recommender.sync_token = None
+
+    # ------------------------------------------------------------------
+    # Polling fallback
+    # ------------------------------------------------------------------
+
+    def _capture_poll_baseline(self):
+        self._poll_since = _mongo_now()
+        for coll_name in self.collections:
+            newest = self.db[coll_name].find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            self._newest_ids[coll_name] = newest["_id"] if newest else None
+
+    def _poll(self):
+        self.mode = "polling"
+        since = self._poll_since
+        newest_ids = self._newest_ids
+        last_sweep = time.monotonic()
+
+        while not self._stop.wait(self.poll_interval):
+            try:
+                poll_started = _mongo_now()
+                upserts = []
+                for coll_name, content_type in self.collections.items():
+                    # $gte: writes in the same millisecond as the last poll may not have been seen
+                    query = {"updatedAt": {"$gte": since}}
+                    if newest_ids[coll_name] is not None:
+                        query = {"$or": [query, {"_id": {"$gt": newest_ids[coll_name]}}]}
+                    else:
+                        query = {}
+                    for doc in self.db[coll_name].find(query, CONTENT_PROJECTION):
+                        doc["content_type"] = content_type
+                        upserts.append(doc)
+                        if newest_ids[coll_name] is None or doc["_id"] > newest_ids[coll_name]:
+                            newest_ids[coll_name] = doc["_id"]
+                since = poll_started
+
+                deletes = []
+                if time.monotonic() - last_sweep >= self.sweep_interval:
+                    deletes = self._sweep_deleted()
+                    last_sweep = time.monotonic()
+
+                self._apply(upserts, deletes)
+            except PyMongoError as e:
+                logger.warning(f"Polling for content changes failed: {e}")
+
+    def _sweep_deleted(self) -> List:
+        """Ids that are indexed but no longer exist in their collection"""
+        recommender = self.get_recommender()
+        if recommender is None or not recommender.is_trained:
+            return []
+        deleted = []
+        for coll_name, content_type in self.collections.items():
+            existing = {doc["_id"] for doc in self.db[coll_name].find({}, {"_id": 1})}
+            indexed = set(recommender.object_ids_for_type(content_type))
+            deleted.extend(indexed - existing)
+        return deleted
+
+    # ------------------------------------------------------------------
+
+    def start_recording(self):
+        """Remember changes applied from now on so they can be replayed onto a rebuilt index"""
+        with self._apply_lock:
+            self._recorded = {}
+
+    def stop_recording(self):
+        with self._apply_lock:
+            self._recorded = None
+
+    def replay_and_swap(self, new_recommender, swap: Callable):
+        """Apply the recorded changes to `new_recommender`, then call `swap(new_recommender)`.
+
+        Runs under the apply lock, so no change can land on the old recommender
+        between the replay and the swap.
+        """
+        with self._apply_lock:
+            recorded = self._recorded or {}
+            self._recorded = None
+            upserts = [doc for doc in recorded.values() if doc is not None]
+            deletes = [object_id for object_id, doc in recorded.items() if doc is None]
+            if deletes:
+                new_recommender.remove_from_index(deletes)
+            if upserts:
+                new_recommender.update_index(upserts)
+            # Recording started before the build read the catalogue, so the replay brings it up to _token
+            new_recommender.sync_token = self._token
+            self._stale = False
+            if upserts or deletes:
+                logger.info(f"Replayed {len(upserts)} upserts, {len(deletes)} deletes onto rebuilt index")
+            swap(new_recommender)
+
+    def _apply(self, upserts: List[Dict], deletes: List, token=None):
+        if not upserts and not deletes:
+            return
+        with self._apply_lock:
+            if token is not None:
+                self._token = token
+            if self._recorded is not None:
+                # Deletes are applied before upserts below, so record them first too
+                for object_id in deletes:
+                    self._recorded[object_id] = None
+                for doc in upserts:
+                    self._recorded[doc["_id"]] = doc
+            recommender = self.get_recommender()
+            if recommender is None or not recommender.is_trained:
+                return
+            if deletes:
+                recommender.remove_from_index(deletes)
+            if upserts:
+                recommender.update_index(upserts)
+            if token is not None and not self._stale:
+                recommender.sync_token = token
+        self.applied_changes += len(upserts) + len(deletes)
+        logger.info(f"Index synced: {len(upserts)} upserts, {len(deletes)} deletes")
+
+    def get_stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "running": bool(self._thread and self._thread.is_alive()),
+            "applied_changes": self.applied_changes,
+        }
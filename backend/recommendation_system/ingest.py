@@ -0,0 +1,49 @@
+from typing import Dict, Iterator, List
+import logging
+from config import CHUNKING_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# Long text bodies read by EmbeddingGenerator.create_chunk_texts: blog posts and course chapters
+CHUNK_BODY_FIELDS = ["content", "chapters.title", "chapters.transcription"]
+
+# Only the fields read by EmbeddingGenerator.create_content_text and the
+# /api/recommend response builder (plus the long bodies when chunking);
+# comments etc. stay in Mongo.
+CONTENT_FIELDS = [
+    "title", "description", "desc", "tags", "labels", "category",
+    "author", "creator", "difficulty", "images.cover_image", "image",
+    "duration_hours", "views", "replies", "language",
+] + (CHUNK_BODY_FIELDS if CHUNKING_ENABLED else [])
+CONTENT_PROJECTION = {field: 1 for field in CONTENT_FIELDS}
+
+
+def count_contents(db, collections: Dict[str, str]) -> int:
+    """Total number of documents across the content collections"""
+    return sum(db[name].count_documents({}) for name in collections.values() if name)
+
+
+def iter_content_batches(db, collections: Dict[str, str], batch_size: int = 512) -> Iterator[List[Dict]]:
+    """Stream projected content documents in fixed-size batches, tagged with their content_type.
+
+    `collections` maps content_type -> collection name. Cursors are read in
+    `batch_size` chunks, so memory stays bounded by one batch regardless of
+    collection size.
+    """
+    for content_type, coll_name in collections.items():
+        if not coll_name:
+            continue
+        cursor = db[coll_name].find({}, CONTENT_PROJECTION, batch_size=batch_size)
+        batch = []
+        loaded = 0
+        for doc in cursor:
+            doc['content_type'] = content_type
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                loaded += len(batch)
+                yield batch
+                batch = []
+        if batch:
+            loaded += len(batch)
+            yield batch
+        logger.info(f"Streamed {loaded} {content_type} documents from {coll_name}")
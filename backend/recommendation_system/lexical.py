@@ -0,0 +1,291 @@
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_DIR = "lexical"
+LEXICAL_META_FILE = "lexical.json"
+ARRAY_NAMES = ("terms", "offsets", "rows", "tfs", "doc_ids", "doc_lengths")
+
+# Longer tokens are truncated so terms fit a fixed-width byte array
+MAX_TERM_BYTES = 32
+TERM_DTYPE = f'S{MAX_TERM_BYTES}'
+
+# English and French function words (the catalogue is mixed)
+STOPWORDS = frozenset("""
+a an and are as at be by for from how in into is it its of on or the this to with your you
+au aux avec ce ces cette dans de des du en est et il la le les leur l d un une ou par pour qui que sur son sa ses vos votre
+""".split())
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[bytes]:
+    """Lowercased, accent-folded word tokens as UTF-8 bytes, stop words dropped.
+
+    Accents are folded so "débutant" matches "debutant"; there is no stemming.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [token.encode()[:MAX_TERM_BYTES] for token in _TOKEN.findall(text) if token not in STOPWORDS]
+
+
+class LexicalIndexBuilder:
+    """Collects postings batch by batch during a streaming index build"""
+
+    def __init__(self):
+        self._doc_ids, self._lengths = [], []
+        self._docs, self._terms, self._tfs = [], [], []
+        self._count = 0
+
+    def add(self, ids: Sequence[int], texts: Sequence[str]):
+        docs, terms, tfs, lengths = [], [], [], []
+        for seq, text in enumerate(texts, self._count):
+            counts = Counter(tokenize(text))
+            docs.extend([seq] * len(counts))
+            terms.extend(counts)
+            tfs.extend(counts.values())
+            lengths.append(sum(counts.values()))
+        self._count += len(texts)
+        self._doc_ids.append(np.asarray(ids, dtype='int64'))
+        self._lengths.append(np.array(lengths, dtype='uint32'))
+        self._docs.append(np.array(docs, dtype='int64'))
+        self._terms.append(np.array(terms, dtype=TERM_DTYPE))
+        self._tfs.append(np.array(tfs, dtype='uint32'))
+
+    def build(self, k1: float = 1.2, b: float = 0.75) -> "LexicalIndex":
+        def concat(parts, dtype):
+            return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+        return LexicalIndex.assemble(
+            concat(self._doc_ids, 'int64'), concat(self._lengths, 'uint32'), concat(self._docs, 'int64'),
+            concat(self._terms, TERM_DTYPE), concat(self._tfs, 'uint32'), k1, b,
+        )
+
+
+class LexicalIndex:
+    """In-process BM25 inverted index over the same text the embeddings are built from.
+
+    Postings are stored CSR-style: a sorted fixed-width `terms` array, an
+    `offsets` array into the `rows` (int32 document rows) and `tfs` (uint16
+    term frequencies) postings arrays, plus the documents' sorted content ids
+    and token counts. Terms are found by binary search, so there is no
+    per-term Python object and every array can be memory-mapped from a
+    snapshot. Items added after the build live in a small overlay of term
+    counters and removed rows are masked until the next `freeze()`.
+    """
+
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, rows: np.ndarray, tfs: np.ndarray,
+                 doc_ids: np.ndarray, doc_lengths: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self._overlay = {}  # content id -> (term counts, length) for documents not in the base arrays
+        self._dead = None  # bool mask of removed base rows, allocated on the first removal
+        self._docs = len(doc_ids)
+        self._total_length = int(doc_lengths.sum())
+
+    def __len__(self) -> int:
+        return self._docs
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(getattr(self, name).nbytes for name in ARRAY_NAMES))
+
+    @classmethod
+    def assemble(cls, doc_ids: np.ndarray, lengths: np.ndarray, posting_docs: np.ndarray, posting_terms: np.ndarray,
+                 posting_tfs: np.ndarray, k1: float, b: float) -> "LexicalIndex":
+        """Build the CSR arrays from flat postings (`posting_docs` index into `doc_ids`).
+
+        A content id that occurs more than once keeps its last document.
+        """
+        _, last = np.unique(doc_ids[::-1], return_index=True)
+        kept = np.sort(len(doc_ids) - 1 - last)
+        kept = kept[np.argsort(doc_ids[kept], kind='stable')]
+        row_of_doc = np.full(len(doc_ids), -1, dtype='int64')
+        row_of_doc[kept] = np.arange(len(kept))
+
+        rows = row_of_doc[posting_docs]
+        valid = rows >= 0
+        rows = rows[valid]
+        terms, term_ids = np.unique(posting_terms[valid], return_inverse=True)
+        order = np.lexsort((rows, term_ids))
+        offsets = np.searchsorted(term_ids[order], np.arange(len(terms) + 1)).astype('int64')
+        tfs = np.minimum(posting_tfs[valid][order], np.iinfo('uint16').max).astype('uint16')
+        return cls(terms.astype(TERM_DTYPE), offsets, rows[order].astype('int32'), tfs,
+                   doc_ids[kept], lengths[kept].astype('uint32'), k1, b)
+
+    def _row(self, content_id: int) -> Optional[int]:
+        row = int(np.searchsorted(self.doc_ids, content_id))
+        if row < len(self.doc_ids) and self.doc_ids[row] == content_id and (self._dead is None or not self._dead[row]):
+            return row
+        return None
+
+    def upsert(self, content_id: int, text: str):
+        self.remove([content_id])
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        self._overlay[content_id] = (counts, length)
+        self._docs += 1
+        self._total_length += length
+
+    def remove(self, content_ids: Iterable[int]):
+        for content_id in content_ids:
+            entry = self._overlay.pop(content_id, None)
+            if entry is not None:
+                self._docs -= 1
+                self._total_length -= entry[1]
+                continue
+            row = self._row(content_id)
+            if row is not None:
+                if self._dead is None:
+                    self._dead = np.zeros(len(self.doc_ids), dtype=bool)
+                self._dead[row] = True
+                self._docs -= 1
+                self._total_length -= int(self.doc_lengths[row])
+
+    def search(self, text: str, k: int, allowed: Optional[np.ndarray] = None,
+               exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top k (content ids, BM25 scores) for a query, best first.
+
+        `allowed` (sorted ids) restricts the candidates, `exclude` removes some.
+        """
+        terms = set(tokenize(text))
+        if not terms or not self._docs or k <= 0:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+        avgdl = max(self._total_length / self._docs, 1e-9)
+
+        row_parts, score_parts = [], []
+        overlay_scores = Counter()
+        for term in terms:
+            t = int(np.searchsorted(self.terms, term))
+            start, end = (int(self.offsets[t]), int(self.offsets[t + 1])) if t < len(self.terms) and self.terms[t] == term else (0, 0)
+            overlay_hits = [(content_id, counts[term], length) for content_id, (counts, length) in self._overlay.items()
+                            if term in counts]
+            rows = self.rows[start:end]
+            df = end - start + len(overlay_hits)
+            if self._dead is not None and end > start:
+                df -= int(np.count_nonzero(self._dead[rows]))
+            if not df:
+                continue
+            idf = math.log(1.0 + (self._docs - df + 0.5) / (df + 0.5))
+            if end > start:
+                tf = self.tfs[start:end].astype('float32')
+                norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[rows] / avgdl)
+                row_parts.append(rows)
+                score_parts.append(idf * tf * (self.k1 + 1.0) / (tf + norm))
+            for content_id, tf, length in overlay_hits:
+                norm = self.k1 * (1.0 - self.b + self.b * length / avgdl)
+                overlay_scores[content_id] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+
+        ids = np.empty(0, dtype='int64')
+        scores = np.empty(0, dtype='float32')
+        if row_parts:
+            rows, inverse = np.unique(np.concatenate(row_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype('float32')
+            if self._dead is not None:
+                live = ~self._dead[rows]
+                rows, scores = rows[live], scores[live]
+            ids = self.doc_ids[rows]
+        if overlay_scores:
+            ids = np.concatenate([ids, np.fromiter(overlay_scores.keys(), dtype='int64', count=len(overlay_scores))])
+            scores = np.concatenate([scores, np.fromiter(overlay_scores.values(), dtype='float32', count=len(overlay_scores))])
+
+        keep = np.ones(len(ids), dtype=bool)
+        if allowed is not None:
+            keep &= np.isin(ids, allowed)
+        if exclude is not None:
+            keep &= ~np.isin(ids, exclude)
+        ids, scores = ids[keep], scores[keep]
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.lexsort((ids, -scores))
+        return ids[order], scores[order]
+
+    def freeze(self) -> "LexicalIndex":
+        """Fold the overlay and removals into the base arrays"""
+        if not self._overlay and self._dead is None:
+            return self
+        alive = np.ones(len(self.doc_ids), dtype=bool) if self._dead is None else ~self._dead
+        alive_rows = np.flatnonzero(alive)
+        doc_of_row = np.full(len(self.doc_ids), -1, dtype='int64')
+        doc_of_row[alive_rows] = np.arange(len(alive_rows))
+
+        base_terms = np.repeat(np.arange(len(self.terms)), np.diff(self.offsets))
+        live_postings = alive[self.rows]
+        overlay = list(self._overlay.items())
+        overlay_docs = [len(alive_rows) + j for j, (_, (counts, _)) in enumerate(overlay) for _ in counts]
+        overlay_terms = [term for _, (counts, _) in overlay for term in counts]
+        overlay_tfs = [tf for _, (counts, _) in overlay for tf in counts.values()]
+
+        table = LexicalIndex.assemble(
+            np.concatenate([self.doc_ids[alive_rows], np.array([i for i, _ in overlay], dtype='int64')]),
+            np.concatenate([self.doc_lengths[alive_rows], np.array([e[1] for _, e in overlay], dtype='uint32')]),
+            np.concatenate([doc_of_row[self.rows[live_postings]], np.array(overlay_docs, dtype='int64')]),
+            np.concatenate([self.terms[base_terms[live_postings]], np.array(overlay_terms, dtype=TERM_DTYPE)]),
+            np.concatenate([self.tfs[live_postings].astype('uint32'), np.array(overlay_tfs, dtype='uint32')]),
+            self.k1, self.b,
+        )
+        for name in ARRAY_NAMES:
+            setattr(self, name, getattr(table, name))
+        self._overlay, self._dead = {}, None
+        self._docs, self._total_length = table._docs, table._total_length
+        return self
+
+    def copy(self) -> "LexicalIndex":
+        """Independent index sharing the base arrays (they are replaced, never written in place)"""
+        index = LexicalIndex(self.terms, self.offsets, self.rows, self.tfs, self.doc_ids, self.doc_lengths, self.k1, self.b)
+        index._overlay = dict(self._overlay)
+        index._dead = None if self._dead is None else self._dead.copy()
+        index._docs, index._total_length = self._docs, self._total_length
+        return index
+
+    def write(self, path: str):
+        index_dir = os.path.join(path, LEXICAL_DIR)
+        os.makedirs(index_dir, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(index_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(index_dir, LEXICAL_META_FILE), "w") as f:
+            json.dump({"k1": self.k1, "b": self.b}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> Optional["LexicalIndex"]:
+        """The snapshot's index, or None if it was written without one"""
+        index_dir = os.path.join(path, LEXICAL_DIR)
+        if not os.path.isdir(index_dir):
+            return None
+        with open(os.path.join(index_dir, LEXICAL_META_FILE)) as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        arrays = [np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAY_NAMES]
+        return cls(*arrays, k1=meta["k1"], b=meta["b"])
+
+    def get_stats(self) -> Dict:
+        return {
+            "documents": len(self),
+            "terms": len(self.terms),
+            "postings": len(self.rows),
+            "overlay_documents": len(self._overlay),
+            "bytes": self.nbytes,
+        }
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int, rrf_k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked id lists: score = sum over lists of 1 / (rrf_k + rank), top k best first"""
+    scores = {}
+    for ranking in rankings:
+        for rank, content_id in enumerate(ranking, 1):
+            scores[content_id] = scores.get(content_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
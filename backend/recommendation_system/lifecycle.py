@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def process_started_at() -> float:
+    """Wall-clock time this process started (from /proc on Linux, else now)"""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        # starttime is field 22 of stat, in clock ticks since boot
+        return time.time() - uptime + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class StartupTracker:
+    """Startup phases plus the liveness / readiness split.
+
+    The process is live as soon as it answers HTTP and stays live unless
+    startup fails (so an orchestrator restarts it then, and only then). It
+    becomes ready the first time a trained recommender is installed; the
+    time from process start to that moment is kept as `time_to_ready`.
+    """
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = started_at if started_at is not None else process_started_at()
+        self.phase = "starting"
+        self.phases = {}  # phase -> seconds spent in it
+        self.error = None
+        self.time_to_ready = None
+        self._phase_started = time.time()
+        self._lock = threading.Lock()
+
+    def enter(self, phase: str):
+        with self._lock:
+            now = time.time()
+            self.phases[self.phase] = self.phases.get(self.phase, 0.0) + now - self._phase_started
+            self.phase, self._phase_started = phase, now
+
+    def mark_ready(self):
+        """Record the first time the process can answer queries"""
+        with self._lock:
+            if self.time_to_ready is not None:
+                return
+            self.time_to_ready = time.time() - self.started_at
+        logger.info(f"🟢 Ready {self.time_to_ready:.1f}s after process start")
+
+    def mark_failed(self, error: Exception):
+        self.enter("failed")
+        self.error = str(error)
+
+    @property
+    def live(self) -> bool:
+        return self.phase != "failed"
+
+    @property
+    def ready(self) -> bool:
+        return self.time_to_ready is not None
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            phases = dict(self.phases)
+            phases[self.phase] = phases.get(self.phase, 0.0) + time.time() - self._phase_started
+        return {
+            "phase": self.phase,
+            "ready": self.ready,
+            "time_to_ready_seconds": round(self.time_to_ready, 3) if self.time_to_ready is not None else None,
+            "phase_seconds": {phase: round(seconds, 3) for phase, seconds in phases.items()},
+            "error": self.error,
+        }
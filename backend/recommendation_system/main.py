@@ -1,15 +1,45 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+import asyncio
 import logging
-from typing import List
+import random
+import signal
+import threading
+import time
+from typing import List, Optional
 import os
 
-from db import db, courses_coll, blogs_coll, forums_coll
-from models import RecommendRequest, RecommendResponse, CourseRecommendation
+from db import db, courses_coll, blogs_coll, forums_coll, users_coll
+from models import RecommendRequest, BulkRecommendRequest
 from embeddings import EmbeddingGenerator
-from recommender import FAISSRecommender
+from recommender import FAISSRecommender, SearchQuery
+from embedding_cache import EmbeddingCache
+from snapshot import catalogue_fingerprint, ensure_updated_at_indexes
+from content_store import FILTER_FIELDS
+from index_sync import IndexWatcher
+from serving import SnapshotFollower, SnapshotPublisher
+from user_profiles import UserProfileStore
+from index_jobs import IndexJobManager
+from query_batcher import QueryBatcher
+from query_cache import TTLCache
+from ingest import count_contents, iter_content_batches
+from payloads import render_recommendations
+from metrics import CallbackMetric, REQUEST_SECONDS, render_metrics, server_timing, stage_timer
+from lifecycle import StartupTracker
+from bulk import iter_ndjson
+from vector_store import object_id_to_int
+from config import (
+    SNAPSHOT_DIR, SNAPSHOT_MMAP, SNAPSHOT_KEEP, EMBEDDING_CACHE_PATH, INGEST_BATCH_SIZE,
+    SERVE_ROLE, SNAPSHOT_PUBLISH_INTERVAL, SNAPSHOT_FOLLOW_INTERVAL,
+    INDEX_SYNC_ENABLED, INDEX_SYNC_POLL_INTERVAL, INDEX_SYNC_SWEEP_INTERVAL,
+    ENSURE_UPDATED_AT_INDEX,
+    QUERY_BATCH_WINDOW_MS, QUERY_BATCH_MAX_SIZE,
+    QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL, RESULT_CACHE_SIZE, RESULT_CACHE_TTL,
+    USER_PROFILE_CACHE_SIZE, USER_PROFILE_TTL, USER_PROFILE_REFRESH_INTERVAL, BULK_CHUNK_SIZE, BULK_MAX_QUERIES,
+    RETRIEVAL_MODE, MMR_DEFAULT_DIVERSITY, TRACE_SAMPLE_RATE, STARTUP_MODE,
+)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -27,133 +57,211 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Content collections indexed by the recommender, keyed by content_type
+CONTENT_COLLECTIONS = {"course": courses_coll, "blog": blogs_coll, "forum": forums_coll}
+
 # Global instances
+startup = StartupTracker()
+event_loop = None
 embedding_gen = None
+embedding_cache = None
 recommender = None
+index_watcher = None
+snapshot_publisher = None  # builder role, or whenever index sync runs
+snapshot_follower = None  # worker role
+index_jobs = IndexJobManager()
+query_embedding_cache = TTLCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+result_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+query_batcher = QueryBatcher(lambda: recommender, window_ms=QUERY_BATCH_WINDOW_MS, max_batch=QUERY_BATCH_MAX_SIZE,
+                             payloads=True)
+user_profiles = UserProfileStore(db, users_coll, lambda: recommender, maxsize=USER_PROFILE_CACHE_SIZE,
+                                 ttl=USER_PROFILE_TTL, refresh_interval=USER_PROFILE_REFRESH_INTERVAL)
 
-# Image URLs for topics (fallback)
-TOPIC_IMAGES = {
-    "AI": "https://images.unsplash.com/photo-1677442136019-21780ecad995?w=400",
-    "Machine Learning": "https://images.unsplash.com/photo-1555949963-aa79dcee981c?w=400",
-    "Web Development": "https://images.unsplash.com/photo-1498050108023-c5249f4df085?w=400",
-    "Data Science": "https://images.unsplash.com/photo-1551288049-bebda4e38f71?w=400",
-    "Cloud": "https://images.unsplash.com/photo-1451187580459-43490279c0fa?w=400",
-    "Cybersecurity": "https://images.unsplash.com/photo-1550751827-4bd374c3f58b?w=400",
-    "default": "https://images.unsplash.com/photo-1516321318423-f06f85e504b3?w=400"
-}
-
-def get_image_for_content(content: dict) -> str:
-    """Get appropriate image URL for content"""
-    
-    # Your schema: images.cover_image
-    if 'images' in content and isinstance(content['images'], dict):
-        if 'cover_image' in content['images'] and content['images']['cover_image']:
-            cover = content['images']['cover_image']
-            # Replace picsum placeholder with real Unsplash images
-            if 'picsum.photos' not in cover:
-                return cover
-    
-    # Fallback: try flat 'image' field
-    if 'image' in content and content['image']:
-        return content['image']
-    
-    # Match based on category
-    category = content.get('category', '').lower()
-    category_mapping = {
-        'développement web': 'Web Development',
-        'design graphique': 'UX/UI',
-        'cybersécurité': 'Cybersecurity',
-        'intelligence artificielle': 'AI',
-        'data science': 'Data Science',
-        'cloud': 'Cloud',
-        'mobile': 'Mobile'
-    }
-    
-    matched_key = category_mapping.get(category, None)
-    if matched_key and matched_key in TOPIC_IMAGES:
-        return TOPIC_IMAGES[matched_key]
-    
-    # Try to match tags
-    tags = content.get('tags', [])
-    if isinstance(tags, str):
-        tags = [tags]
-    
-    for tag in tags:
-        tag_lower = tag.lower()
-        if tag_lower in ['deep-learning', 'ml', 'ai']:
-            return TOPIC_IMAGES['AI']
-        elif tag_lower in ['frontend', 'backend', 'web']:
-            return TOPIC_IMAGES['Web Development']
-        elif tag_lower in ['cloud', 'aws', 'azure']:
-            return TOPIC_IMAGES['Cloud']
-        elif tag_lower in ['security', 'cybersecurity']:
-            return TOPIC_IMAGES['Cybersecurity']
-        elif tag_lower in ['data', 'analytics']:
-            return TOPIC_IMAGES['Data Science']
-    
-    # Check title for keywords
-    title = content.get('title', '').lower()
-    for key in TOPIC_IMAGES.keys():
-        if key.lower() in title:
-            return TOPIC_IMAGES[key]
-    
-    return TOPIC_IMAGES['default']
+def _cache_samples(field: str) -> list:
+    caches = {"query_embeddings": query_embedding_cache.get_stats(), "results": result_cache.get_stats(),
+              "user_profiles": user_profiles.get_stats()["cache"]}
+    return [((name,), stats[field]) for name, stats in caches.items()]
+
+# Read at scrape time
+CallbackMetric("cache_hits_total", "Cache hits", lambda: _cache_samples("hits"), ("cache",), kind="counter")
+CallbackMetric("cache_misses_total", "Cache misses", lambda: _cache_samples("misses"), ("cache",), kind="counter")
+CallbackMetric("cache_entries", "Entries held per cache", lambda: _cache_samples("size"), ("cache",))
+CallbackMetric("index_vectors", "Vectors in the served index",
+               lambda: recommender.index.ntotal if recommender and recommender.index else 0)
+CallbackMetric("index_version", "In-process index version (changes on every index update)",
+               lambda: recommender.version if recommender else None)
+CallbackMetric("startup_time_to_ready_seconds", "Seconds from process start until first ready",
+               lambda: startup.time_to_ready)
+CallbackMetric("startup_phase_seconds", "Seconds spent in each startup phase",
+               lambda: [((phase,), seconds) for phase, seconds in startup.get_stats()["phase_seconds"].items()],
+               ("phase",))
+CallbackMetric("index_snapshot_info", "Snapshot the index was loaded from",
+               lambda: [((recommender.snapshot_version,), 1)] if recommender and recommender.snapshot_version else [],
+               ("snapshot",))
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize recommendation system on startup"""
-    global embedding_gen, recommender
+    """Initialize recommendation system on startup.
+
+    With STARTUP_MODE=background the port is bound right away and the model
+    and index load on a thread; until then /health/ready and the query
+    endpoints answer 503 while /health/live answers 200.
+    """
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    if STARTUP_MODE == "background":
+        threading.Thread(target=initialize, name="startup", daemon=True).start()
+    else:
+        initialize()
+
+def initialize():
+    """Load the model and the index (or start following published snapshots) and start index maintenance"""
+    global embedding_gen, embedding_cache, index_watcher, snapshot_publisher
     
     try:
-        logger.info("Initializing recommendation system...")
-        
-        # Initialize embedding generator
-        embedding_gen = EmbeddingGenerator()
+        logger.info(f"Initializing recommendation system ({SERVE_ROLE}, {STARTUP_MODE} startup)...")
         
-        # Load content from MongoDB
-        logger.info("Loading content from MongoDB...")
-        contents = []
+        # Initialize embedding generator (serve.py loads it before forking workers)
+        if embedding_gen is None:
+            startup.enter("loading_model")
+            embedding_gen = EmbeddingGenerator(query_cache=query_embedding_cache)
         
-        # Load courses - ADD CONTENT_TYPE MARKER
-        if courses_coll:
-            courses = list(db[courses_coll].find().limit(1000))
-            logger.info(f"Loaded {len(courses)} courses")
-            # Mark each course with its type
-            for course in courses:
-                course['content_type'] = 'course'
-            contents.extend(courses)
-        
-        # Load blogs - ADD CONTENT_TYPE MARKER
-        if blogs_coll:
-            blogs = list(db[blogs_coll].find().limit(1000))
-            logger.info(f"Loaded {len(blogs)} blogs")
-            # Mark each blog with its type
-            for blog in blogs:
-                blog['content_type'] = 'blog'
-            contents.extend(blogs)
-        
-        # Load forums - ADD CONTENT_TYPE MARKER
-        if forums_coll:
-            forums = list(db[forums_coll].find().limit(500))
-            logger.info(f"Loaded {len(forums)} forum posts")
-            # Mark each forum with its type
-            for forum in forums:
-                forum['content_type'] = 'forum'
-            contents.extend(forums)
+        if SERVE_ROLE == "worker":
+            startup.enter("loading_snapshot")
+            start_worker()
+            startup.enter("running")
+            return
+        if SERVE_ROLE == "builder" or INDEX_SYNC_ENABLED:
+            # Synced changes are snapshotted periodically, so a restart resumes from a recent position
+            snapshot_publisher = SnapshotPublisher(lambda: recommender, publish_snapshot,
+                                                   interval=SNAPSHOT_PUBLISH_INTERVAL)
+        if INDEX_SYNC_ENABLED:
+            index_watcher = IndexWatcher(
+                db, CONTENT_COLLECTIONS, lambda: recommender,
+                poll_interval=INDEX_SYNC_POLL_INTERVAL,
+                sweep_interval=INDEX_SYNC_SWEEP_INTERVAL,
+                on_stale=lambda: index_jobs.submit(rebuild_index),
+            )
         
-        if not contents:
-            logger.warning("No content found in database. Using sample data.")
-            contents = create_sample_data()
+        # Initialize recommender, reusing the saved index when the catalogue is unchanged
+        startup.enter("loading_snapshot")
+        if EMBEDDING_CACHE_PATH:
+            embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, embedding_gen.model_name, embedding_gen.embedding_dim)
+        rec = FAISSRecommender(embedding_gen, embedding_cache, result_cache)
+        if ENSURE_UPDATED_AT_INDEX:
+            ensure_updated_at_indexes(db, CONTENT_COLLECTIONS)
+        fingerprint = catalogue_fingerprint(db, CONTENT_COLLECTIONS)
+        # Change stream position before the catalogue is read (None when polling)
+        sync_token = index_watcher.current_token() if index_watcher else None
+        loaded = rec.load_snapshot(SNAPSHOT_DIR, fingerprint, mmap=SNAPSHOT_MMAP)
+        if loaded and sync_token is not None and rec.sync_token is None:
+            # Edits made since it was written can't be replayed
+            logger.info("Snapshot has no change stream position; rebuilding")
+            rec = FAISSRecommender(embedding_gen, embedding_cache, result_cache)
+            loaded = False
+        if loaded:
+            if snapshot_publisher:
+                snapshot_publisher.mark_published(rec.version)
+            swap_recommender(rec)
+            logger.info("Recommendation system initialized from snapshot!")
+        else:
+            # Stream content from MongoDB into the index
+            startup.enter("building_index")
+            logger.info("Loading content from MongoDB...")
+            build_from_database(rec)
+            rec.sync_token = sync_token
+            swap_recommender(rec)
+            save_snapshot(rec, fingerprint)
+            
+            logger.info("Recommendation system initialized successfully!")
         
-        # Initialize recommender
-        recommender = FAISSRecommender(embedding_gen)
-        recommender.build_index(contents)
+        # Keep the index in sync with inserts, edits and deletes, resuming after the served index's position
+        if index_watcher:
+            index_watcher.start()
         
-        logger.info("Recommendation system initialized successfully!")
+        if snapshot_publisher:
+            # Workers see synced changes once they are published; SIGHUP publishes right away
+            snapshot_publisher.start()
+            on_signal(signal.SIGHUP, snapshot_publisher.trigger)
+        startup.enter("running")
         
     except Exception as e:
         logger.error(f"Error initializing recommendation system: {e}")
-        raise
+        startup.mark_failed(e)
+        if STARTUP_MODE != "background":
+            raise
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background index maintenance"""
+    if index_watcher:
+        index_watcher.stop()
+    if snapshot_publisher:
+        snapshot_publisher.stop()
+    if snapshot_follower:
+        snapshot_follower.stop()
+    index_jobs.shutdown()
+    await query_batcher.close()
+
+def build_from_database(rec: FAISSRecommender, progress=None):
+    """Stream the catalogue from MongoDB into `rec`, falling back to sample data"""
+    total = count_contents(db, CONTENT_COLLECTIONS)
+    if total:
+        batches = iter_content_batches(db, CONTENT_COLLECTIONS, batch_size=INGEST_BATCH_SIZE)
+        rec.build_index_streaming(batches, expected_total=total, progress=progress)
+    else:
+        logger.warning("No content found in database. Using sample data.")
+        rec.build_index(create_sample_data())
+
+def save_snapshot(rec: FAISSRecommender, fingerprint: str):
+    """Persist the index snapshot; a failed write only costs the next cold start"""
+    version = rec.version
+    try:
+        rec.save_snapshot(SNAPSHOT_DIR, fingerprint, keep=SNAPSHOT_KEEP)
+    except Exception as e:
+        logger.warning(f"Could not save index snapshot: {e}")
+        return
+    if snapshot_publisher:
+        snapshot_publisher.mark_published(version)
+
+def publish_snapshot(rec: FAISSRecommender):
+    """Snapshot incrementally synced changes for the serving workers (builder role)"""
+    rec.save_snapshot(SNAPSHOT_DIR, catalogue_fingerprint(db, CONTENT_COLLECTIONS), keep=SNAPSHOT_KEEP)
+
+def start_worker():
+    """Serve the builder's published snapshot read-only, following new versions (worker role)"""
+    global snapshot_follower
+    snapshot_follower = SnapshotFollower(SNAPSHOT_DIR, load_published_snapshot, swap_recommender,
+                                         interval=SNAPSHOT_FOLLOW_INTERVAL)
+    if not snapshot_follower.check():
+        logger.info("No published snapshot yet; serving 503 until the builder publishes one")
+    snapshot_follower.start()
+    on_signal(signal.SIGHUP, snapshot_follower.trigger)
+
+def load_published_snapshot(version: str):
+    """Memory-map one published snapshot into a fresh recommender, or None if it can't be used"""
+    rec = FAISSRecommender(embedding_gen, result_cache=result_cache)
+    return rec if rec.load_snapshot(SNAPSHOT_DIR, None, mmap=True, version=version) else None
+
+def on_signal(signum, callback):
+    """Run `callback` on the event loop when the process receives `signum` (callable from any thread)"""
+    def install():
+        try:
+            event_loop.add_signal_handler(signum, callback)
+        except (NotImplementedError, RuntimeError) as e:
+            logger.warning(f"Cannot handle signal {signum}: {e}")
+    if event_loop is None:
+        logger.warning(f"Cannot handle signal {signum}: no event loop")
+    else:
+        event_loop.call_soon_threadsafe(install)
+
+def serving_stats() -> dict:
+    return {
+        "role": SERVE_ROLE,
+        "pid": os.getpid(),
+        "publisher": snapshot_publisher.get_stats() if snapshot_publisher else None,
+        "follower": snapshot_follower.get_stats() if snapshot_follower else None,
+    }
 
 def create_sample_data() -> List[dict]:
     """Create sample data if database is empty"""
@@ -178,130 +286,241 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    rec = recommender
     return {
         "status": "healthy",
-        "index_trained": recommender.is_trained if recommender else False,
-        "total_content": recommender.index.ntotal if recommender and recommender.index else 0
+        "ready": is_ready(),
+        "startup": startup.get_stats(),
+        "index_trained": rec.is_trained if rec else False,
+        "total_content": rec.index.ntotal if rec and rec.index else 0,
+        "index_sync": index_watcher.get_stats() if index_watcher else None,
+        "index_rebuild": index_jobs.latest(),
+        "query_batching": query_batcher.get_stats(),
+        "query_cache": get_cache_stats(),
+        "serving": serving_stats()
+    }
+
+def is_ready() -> bool:
+    rec = recommender
+    return startup.ready and rec is not None and rec.is_trained
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process answers, and startup hasn't failed"""
+    if not startup.live:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": startup.error})
+    return {"status": "alive", "phase": startup.phase}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe: a trained index is being served"""
+    stats = startup.get_stats()
+    if not is_ready():
+        return JSONResponse(status_code=503, content=dict(stats, status="starting"))
+    return dict(stats, status="ready")
+
+def get_cache_stats() -> dict:
+    return {
+        "query_embeddings": query_embedding_cache.get_stats(),
+        "results": result_cache.get_stats()
     }
 
+@app.get("/api/stats")
+async def stats():
+    """Index, cache and batching statistics"""
+    rec = recommender
+    return {
+        "index": rec.get_stats() if rec else None,
+        "query_cache": get_cache_stats(),
+        "query_batching": query_batcher.get_stats(),
+        "user_profiles": user_profiles.get_stats(),
+        "index_sync": index_watcher.get_stats() if index_watcher else None,
+        "serving": serving_stats(),
+        "startup": startup.get_stats()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text-format metrics for this process"""
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/api/recommend")
 async def recommend(request: RecommendRequest):
     """Generate content recommendations based on user topics"""
+    started = time.perf_counter()
+    # Sampled requests carry per-stage timings back in a Server-Timing header
+    timings = {} if TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE else None
     try:
-        if not recommender or not recommender.is_trained:
+        rec = recommender  # stable reference even if a rebuild swaps the index meanwhile
+        if not rec or not rec.is_trained:
             raise HTTPException(status_code=503, detail="Recommendation system not ready")
         
-        if not request.topics:
-            raise HTTPException(status_code=400, detail="No topics provided")
+        unknown = set(request.filters or {}) - set(FILTER_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unsupported filter fields: {sorted(unknown)}")
         
-        logger.info(f"Generating recommendations for topics: {request.topics}")
+        # Personalized: blend in the user's profile vector; their saved interests stand in for missing topics
+        profile = None
+        topics = request.topics
+        if request.user_id:
+            profile = await asyncio.get_running_loop().run_in_executor(None, user_profiles.get, request.user_id)
+            if profile is None:
+                raise HTTPException(status_code=404, detail="Unknown user")
+            topics = topics or profile.interests
         
-        # Get recommendations
-        results = recommender.search(request.topics, k=request.limit)
+        if not topics and (profile is None or profile.vector is None):
+            raise HTTPException(status_code=400, detail="No topics provided")
         
-        # Format response - NOW INCLUDING CONTENT_TYPE AND EXTRA FIELDS
-        recommendations = []
-        type_counts = {"course": 0, "blog": 0, "forum": 0, "other": 0}
-        for content, score in results:
-            # Extract description
-            desc = content.get('description', 'No description available')
-            if len(desc) > 200:
-                desc = desc[:197] + '...'
-            
-            # Extract primary topic/tag
-            topic = 'General'
-            if 'category' in content:
-                topic = content['category']
-            elif 'tags' in content and content['tags']:
-                topic = content['tags'][0] if isinstance(content['tags'], list) else content['tags']
-            elif 'labels' in content and content['labels']:
-                topic = content['labels'][0] if isinstance(content['labels'], list) else content['labels']
-            
-            # Base fields that match the Pydantic model
-            rec = CourseRecommendation(
-                title=content.get('title', 'Untitled Course'),
-                desc=desc,
-                image=get_image_for_content(content),
-                score=score,
-                topic=topic,
-                content_type=content.get('content_type', 'course'),
-            )
-            
-            # Add extra fields that aren't in the model (will still go through
-            # because we removed response_model validation on this route)
-            rec_dict = rec.dict()
-            rec_dict['_id'] = str(content.get('_id', ''))
-            rec_dict['tags'] = content.get('tags', [])
-            rec_dict['difficulty'] = content.get('difficulty', 'Intermédiaire')
-            rec_dict['duration_hours'] = content.get('duration_hours')
-            rec_dict['author'] = content.get('author', 'Expert Synapse')
-            rec_dict['views'] = content.get('views', 0)
-            rec_dict['replies'] = content.get('replies', 0)
-            rec_dict['labels'] = content.get('labels', [])
-            
-            recommendations.append(rec_dict)
-            ctype = rec_dict.get("content_type", "other")
-            if ctype not in type_counts:
-                type_counts["other"] += 1
-            else:
-                type_counts[ctype] += 1
+        logger.debug(f"Generating recommendations for topics: {topics}" + (f" (user {request.user_id})" if profile else ""))
         
-        logger.info(
-            f"Returning {len(recommendations)} recommendations "
-            f"(courses={type_counts['course']}, blogs={type_counts['blog']}, forums={type_counts['forum']}, other={type_counts['other']})"
-        )
+        # Get recommendations (encoded and searched off the event loop, batched with concurrent queries).
+        # With quotas, each content type is a separate filtered query in the same batch.
+        retrieval = request.retrieval or RETRIEVAL_MODE
+        diversity = request.diversity if request.diversity is not None else MMR_DEFAULT_DIVERSITY
+        if request.quotas:
+            queries = [
+                SearchQuery(topics, quota, request.min_score, nprobe=request.nprobe,
+                            ef_search=request.ef_search, content_type=content_type, filters=request.filters,
+                            profile=profile, exclude_seen=request.exclude_seen, retrieval=retrieval,
+                            diversity=diversity)
+                for content_type, quota in request.quotas.items()
+            ]
+        else:
+            queries = [SearchQuery(topics, request.limit, request.min_score,
+                                   nprobe=request.nprobe, ef_search=request.ef_search, filters=request.filters,
+                                   profile=profile, exclude_seen=request.exclude_seen, retrieval=retrieval,
+                                   diversity=diversity)]
+        result_lists = await asyncio.gather(*(query_batcher.search(query, timings) for query in queries))
         
-        return {
-            "recommendations": recommendations,
-            "total": len(recommendations)
-        }
+        # Items were encoded when the content was indexed; only the scores are spliced in here
+        results = [hit for hits in result_lists for hit in hits]
+        logger.debug(f"Returning {len(results)} recommendations")
+        with stage_timer("serialize", timings):
+            body = render_recommendations(results)
+        response = Response(content=body, media_type="application/json")
+        if timings is not None:
+            timings["total"] = time.perf_counter() - started
+            trace_id = os.urandom(8).hex()
+            response.headers["Server-Timing"] = server_timing(timings)
+            response.headers["X-Trace-Id"] = trace_id
+            # No topics or user id at INFO: counts and timings are enough to find slow stages
+            logger.info(f"Trace {trace_id}: topics={len(topics)} personalized={profile is not None} "
+                        f"results={len(results)} {server_timing(timings)}")
+        return response
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error generating recommendations: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, "recommend")
+
+@app.post("/api/recommend/bulk")
+async def recommend_bulk(request: BulkRecommendRequest):
+    """Recommendations for many topic sets / users at once, streamed back as NDJSON.
 
-@app.post("/api/refresh-index")
-async def refresh_index():
-    """Refresh FAISS index with latest content from database"""
+    One line per query, in order: {"id", "recommendations", "total"} or
+    {"id", "error"}. Queries are encoded and searched in chunks, not one by one.
+    """
+    rec = recommender
+    if not rec or not rec.is_trained:
+        raise HTTPException(status_code=503, detail="Recommendation system not ready")
+    if len(request.queries) > BULK_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_QUERIES} queries per request")
+    unknown = set(request.filters or {}) - set(FILTER_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unsupported filter fields: {sorted(unknown)}")
+    
+    logger.info(f"Bulk recommendations for {len(request.queries)} queries")
+    # A plain generator: Starlette iterates it on a worker thread, so chunks don't block the event loop
+    lines = iter_ndjson(rec, request.queries, user_profiles, limit=request.limit, min_score=request.min_score,
+                        filters=request.filters, exclude_seen=request.exclude_seen,
+                        retrieval=request.retrieval or RETRIEVAL_MODE,
+                        diversity=request.diversity if request.diversity is not None else MMR_DEFAULT_DIVERSITY,
+                        chunk_size=BULK_CHUNK_SIZE)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+@app.get("/api/similar/{content_id}")
+async def similar(content_id: str, limit: int = Query(10, ge=1, le=50), content_type: Optional[str] = None):
+    """Items most similar to one indexed item ("more like this")"""
+    rec = recommender
+    if not rec or not rec.is_trained:
+        raise HTTPException(status_code=503, detail="Recommendation system not ready")
+    item_id = object_id_to_int(content_id)
+    if not rec.has_item(item_id):
+        raise HTTPException(status_code=404, detail="Unknown content id")
+    
+    # Precomputed neighbours answer without touching the index; restricted or stale rows search live
+    hits = rec.similar(item_id, limit, payloads=True) if content_type is None else None
+    if hits is None:
+        hits = await query_batcher.search(SearchQuery([], limit, content_type=content_type, item_id=item_id))
+    return Response(content=render_recommendations(hits), media_type="application/json")
+
+def rebuild_index(progress) -> dict:
+    """Build a fresh recommender off to the side and swap it in atomically (runs on the job worker)"""
+    logger.info("Refreshing FAISS index...")
+    
+    if index_watcher:
+        index_watcher.start_recording()
+    fingerprint = catalogue_fingerprint(db, CONTENT_COLLECTIONS)
+    new_recommender = FAISSRecommender(embedding_gen, embedding_cache, result_cache)
     try:
-        global recommender
-        
-        logger.info("Refreshing FAISS index...")
-        
-        contents = []
-        if courses_coll:
-            courses = list(db[courses_coll].find().limit(1000))
-            for course in courses:
-                course['content_type'] = 'course'
-            contents.extend(courses)
-            
-        if blogs_coll:
-            blogs = list(db[blogs_coll].find().limit(1000))
-            for blog in blogs:
-                blog['content_type'] = 'blog'
-            contents.extend(blogs)
-            
-        if forums_coll:
-            forums = list(db[forums_coll].find().limit(500))
-            for forum in forums:
-                forum['content_type'] = 'forum'
-            contents.extend(forums)
-        
-        if not contents:
-            contents = create_sample_data()
-        
-        recommender.build_index(contents)
-        
-        return {
-            "status": "success",
-            "total_content": recommender.index.ntotal
-        }
-        
+        build_from_database(new_recommender, progress)
+    except Exception:
+        if index_watcher:
+            index_watcher.stop_recording()
+        raise
+    
+    if index_watcher:
+        # Changes that arrived during the build are replayed before the swap
+        index_watcher.replay_and_swap(new_recommender, swap_recommender)
+    else:
+        swap_recommender(new_recommender)
+    save_snapshot(new_recommender, fingerprint)
+    
+    return {
+        "total_content": new_recommender.index.ntotal,
+        "embedding_cache": new_recommender.last_build_stats
+    }
+
+def swap_recommender(new_recommender: FAISSRecommender):
+    """Replace the live recommender with a single reference assignment"""
+    global recommender
+    recommender = new_recommender
+    if new_recommender.is_trained:
+        startup.mark_ready()
+
+@app.post("/api/refresh-index", status_code=202)
+async def refresh_index(wait: bool = False):
+    """Rebuild the FAISS index from the database in the background.
+
+    Returns immediately with a job id to poll; with ?wait=true the request
+    waits for the rebuild to finish (without blocking other requests).
+    """
+    if SERVE_ROLE == "worker":
+        raise HTTPException(status_code=409, detail="Rebuilds run in the builder process")
+    if embedding_gen is None:
+        raise HTTPException(status_code=503, detail="Recommendation system not ready")
+    
+    job = index_jobs.submit(rebuild_index)
+    if not wait:
+        return job
+    
+    try:
+        await asyncio.wrap_future(index_jobs.future(job["job_id"]))
     except Exception as e:
         logger.error(f"Error refreshing index: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return index_jobs.get(job["job_id"])
+
+@app.get("/api/refresh-index/{job_id}")
+async def refresh_index_status(job_id: str):
+    """Status and progress of an index rebuild job"""
+    job = index_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job
 
 # Mount static files
 if os.path.exists("frontend"):
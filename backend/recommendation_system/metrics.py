@@ -0,0 +1,188 @@
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets in seconds, 100µs .. 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def inc(self, amount: float = 1.0, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels.
+
+    `observe` is a binary search plus two additions under a lock, cheap
+    enough to call on every request.
+    """
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value: float, *labels):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[slot] += 1
+            series[-1] += value
+
+    def time(self, *labels) -> "Timer":
+        return Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Timer:
+    """Context manager observing the elapsed time into a histogram, and into `timings` if given"""
+    __slots__ = ("histogram", "labels", "timings", "key", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple, timings: Optional[Dict[str, float]] = None,
+                 key: Optional[str] = None):
+        self.histogram = histogram
+        self.labels = labels
+        self.timings = timings
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed, *self.labels)
+        if self.timings is not None:
+            self.timings[self.key] = self.timings.get(self.key, 0.0) + elapsed
+        return False
+
+
+class CallbackMetric:
+    """Gauge or counter whose samples are read when /metrics is scraped.
+
+    `collect()` returns a number, or a list of (label values, number).
+    """
+
+    def __init__(self, name: str, help: str, collect: Callable, labelnames: Iterable[str] = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        _register(self)
+
+    def render(self) -> List[str]:
+        samples = self.collect()
+        if samples is None:
+            return []
+        if not isinstance(samples, list):
+            samples = [((), samples)]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in samples:
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+def render_metrics() -> bytes:
+    """Every registered metric in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode()
+
+
+# Shared by the recommend path; stage timings of batched work are per batch
+STAGE_SECONDS = Histogram(
+    "recommend_stage_seconds", "Time spent per recommendation stage (encode/search/hydrate per batch, "
+    "queue/serialize per request)", labelnames=("stage",),
+)
+BATCH_SIZE = Histogram(
+    "recommend_batch_queries", "Queries per batched search", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024),
+)
+INDEX_BUILD_SECONDS = Histogram(
+    "index_build_seconds", "Full index build duration", buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 3600),
+)
+REQUEST_SECONDS = Histogram("recommend_request_seconds", "End-to-end handler latency", labelnames=("endpoint",))
+EMBEDDED_TEXTS = Counter("embedding_texts_total", "Texts run through the embedding model", labelnames=("kind",))
+EMBEDDING_SECONDS = Counter("embedding_seconds_total", "Time spent in the embedding model", labelnames=("kind",))
+
+
+def stage_timer(stage: str, timings: Optional[Dict[str, float]] = None) -> Timer:
+    """Time one stage into STAGE_SECONDS (and a per-request `timings` dict for traces)"""
+    return Timer(STAGE_SECONDS, (stage,), timings, stage)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Server-Timing header value (milliseconds) for a traced request"""
+    return ", ".join(f"{stage};dur={seconds * 1000.0:.3f}" for stage, seconds in timings.items())
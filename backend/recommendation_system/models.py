@@ -1,17 +1,62 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Annotated, Dict, List, Literal, Optional
+
+RetrievalMode = Literal["semantic", "lexical", "hybrid"]
 
 class RecommendRequest(BaseModel):
     """Request model for recommendation endpoint"""
-    topics: List[str] = Field(..., description="List of topics selected by user")
+    topics: List[str] = Field(default_factory=list, description="List of topics selected by user (optional with user_id)")
+    user_id: Optional[str] = Field(default=None, description="Personalize with this user's enrolled courses and interests")
+    exclude_seen: bool = Field(default=True, description="With user_id, leave out courses the user is enrolled in")
     limit: int = Field(default=10, ge=1, le=50, description="Maximum number of recommendations")
+    min_score: Optional[float] = Field(
+        default=None, ge=-1, le=1, description="Drop results whose similarity score is below this cutoff "
+                                               "(not applied to summed chunk scores, CHUNK_AGGREGATION=sum)"
+    )
+    nprobe: Optional[int] = Field(default=None, ge=1, le=4096, description="IVF clusters to search (higher = better recall, slower)")
+    ef_search: Optional[int] = Field(default=None, ge=1, le=4096, description="HNSW search breadth (higher = better recall, slower)")
+    retrieval: Optional[RetrievalMode] = Field(
+        default=None, description="semantic (embeddings), lexical (BM25 keyword match) or hybrid (both, rank-fused); "
+                                  "default from RETRIEVAL_MODE"
+    )
+    diversity: Optional[float] = Field(
+        default=None, ge=0, le=1, description="Trade relevance for variety: 0 = plain similarity ranking, higher "
+                                              "values push near-duplicates down (MMR); semantic retrieval only, "
+                                              "default from MMR_DEFAULT_DIVERSITY"
+    )
+    quotas: Optional[Dict[str, Annotated[int, Field(ge=1, le=50)]]] = Field(
+        default=None, description="Results per content_type, e.g. {\"course\": 6, \"blog\": 4}; replaces limit"
+    )
+    filters: Optional[Dict[str, List[str]]] = Field(
+        default=None,
+        description="Only return items matching all fields (any listed value per field), "
+                    "e.g. {\"category\": [\"AI\"], \"difficulty\": [\"Débutant\"]}. "
+                    "Fields: content_type, category, difficulty, tags, labels, language"
+    )
+
+class BulkQuery(BaseModel):
+    """One query of a bulk recommendation request"""
+    id: Optional[str] = Field(default=None, description="Caller's key, echoed back on the result line")
+    topics: List[str] = Field(default_factory=list, description="Topics (optional with user_id)")
+    user_id: Optional[str] = Field(default=None, description="Personalize with this user's profile")
+
+class BulkRecommendRequest(BaseModel):
+    """Request model for the bulk recommendation endpoint; settings apply to every query"""
+    queries: List[BulkQuery] = Field(..., min_length=1, description="Topic sets and/or user ids to recommend for")
+    limit: int = Field(default=10, ge=1, le=50, description="Maximum number of recommendations per query")
+    min_score: Optional[float] = Field(default=None, ge=-1, le=1, description="Same as RecommendRequest.min_score")
+    exclude_seen: bool = Field(default=True, description="With user_id, leave out courses the user is enrolled in")
+    filters: Optional[Dict[str, List[str]]] = Field(default=None, description="Same as RecommendRequest.filters")
+    retrieval: Optional[RetrievalMode] = Field(default=None, description="Same as RecommendRequest.retrieval")
+    diversity: Optional[float] = Field(default=None, ge=0, le=1, description="Same as RecommendRequest.diversity")
 
 class CourseRecommendation(BaseModel):
     """Single recommendation item"""
     title: str = Field(..., description="Title of the content")
     desc: str = Field(..., description="Description/summary")
     image: str = Field(..., description="Cover image URL")
-    score: float = Field(..., description="Similarity score (0-1)")
+    score: float = Field(..., description="Cosine similarity score (comparable across queries); "
+                                          "BM25 score for lexical and fused rank score for hybrid retrieval")
     topic: Optional[str] = Field(None, description="Primary topic/category")
     content_type: Optional[str] = Field(None, description="Type: course, blog, or forum")
 
@@ -0,0 +1,176 @@
+import json
+import os
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+NEIGHBOURS_DIR = "neighbours"
+NEIGHBOURS_META_FILE = "neighbours.json"
+
+
+class NeighbourTable:
+    """Precomputed top-K most similar items for every indexed item.
+
+    Rows are stored as one sorted int64 id column plus an (n, K) int64
+    neighbour-id matrix and an (n, K) float16 score matrix, with -1 padding
+    for rows that have fewer than K neighbours. Rows are looked up by binary
+    search, so there is no per-item Python object; items added after the
+    build live in a small overlay until the next `freeze()`. Like the other
+    snapshot columns the arrays are plain .npy files that can be mmap'd.
+
+    Rows that still point at a removed item are found with `referencing()`
+    and recomputed by the owner; readers skip ids that are no longer indexed.
+    """
+
+    def __init__(self, k: int, ids: np.ndarray, neighbours: np.ndarray, scores: np.ndarray):
+        self.k = k
+        self.ids = ids
+        self.neighbours = neighbours
+        self.scores = scores
+        self._overlay = {}  # content id -> (neighbour ids, scores) for rows not in the base arrays
+        self._dead = set()  # removed base rows
+
+    def __len__(self) -> int:
+        return len(self.ids) - len(self._dead) + len(self._overlay)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.ids.nbytes + self.neighbours.nbytes + self.scores.nbytes)
+
+    @classmethod
+    def build(cls, ids: np.ndarray, vectors: np.ndarray, search: Callable, k: int,
+              batch_size: int = 1024) -> "NeighbourTable":
+        """Search every item against the index in batches of `batch_size`.
+
+        `search(vectors, k)` returns (scores, content ids) sorted best first.
+        """
+        order = np.argsort(ids)
+        ids = np.asarray(ids)[order]
+        neighbours = np.full((len(ids), k), -1, dtype='int64')
+        scores = np.zeros((len(ids), k), dtype='float16')
+        for start in range(0, len(ids), batch_size):
+            rows = order[start:start + batch_size]
+            batch_scores, batch_ids = search(np.asarray(vectors[rows]), k + 1)
+            for j, content_id in enumerate(ids[start:start + batch_size].tolist()):
+                neighbours[start + j], scores[start + j] = drop_self(content_id, batch_ids[j], batch_scores[j], k)
+        return cls(k, ids, neighbours, scores)
+
+    def _row(self, content_id: int) -> Optional[int]:
+        row = int(np.searchsorted(self.ids, content_id))
+        if row < len(self.ids) and self.ids[row] == content_id and row not in self._dead:
+            return row
+        return None
+
+    def get(self, content_id: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(neighbour ids, scores) best first, -1 padded; None if the item has no row"""
+        entry = self._overlay.get(content_id)
+        if entry is not None:
+            return entry
+        row = self._row(content_id)
+        if row is None:
+            return None
+        return self.neighbours[row], self.scores[row]
+
+    def set(self, content_id: int, neighbour_ids: np.ndarray, scores: np.ndarray):
+        row = self._row(content_id)
+        if row is None:
+            self._overlay[content_id] = (neighbour_ids, scores.astype('float16'))
+            return
+        self._make_writable()
+        self.neighbours[row], self.scores[row] = neighbour_ids, scores
+
+    def offer(self, content_id: int, candidate: int, score: float):
+        """Put `candidate` into `content_id`'s row if it ranks among its top K"""
+        entry = self.get(content_id)
+        if entry is None or candidate == content_id:
+            return
+        neighbour_ids, scores = entry
+        present = np.flatnonzero(neighbour_ids == candidate)
+        if present.size:
+            slot = int(present[0])
+        elif neighbour_ids[-1] < 0 or score > scores[-1]:
+            slot = self.k - 1
+        else:
+            return
+        neighbour_ids, scores = neighbour_ids.copy(), scores.astype('float32')
+        neighbour_ids[slot], scores[slot] = candidate, score
+        order = np.lexsort((-scores, neighbour_ids < 0))  # valid entries first, best first
+        self.set(content_id, neighbour_ids[order], scores[order])
+
+    def remove(self, content_ids: Iterable[int]):
+        for content_id in content_ids:
+            if self._overlay.pop(content_id, None) is None:
+                row = self._row(content_id)
+                if row is not None:
+                    self._dead.add(row)
+
+    def referencing(self, content_ids: Iterable[int]) -> List[int]:
+        """Items whose rows list any of `content_ids` as a neighbour"""
+        targets = np.fromiter(content_ids, dtype='int64')
+        hits = np.flatnonzero(np.isin(self.neighbours, targets).any(axis=1))
+        found = [int(self.ids[row]) for row in hits.tolist() if row not in self._dead]
+        found += [i for i, (row_ids, _) in self._overlay.items() if np.isin(row_ids, targets).any()]
+        return found
+
+    def freeze(self) -> "NeighbourTable":
+        """Fold the overlay and removals into the base arrays"""
+        if self._overlay or self._dead:
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[list(self._dead)] = False
+            extra = sorted(self._overlay)
+            ids = np.concatenate([self.ids[keep], np.array(extra, dtype='int64')])
+            neighbours = np.concatenate([self.neighbours[keep], np.array(
+                [self._overlay[i][0] for i in extra], dtype='int64').reshape(-1, self.k)])
+            scores = np.concatenate([self.scores[keep], np.array(
+                [self._overlay[i][1] for i in extra], dtype='float16').reshape(-1, self.k)])
+            order = np.argsort(ids)
+            self.ids, self.neighbours, self.scores = ids[order], neighbours[order], scores[order]
+            self._overlay, self._dead = {}, set()
+        return self
+
+    def copy(self) -> "NeighbourTable":
+        table = NeighbourTable(self.k, np.array(self.ids), np.array(self.neighbours), np.array(self.scores))
+        table._overlay, table._dead = dict(self._overlay), set(self._dead)
+        return table
+
+    def _make_writable(self):
+        # Snapshot arrays may be read-only memory maps
+        if not self.neighbours.flags.writeable or not self.scores.flags.writeable:
+            self.neighbours = np.array(self.neighbours)
+            self.scores = np.array(self.scores)
+
+    def write(self, path: str):
+        table_dir = os.path.join(path, NEIGHBOURS_DIR)
+        os.makedirs(table_dir, exist_ok=True)
+        for name in ("ids", "neighbours", "scores"):
+            np.save(os.path.join(table_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(table_dir, NEIGHBOURS_META_FILE), "w") as f:
+            json.dump({"k": self.k}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> Optional["NeighbourTable"]:
+        """The snapshot's table, or None if it was written without one"""
+        table_dir = os.path.join(path, NEIGHBOURS_DIR)
+        if not os.path.isdir(table_dir):
+            return None
+        with open(os.path.join(table_dir, NEIGHBOURS_META_FILE)) as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        arrays = [np.load(os.path.join(table_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ("ids", "neighbours", "scores")]
+        return cls(meta["k"], *arrays)
+
+    def get_stats(self) -> Dict:
+        return {"items": len(self), "k": self.k, "overlay_items": len(self._overlay), "bytes": self.nbytes}
+
+
+def drop_self(content_id: int, neighbour_ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top k of one search result row without the item itself, -1 padded"""
+    keep = (neighbour_ids >= 0) & (neighbour_ids != content_id)
+    neighbour_ids, scores = neighbour_ids[keep][:k], scores[keep][:k]
+    padded_ids = np.full(k, -1, dtype='int64')
+    padded_scores = np.zeros(k, dtype='float16')
+    padded_ids[:len(neighbour_ids)], padded_scores[:len(scores)] = neighbour_ids, scores
+    return padded_ids, padded_scores
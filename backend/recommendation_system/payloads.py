@@ -0,0 +1,123 @@
+from typing import Dict, Iterable, Tuple
+import orjson
+
+# Image URLs for topics (fallback)
+TOPIC_IMAGES = {
+    "AI": "https://images.unsplash.com/photo-1677442136019-21780ecad995?w=400",
+    "Machine Learning": "https://images.unsplash.com/photo-1555949963-aa79dcee981c?w=400",
+    "Web Development": "https://images.unsplash.com/photo-1498050108023-c5249f4df085?w=400",
+    "Data Science": "https://images.unsplash.com/photo-1551288049-bebda4e38f71?w=400",
+    "Cloud": "https://images.unsplash.com/photo-1451187580459-43490279c0fa?w=400",
+    "Cybersecurity": "https://images.unsplash.com/photo-1550751827-4bd374c3f58b?w=400",
+    "default": "https://images.unsplash.com/photo-1516321318423-f06f85e504b3?w=400"
+}
+
+# Catalogue categories -> TOPIC_IMAGES key
+CATEGORY_TOPICS = {
+    'développement web': 'Web Development',
+    'design graphique': 'UX/UI',
+    'cybersécurité': 'Cybersecurity',
+    'intelligence artificielle': 'AI',
+    'data science': 'Data Science',
+    'cloud': 'Cloud',
+    'mobile': 'Mobile'
+}
+
+# Lowercased tag -> TOPIC_IMAGES key
+TAG_TOPICS = {
+    **dict.fromkeys(['deep-learning', 'ml', 'ai'], 'AI'),
+    **dict.fromkeys(['frontend', 'backend', 'web'], 'Web Development'),
+    **dict.fromkeys(['cloud', 'aws', 'azure'], 'Cloud'),
+    **dict.fromkeys(['security', 'cybersecurity'], 'Cybersecurity'),
+    **dict.fromkeys(['data', 'analytics'], 'Data Science'),
+}
+
+TITLE_KEYWORDS = [(key.lower(), key) for key in TOPIC_IMAGES]
+
+
+def get_image_for_content(content: dict) -> str:
+    """Get appropriate image URL for content"""
+
+    # Your schema: images.cover_image
+    images = content.get('images')
+    if isinstance(images, dict) and images.get('cover_image'):
+        cover = images['cover_image']
+        # Replace picsum placeholder with real Unsplash images
+        if 'picsum.photos' not in cover:
+            return cover
+
+    # Fallback: try flat 'image' field
+    if content.get('image'):
+        return content['image']
+
+    # Match based on category
+    matched_key = CATEGORY_TOPICS.get(content.get('category', '').lower())
+    if matched_key in TOPIC_IMAGES:
+        return TOPIC_IMAGES[matched_key]
+
+    # Try to match tags
+    tags = content.get('tags', [])
+    if isinstance(tags, str):
+        tags = [tags]
+    for tag in tags:
+        matched_key = TAG_TOPICS.get(tag.lower())
+        if matched_key:
+            return TOPIC_IMAGES[matched_key]
+
+    # Check title for keywords
+    title = content.get('title', '').lower()
+    for keyword, key in TITLE_KEYWORDS:
+        if keyword in title:
+            return TOPIC_IMAGES[key]
+
+    return TOPIC_IMAGES['default']
+
+
+def primary_topic(content: dict) -> str:
+    """Category, else first tag, else first label"""
+    if content.get('category'):
+        return content['category']
+    for field in ('tags', 'labels'):
+        values = content.get(field)
+        if values:
+            return values[0] if isinstance(values, list) else values
+    return 'General'
+
+
+def build_payload(content: dict) -> Dict:
+    """The /api/recommend item for one content, without its score"""
+    desc = content.get('description', 'No description available')
+    if len(desc) > 200:
+        desc = desc[:197] + '...'
+    _id = content.get('_id')
+    return {
+        "title": content.get('title', 'Untitled Course'),
+        "desc": desc,
+        "image": get_image_for_content(content),
+        "topic": primary_topic(content),
+        "content_type": content.get('content_type', 'course'),
+        "_id": str(_id) if _id is not None else '',
+        "tags": content.get('tags', []),
+        "difficulty": content.get('difficulty', 'Intermédiaire'),
+        "duration_hours": content.get('duration_hours'),
+        "author": content.get('author', 'Expert Synapse'),
+        "views": content.get('views', 0),
+        "replies": content.get('replies', 0),
+        "labels": content.get('labels', []),
+    }
+
+
+def encode_payload(content: dict) -> bytes:
+    """JSON-encoded payload, computed once when the content is indexed"""
+    return orjson.dumps(build_payload(content))
+
+
+def with_score(payload: bytes, score: float) -> bytes:
+    """Splice the score into a pre-encoded payload object"""
+    return b'{"score":' + orjson.dumps(score) + (b',' + payload[1:] if len(payload) > 2 else b'}')
+
+
+def render_recommendations(hits: Iterable[Tuple[bytes, float]]) -> bytes:
+    """Response body for (payload, score) hits: {"recommendations": [...], "total": n}"""
+    items = [with_score(payload, score) for payload, score in hits]
+    return b'{"recommendations":[' + b','.join(items) + b'],"total":' + str(len(items)).encode() + b'}'
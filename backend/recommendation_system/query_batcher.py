@@ -0,0 +1,117 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+from metrics import STAGE_SECONDS
+from recommender import SearchQuery
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBatcher:
+    """Coalesces concurrent recommendation queries into batched encode + search calls.
+
+    Requests are queued; a background task waits up to `window_ms` after the
+    first one (or until `max_batch` are queued), then runs a single
+    `search_batch` on the executor thread so the event loop stays free.
+    While a batch is running, new requests accumulate for the next one.
+    With `payloads=True` results carry pre-encoded response items instead
+    of content records. Time spent queued is recorded as the "queue" stage;
+    a request passing `timings` also gets its batch's stage durations.
+    """
+
+    def __init__(self, get_recommender: Callable, window_ms: float = 3.0, max_batch: int = 32,
+                 workers: int = 1, payloads: bool = False):
+        self.get_recommender = get_recommender
+        self.payloads = payloads
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-batch")
+        self._queue = None
+        self._task = None
+        self.batches = 0
+        self.queries = 0
+
+    async def search(self, query: SearchQuery, timings: Optional[Dict[str, float]] = None) -> List[Tuple[Dict, float]]:
+        """Queue one query and wait for its results"""
+        self._ensure_running()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._queue.put((query, future, timings, loop.time()))
+        return await future
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                # Take whatever is already queued, then wait out the window
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Clients that disconnected meanwhile don't need an answer
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            started = loop.time()
+            for _, _, timings, queued_at in batch:
+                STAGE_SECONDS.observe(started - queued_at, "queue")
+                if timings is not None:
+                    timings["queue"] = started - queued_at
+            batch_timings = {}
+            try:
+                recommender = self.get_recommender()
+                results = await loop.run_in_executor(
+                    self._executor,
+                    functools.partial(recommender.search_batch, payloads=self.payloads, timings=batch_timings),
+                    [item[0] for item in batch],
+                )
+            except Exception as e:
+                logger.error(f"Batched search failed: {e}")
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.queries += len(batch)
+            for (_, future, timings, _), result in zip(batch, results):
+                if timings is not None:
+                    timings.update(batch_timings)
+                if not future.done():
+                    future.set_result(result)
+
+    def get_stats(self) -> Dict:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
@@ -1,19 +1,164 @@
-import faiss
+import os
+import itertools
+from collections import deque
+from contextlib import nullcontext
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Iterable, Optional, Tuple
 import logging
+import threading
+import time
+from bson import json_util
 from embeddings import EmbeddingGenerator
+from embedding_cache import EmbeddingCache
+from query_cache import TTLCache, normalize_topics
+from config import (
+    INDEX_METRIC, FILTER_BRUTE_FORCE_MAX, USER_PROFILE_WEIGHT, NEIGHBOURS_K, NEIGHBOURS_BATCH_SIZE,
+    LEXICAL_INDEX_ENABLED, HYBRID_CANDIDATES, RRF_K, BM25_K1, BM25_B, EMBEDDING_POOL_MIN_ITEMS,
+    CHUNKING_ENABLED, CHUNK_WORDS, CHUNK_OVERLAP_WORDS, CHUNK_MAX_PER_ITEM, CHUNK_AGGREGATION, CHUNK_OVERFETCH,
+    MMR_CANDIDATE_FACTOR, MMR_MAX_CANDIDATES,
+)
+from chunks import ChunkIndex
+from content_store import ContentStore, FilterKey, make_filter_key
+from diversity import mmr
+from index_factory import AnnIndex, default_index_params
+from lexical import LexicalIndexBuilder, reciprocal_rank_fusion
+from metrics import BATCH_SIZE, INDEX_BUILD_SECONDS, stage_timer
+from neighbours import NeighbourTable, drop_self
+from vector_store import VectorStore, stable_content_id, object_id_to_int
+import snapshot
+from lazy_imports import lazy_import
+
+faiss = lazy_import("faiss")
 
 logger = logging.getLogger(__name__)
 
+# Index versions are unique across recommender instances, so a rebuilt
+# (swapped-in) recommender never matches cached results of the old one
+_index_versions = itertools.count(1)
+
+class SearchQuery:
+    """One recommendation query.
+
+    nprobe / ef_search override the index defaults (recall vs speed);
+    content_type and filters ({field: [values]}, see content_store.FILTER_FIELDS)
+    restrict which items can be returned. With a user `profile`
+    (user_profiles.UserProfile) the topic embedding is blended with the
+    profile vector (topics may then be empty), and with `exclude_seen` the
+    user's enrolled items are left out. An `item_id` query ("more like
+    this") searches with that item's stored vector instead of topics.
+
+    `retrieval` picks the retriever: "semantic" (embeddings), "lexical"
+    (BM25 over the topics) or "hybrid" (both, reciprocal-rank fused). Only
+    semantic scores are similarities; min_score applies to them alone (and
+    not to summed chunk scores, with CHUNK_AGGREGATION=sum).
+
+    `diversity` (0..1) re-ranks semantic results with maximal marginal
+    relevance: more candidates are fetched and the top k picked trading
+    similarity to the query against similarity to the items already picked.
+    Scores stay the query similarities, so results are then no longer sorted
+    by score. Lexical and hybrid results are not re-ranked.
+    """
+    __slots__ = ("topics", "k", "min_score", "nprobe", "ef_search", "content_type", "filters",
+                 "profile", "exclude_seen", "item_id", "retrieval", "diversity")
+    
+    def __init__(self, topics: List[str], k: int = 10, min_score: Optional[float] = None,
+                 nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                 content_type: Optional[str] = None, filters: Optional[Dict[str, List[str]]] = None,
+                 profile=None, exclude_seen: bool = True, item_id: Optional[int] = None,
+                 retrieval: str = "semantic", diversity: float = 0.0):
+        if retrieval not in ("semantic", "lexical", "hybrid"):
+            raise ValueError(f"Unsupported retrieval mode: {retrieval}")
+        self.topics = topics
+        self.k = k
+        self.min_score = min_score
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.content_type = content_type
+        self.filters = filters
+        self.profile = profile
+        self.exclude_seen = exclude_seen
+        self.item_id = item_id
+        self.retrieval = retrieval
+        self.diversity = diversity
+    
+    @property
+    def exclude(self) -> Optional[np.ndarray]:
+        """Sorted content ids that must not be returned"""
+        seen = None
+        if self.profile is not None and self.exclude_seen and len(self.profile.seen):
+            seen = self.profile.seen
+        if self.item_id is None:
+            return seen
+        item = np.array([self.item_id], dtype='int64')
+        return item if seen is None else np.union1d(seen, item)
+    
+    def filter_key(self) -> FilterKey:
+        """Canonical filter: AND of (field, any-of values) clauses"""
+        key = make_filter_key(self.filters)
+        if self.content_type is not None:
+            key = tuple(sorted(key + make_filter_key({"content_type": [self.content_type]})))
+        return key
+    
+    def search_params(self) -> Tuple:
+        return (self.nprobe, self.ef_search, self.filter_key())
+    
+    def cache_key(self, version: int) -> Tuple:
+        key = (version, normalize_topics(self.topics), self.k) + self.search_params()
+        if self.profile is not None:
+            key += (self.profile.key, self.exclude_seen)
+        if self.item_id is not None:
+            key += ("item", self.item_id)
+        if self.retrieval == "hybrid":
+            # Semantic hits below min_score are dropped before fusion
+            key += (self.retrieval, self.min_score)
+        elif self.retrieval != "semantic":
+            key += (self.retrieval,)
+        if self.diversity > 0:
+            # Hits below min_score are dropped before re-ranking, so the cached list depends on it
+            key += ("diversity", self.diversity, self.min_score)
+        return key
+
+def _excluded(query: SearchQuery) -> int:
+    exclude = query.exclude
+    return 0 if exclude is None else len(exclude)
+
+def _fetch_k(query: SearchQuery) -> int:
+    """Semantic hits needed: k, the fusion depth for hybrid queries, or the MMR candidates for diverse ones"""
+    if query.retrieval == "hybrid":
+        return max(query.k, HYBRID_CANDIDATES)
+    if query.diversity > 0:
+        return max(min(query.k * MMR_CANDIDATE_FACTOR, MMR_MAX_CANDIDATES), query.k)
+    return query.k
+
 class FAISSRecommender:
     """FAISS-based content recommendation system"""
     
-    def __init__(self, embedding_generator: EmbeddingGenerator):
+    def __init__(self, embedding_generator: EmbeddingGenerator, embedding_cache: EmbeddingCache = None,
+                 result_cache: TTLCache = None, metric: str = INDEX_METRIC, index_params: Dict = None,
+                 chunking: bool = CHUNKING_ENABLED, neighbours_k: int = NEIGHBOURS_K):
+        if metric not in ("cosine", "l2"):
+            raise ValueError(f"Unsupported index metric: {metric}")
         self.embedding_gen = embedding_generator
-        self.index = None
-        self.content_mapping = []  # Maps FAISS index position to content
+        self.metric = metric  # "cosine": inner product over L2-normalized vectors
+        self.embedding_cache = embedding_cache
+        self.result_cache = result_cache  # (index version, topics, k, search params) -> [(id, score)]
+        self.index_params = index_params or default_index_params()
+        self.version = next(_index_versions)
+        self.last_build_stats = {"cache_hits": 0, "cache_misses": 0}
+        self.index = None  # AnnIndex
+        self.contents = ContentStore()  # stable content id (FAISS id) -> serving fields; also resolves filters
+        self._filters = {}  # filter key -> (matching ids, FAISS selector), rebuilt after index changes
+        self.vectors = None  # VectorStore holding a copy of every indexed embedding
+        self.neighbours = None  # NeighbourTable of precomputed "more like this" items, if enabled
+        self.neighbours_k = neighbours_k  # neighbours per item in that table, 0 = don't build one
+        self.lexical = None  # LexicalIndex (BM25) over the embedded text, if enabled
+        self.chunking = chunking  # embed and search long items as overlapping chunks
+        self.chunks = None  # ChunkIndex of chunk vectors, when chunking
         self.is_trained = False
+        self.read_only = False  # True while the index is memory-mapped from a snapshot
+        self.snapshot_version = None  # snapshot this index was loaded from, if any
+        self.sync_token = None  # change stream resume token of the last change applied (see IndexWatcher)
+        self._lock = threading.RLock()  # Guards index/mapping against concurrent updates
     
     def build_index(self, contents: List[Dict]):
         """Build FAISS index from content embeddings"""
@@ -21,83 +166,725 @@ class FAISSRecommender:
             logger.warning("No content provided to build index")
             return
         
-        logger.info(f"Building FAISS index for {len(contents)} items")
+        batch_size = 512
+        batches = (contents[i:i + batch_size] for i in range(0, len(contents), batch_size))
+        self.build_index_streaming(batches, expected_total=len(contents))
+    
+    def build_index_streaming(self, batches: Iterable[List[Dict]], expected_total: int,
+                              progress: Optional[Callable[[int, int], None]] = None):
+        """Build FAISS index from a stream of content batches.
+
+        Batches are embedded and added in order, holding only a few batches of
+        documents at a time. Builds of at least EMBEDDING_POOL_MIN_ITEMS items
+        encode on the embedding generator's process pool, with the next
+        batches read and submitted while earlier ones encode. Indexes that need training
+        (IVF variants) are trained on the first `train_size` vectors, which are
+        buffered until then.
+        `progress(processed, expected_total)` is called after every batch.
+
+        The new index is assembled off to the side and installed in one step at
+        the end, so concurrent searches never see a half-built state.
+        """
+        logger.info(f"Building FAISS index for ~{expected_total} items")
+        build_started = time.time()
+        stats = {"cache_hits": 0, "cache_misses": 0}
         
-        # Generate embeddings
-        texts = [self.embedding_gen.create_content_text(c) for c in contents]
-        embeddings = self.embedding_gen.generate_batch_embeddings(texts)
+        dimension = self.embedding_gen.embedding_dim
+        index = AnnIndex.create(dimension, expected_total, self.metric, self.index_params)
+        train_size = index.train_size
+        store = VectorStore(dimension)
+        contents = ContentStore()
+        lexical = LexicalIndexBuilder() if LEXICAL_INDEX_ENABLED else None
+        chunk_parents, chunk_vectors = [], []
         
-        # Create FAISS index (using L2 distance)
-        dimension = embeddings.shape[1]
+        pending_ids, pending_vectors = [], []
+        processed = 0
         
-        # For small datasets (<1000), use simple IndexFlatL2
-        # For larger datasets, use IndexIVFFlat with clustering
-        if len(contents) < 1000:
-            logger.info("Using IndexFlatL2 (brute force) for small dataset")
-            self.index = faiss.IndexFlatL2(dimension)
-            self.index.add(embeddings.astype('float32'))
-        else:
-            # Use IVF (Inverted File) with k-means clustering
-            nlist = min(100, len(contents) // 10)  # Number of clusters
-            quantizer = faiss.IndexFlatL2(dimension)
-            self.index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        def add_batch(batch_len, by_id, ids, texts, resolve):
+            nonlocal processed
+            embeddings, item_chunk_vectors, chunk_counts = resolve()
+            if item_chunk_vectors is not None:
+                chunk_parents.append(np.repeat(ids, chunk_counts))
+                chunk_vectors.append(item_chunk_vectors)
+            processed += batch_len
+            if lexical is not None:
+                lexical.add(ids, texts)
+            
+            for content_id, content in by_id.items():
+                contents.upsert(content_id, content)
+            store.upsert(ids.tolist(), embeddings)
             
-            # Train the index
-            logger.info(f"Training IndexIVFFlat with {nlist} clusters")
-            self.index.train(embeddings.astype('float32'))
-            self.index.add(embeddings.astype('float32'))
+            if index.is_trained:
+                index.add(ids, embeddings)
+            else:
+                pending_ids.append(ids)
+                pending_vectors.append(embeddings)
+                if sum(len(p) for p in pending_ids) >= train_size:
+                    self._train_and_flush(index, pending_ids, pending_vectors)
             
-            # Set search parameters for better recall
-            self.index.nprobe = min(10, nlist)  # Number of clusters to search
+            if progress is not None:
+                progress(processed, expected_total)
+        
+        use_pool = expected_total >= EMBEDDING_POOL_MIN_ITEMS
+        with self.embedding_gen.process_pool() if use_pool else nullcontext():
+            # Batches submitted for encoding, added to the index in submission order
+            in_flight = deque()
+            lookahead = self.embedding_gen.pool.processes if self.embedding_gen.pool is not None else 0
+            for batch in batches:
+                if not batch:
+                    continue
+                # Deduplicate on stable id (last occurrence wins)
+                by_id = {stable_content_id(c): c for c in batch}
+                ids = np.fromiter(by_id.keys(), dtype='int64', count=len(by_id))
+                texts = [self.embedding_gen.create_content_text(c) for c in by_id.values()]
+                in_flight.append((len(batch), by_id, ids, texts,
+                                  self._submit_item_embeddings(list(by_id.values()), texts, stats,
+                                                               show_progress_bar=True)))
+                if len(in_flight) > lookahead:
+                    add_batch(*in_flight.popleft())
+            while in_flight:
+                add_batch(*in_flight.popleft())
         
-        # Store content mapping
-        self.content_mapping = contents
-        self.is_trained = True
+        if not len(contents):
+            logger.warning("No content provided to build index")
+            return
+        if pending_ids:
+            self._train_and_flush(index, pending_ids, pending_vectors)
+        contents.freeze()
+        neighbours = self._build_neighbours(index, store)
+        chunks = self._build_chunks(chunk_parents, chunk_vectors) if self.chunking else None
         
-        logger.info(f"✅ FAISS index built successfully. Total vectors: {self.index.ntotal}")
+        with self._lock:
+            self.index = index
+            self.contents = contents
+            self.vectors = store
+            self.neighbours = neighbours
+            self.lexical = lexical.build(BM25_K1, BM25_B) if lexical is not None else None
+            self.chunks = chunks
+            self.is_trained = True
+            self.read_only = False
+            self._bump_version()
+        self.last_build_stats = stats
+        INDEX_BUILD_SECONDS.observe(time.time() - build_started)
+        
+        # Entries not touched by this full build belong to deleted or edited content
+        if self.embedding_cache is not None:
+            self.embedding_cache.prune(older_than=build_started)
+        
+        logger.info(
+            f"✅ FAISS index built successfully in {time.time() - build_started:.1f}s. "
+            f"Total vectors: {index.ntotal} (embedding cache: {stats['cache_hits']} hits, {stats['cache_misses']} misses)"
+        )
+    
+    def _train_and_flush(self, index: AnnIndex, pending_ids: List[np.ndarray], pending_vectors: List[np.ndarray]):
+        """Train the index on the buffered vectors, then add them"""
+        ids = np.concatenate(pending_ids)
+        vectors = np.vstack(pending_vectors)
+        # Items repeated across buffered batches: keep the last occurrence
+        _, last = np.unique(ids[::-1], return_index=True)
+        if len(last) < len(ids):
+            keep = np.sort(len(ids) - 1 - last)
+            ids, vectors = ids[keep], vectors[keep]
+        index.train(vectors)
+        index.add(ids, vectors)
+        pending_ids.clear()
+        pending_vectors.clear()
     
-    def search(self, topics: List[str], k: int = 10) -> List[Tuple[Dict, float]]:
+    def search(self, topics: List[str], k: int = 10, min_score: Optional[float] = None,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[Dict, float]]:
         """Search for top-k similar content based on user topics"""
+        results = self.search_batch([SearchQuery(topics, k, min_score, nprobe, ef_search)])[0]
+        logger.debug(f"Found {len(results)} recommendations")
+        return results
+    
+    def search_batch(self, queries: List[SearchQuery], payloads: bool = False, cache: bool = True,
+                     timings: Optional[Dict[str, float]] = None) -> List[List[Tuple[Dict, float]]]:
+        """Search several queries at once: one encode batch and one FAISS search per set of search params.
+
+        Filtered queries (content_type / filters) are resolved to matching ids
+        through the attribute index first. Small matches are searched exactly
+        over just their vectors; larger ones are pushed into the ANN search as
+        an id selector. Either way each query gets up to `k` matching hits
+        without over-fetching (except for a personalized query's seen items,
+        which are fetched extra and dropped). Hits scoring below a query's `min_score` are
+        dropped before they are hydrated. Scores are cosine similarities (or
+        1 / (1 + L2 distance) with the l2 metric), so they are comparable
+        across queries. With chunking the search runs over chunk vectors and
+        an item scores the max (or sum) of its retrieved chunks; summed scores
+        aren't similarities, so min_score is not applied to them. Queries with
+        a `diversity` fetch extra candidates and keep an MMR-picked k of them.
+
+        Hits are (content record, score); with `payloads=True` they are
+        (pre-encoded response item, score) instead, skipping record decoding.
+        `cache=False` bypasses the result cache (bulk jobs whose one-off
+        queries would only evict interactive entries). Stage durations
+        (encode / search / hydrate) are recorded in the stage histogram and
+        added to `timings` if given.
+        """
         if not self.is_trained:
             logger.error("Index not trained. Call build_index first")
-            return []
-        
-        # Generate query embedding
-        query_embedding = self.embedding_gen.generate_query_embedding(topics)
-        query_embedding = query_embedding.reshape(1, -1).astype('float32')
-        
-        # Search
-        k = min(k, self.index.ntotal)  # Don't request more than available
-        distances, indices = self.index.search(query_embedding, k)
+            return [[] for _ in queries]
         
-        # Convert distances to similarity scores (lower distance = higher similarity)
-        # Normalize to 0-1 range
-        max_dist = distances[0].max() if len(distances[0]) > 0 and distances[0].max() > 0 else 1
-        similarities = 1 - (distances[0] / max_dist)
+        # Serve repeated queries from the result cache
+        result_cache = self.result_cache if cache else None
+        version = self.version
+        all_hits = [None] * len(queries)
+        pending = []
+        for row, query in enumerate(queries):
+            cached = None
+            if result_cache is not None:
+                cached = result_cache.get(query.cache_key(version))
+            if cached is None:
+                pending.append(row)
+            else:
+                all_hits[row] = cached
         
-        # Build results
-        results = []
-        for idx, score in zip(indices[0], similarities):
-            if 0 <= idx < len(self.content_mapping):
-                results.append((self.content_mapping[idx], float(score)))
+        BATCH_SIZE.observe(len(queries))
+        if pending:
+            with stage_timer("encode", timings):
+                query_embeddings = self._query_vectors([queries[r] for r in pending])
+            
+            # Queries sharing search params go through one index.search call
+            groups = {}
+            for i, row in enumerate(pending):
+                groups.setdefault(queries[row].search_params(), []).append(i)
+            
+            with stage_timer("search", timings):
+                for (nprobe, ef_search, filter_key), members in groups.items():
+                    # Lexical-only queries skip the vector search
+                    semantic = [i for i in members if not self._lexical_only(queries[pending[i]])]
+                    with self._lock:
+                        version = self.version
+                        allowed, selector = self._resolve_filter(filter_key) if filter_key else (None, None)
+                        available = self.index.ntotal if allowed is None else len(allowed)
+                        # Don't request more than available; seen items are over-fetched and dropped below
+                        k_max = min(max((_fetch_k(queries[pending[i]]) + _excluded(queries[pending[i]]) for i in semantic),
+                                        default=0), available)
+                        if k_max > 0 and self.chunks is not None:
+                            chunk_ids, chunk_selector = self._resolve_chunk_filter(filter_key, allowed)
+                            scores, indices = self.chunks.search(
+                                query_embeddings[semantic], k_max, self._scores_from_distances, chunk_ids,
+                                chunk_selector, nprobe=nprobe, ef_search=ef_search,
+                            )
+                        elif k_max > 0:
+                            if selector is None and allowed is not None:
+                                distances, indices = self._search_subset(query_embeddings[semantic], k_max, allowed)
+                            else:
+                                distances, indices = self.index.search(
+                                    query_embeddings[semantic], k_max, nprobe=nprobe, ef_search=ef_search,
+                                    selector=selector,
+                                )
+                            scores = self._scores_from_distances(distances)
+                
+                    semantic_rows = {i: j for j, i in enumerate(semantic)}
+                    member_hits = {}
+                    for i in members:
+                        query = queries[pending[i]]
+                        hits = []
+                        j = semantic_rows.get(i)
+                        if j is not None and k_max > 0:
+                            fetched = _fetch_k(query) + _excluded(query)
+                            row_indices = indices[j, :fetched]
+                            valid = row_indices >= 0
+                            if query.exclude is not None:
+                                valid &= ~np.isin(row_indices, query.exclude, assume_unique=True)
+                            similarities = scores[j, :fetched][valid]
+                            hits = list(zip(row_indices[valid].tolist()[:_fetch_k(query)], similarities.tolist()[:_fetch_k(query)]))
+                        member_hits[i] = hits
+                    
+                    # Diverse queries of the group are re-ranked together
+                    diverse = [i for i in semantic if queries[pending[i]].diversity > 0
+                               and not self._uses_lexical(queries[pending[i]])]
+                    if diverse and k_max > 0:
+                        reranked = self._diversify([queries[pending[i]] for i in diverse],
+                                                   [member_hits[i] for i in diverse])
+                        member_hits.update(zip(diverse, reranked))
+                    
+                    for i in members:
+                        row = pending[i]
+                        query = queries[row]
+                        hits = member_hits[i]
+                        if self._uses_lexical(query):
+                            hits = self._lexical_hits(query, hits, allowed)
+                        else:
+                            hits = hits[:query.k]
+                        all_hits[row] = hits
+                        if result_cache is not None:
+                            result_cache.set(query.cache_key(version), hits)
         
-        logger.info(f"Found {len(results)} recommendations for topics: {topics}")
-        return results
+        # Hydrate (ids removed since the search ran are skipped)
+        with stage_timer("hydrate", timings):
+            all_results = []
+            lookup = self.contents.payload if payloads else self.contents.get
+            for query, hits in zip(queries, all_hits):
+                min_score = query.min_score if self._similarity_scores and not self._uses_lexical(query) else None
+                if min_score is not None:
+                    # Hits are sorted by score, so cut at the first one below the threshold
+                    hits = list(itertools.takewhile(lambda hit: hit[1] >= min_score, hits))
+                results = []
+                for content_id, score in hits:
+                    content = lookup(content_id)
+                    if content is not None:
+                        results.append((content, score))
+                all_results.append(results)
+        return all_results
+    
+    def _diversify(self, queries: List[SearchQuery], hit_lists: List[List[Tuple[int, float]]]) -> List[List[Tuple[int, float]]]:
+        """Each query's top k of its semantic hits by maximal marginal relevance, in one batched `mmr` call.
+
+        Candidate vectors come from the vector store (exact, unlike
+        reconstructing them from a quantized index). Hits below a query's
+        min_score are dropped first, since the re-ranked list is no longer
+        sorted by score for the hydrate cutoff. Summed chunk scores are
+        scaled by each query's top score to be weighed against cosines.
+        """
+        candidates = []
+        for query, hits in zip(queries, hit_lists):
+            if query.min_score is not None and self._similarity_scores:
+                hits = [hit for hit in hits if hit[1] >= query.min_score]
+            candidates.append(hits)
+        width = max(map(len, candidates))
+        relevance = np.full((len(queries), width), -np.inf, dtype='float32')
+        vectors = np.zeros((len(queries), width, self.vectors.dimension), dtype='float32')
+        with self._lock:
+            for row, hits in enumerate(candidates):
+                store_rows = self.vectors.rows([content_id for content_id, _ in hits])
+                if len(store_rows) and store_rows.min() < 0:
+                    # Removed since the search; hydrate would skip them anyway
+                    hits = [hit for hit, store_row in zip(hits, store_rows.tolist()) if store_row >= 0]
+                    store_rows = store_rows[store_rows >= 0]
+                    candidates[row] = hits
+                if hits:
+                    relevance[row, :len(hits)] = [score for _, score in hits]
+                    vectors[row, :len(hits)] = self.vectors.vectors[store_rows]
+        if not self._similarity_scores:
+            top = np.abs(np.where(np.isfinite(relevance), relevance, 0)).max(axis=1, keepdims=True)
+            relevance /= np.maximum(top, 1e-12)
+        diversity = np.array([query.diversity for query in queries], dtype='float32')
+        picks = mmr(relevance, vectors, max(query.k for query in queries), diversity)
+        return [[hits[p] for p in row_picks[:query.k] if p >= 0]
+                for query, hits, row_picks in zip(queries, candidates, picks.tolist())]
+    
+    @property
+    def _similarity_scores(self) -> bool:
+        # Summed chunk scores can't be compared against a similarity cutoff
+        return self.chunks is None or self.chunks.aggregation == "max"
+    
+    def _uses_lexical(self, query: SearchQuery) -> bool:
+        # Without a lexical index every query is served semantically
+        return query.retrieval != "semantic" and self.lexical is not None
+    
+    def _lexical_only(self, query: SearchQuery) -> bool:
+        return query.retrieval == "lexical" and self.lexical is not None
+    
+    def _lexical_hits(self, query: SearchQuery, semantic_hits: List[Tuple[int, float]],
+                      allowed: Optional[np.ndarray]) -> List[Tuple[int, float]]:
+        """BM25 hits for a lexical query, or semantic + BM25 rankings fused for a hybrid one"""
+        depth = query.k if query.retrieval == "lexical" else _fetch_k(query)
+        with self._lock:
+            ids, scores = self.lexical.search(" ".join(query.topics), depth, allowed=allowed, exclude=query.exclude)
+        if query.retrieval == "lexical":
+            return list(zip(ids.tolist(), scores.tolist()))
+        if query.min_score is not None and self._similarity_scores:
+            semantic_hits = [hit for hit in semantic_hits if hit[1] >= query.min_score]
+        return reciprocal_rank_fusion([[i for i, _ in semantic_hits], ids.tolist()], query.k, RRF_K)
     
     def update_index(self, new_contents: List[Dict]):
-        """Add new content to existing index"""
+        """Add new content to the existing index, replacing items that are already indexed"""
         if not new_contents:
             return
         
-        logger.info(f"Adding {len(new_contents)} new items to index")
+        by_id = {stable_content_id(c): c for c in new_contents}
+        ids = np.fromiter(by_id.keys(), dtype='int64', count=len(by_id))
+        contents = list(by_id.values())
         
-        texts = [self.embedding_gen.create_content_text(c) for c in new_contents]
-        embeddings = self.embedding_gen.generate_batch_embeddings(texts)
+        # Encode outside the lock so searches keep being served meanwhile
+        texts = [self.embedding_gen.create_content_text(c) for c in contents]
+        embeddings, chunk_vectors, chunk_counts = self._submit_item_embeddings(
+            contents, texts, {"cache_hits": 0, "cache_misses": 0})()
         
-        self.index.add(embeddings.astype('float32'))
-        self.content_mapping.extend(new_contents)
+        with self._lock:
+            self._ensure_writable()
+            self.index.add(ids, embeddings)
+            for content_id, content in by_id.items():
+                self.contents.upsert(content_id, content)
+            self.vectors.upsert(ids.tolist(), embeddings)
+            if self.lexical is not None:
+                for content_id, text in zip(ids.tolist(), texts):
+                    self.lexical.upsert(content_id, text)
+            if self.chunks is not None:
+                self.chunks.upsert(ids, chunk_counts, chunk_vectors)
+            if self.neighbours is not None:
+                self._refresh_neighbours(ids, embeddings)
+            self._bump_version()
+        
+        logger.info(f"Upserted {len(ids)} items. Total vectors: {self.index.ntotal}")
+    
+    def remove_from_index(self, object_ids: List) -> int:
+        """Remove content by Mongo _id; removed items stop appearing in results immediately"""
+        ids = np.array([object_id_to_int(o) for o in object_ids], dtype='int64')
+        if len(ids) == 0:
+            return 0
         
-        logger.info(f"Index updated. Total vectors: {self.index.ntotal}")
+        with self._lock:
+            self._ensure_writable()
+            for content_id in ids.tolist():
+                self.contents.remove(content_id)
+            self.index.remove(ids)
+            removed = self.vectors.remove(ids.tolist())
+            if self.lexical is not None:
+                self.lexical.remove(ids.tolist())
+            if self.chunks is not None:
+                self.chunks.remove(ids)
+            if self.neighbours is not None:
+                self.neighbours.remove(ids.tolist())
+                self._repair_neighbours(ids)
+            self._bump_version()
+        
+        logger.info(f"Removed {removed} items. Total vectors: {self.index.ntotal}")
+        return removed
+    
+    def object_ids_for_type(self, content_type: str) -> List:
+        """Mongo _ids of all indexed items of one content_type"""
+        with self._lock:
+            return self.contents.object_ids(content_type)
+    
+    def _resolve_filter(self, filter_key: FilterKey):
+        """Matching ids and, unless the match is small enough for exact search, a FAISS selector.
+
+        Cached per filter until the index changes (caller holds the lock).
+        """
+        resolved = self._filters.get(filter_key)
+        if resolved is None:
+            allowed = self.contents.match(filter_key)
+            selector = None
+            if len(allowed) > FILTER_BRUTE_FORCE_MAX:
+                selector = self.index.id_selector(allowed)
+            if len(self._filters) >= 256:
+                self._filters.clear()
+            resolved = self._filters[filter_key] = (allowed, selector)
+        return resolved
+    
+    def _resolve_chunk_filter(self, filter_key: Optional[FilterKey], allowed: Optional[np.ndarray]):
+        """A filter's chunk ids and, unless few enough for exact search, a selector on the chunk index"""
+        if not filter_key:
+            return None, None
+        resolved = self._filters.get(("chunks", filter_key))
+        if resolved is None:
+            chunk_ids = self.chunks.chunks_of(allowed)
+            selector = self.chunks.index.id_selector(chunk_ids) if len(chunk_ids) > FILTER_BRUTE_FORCE_MAX else None
+            resolved = self._filters[("chunks", filter_key)] = (chunk_ids, selector)
+        return resolved
+    
+    def _search_subset(self, queries: np.ndarray, k: int, allowed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact search restricted to a small set of ids, over their stored vectors"""
+        vectors = self.vectors.get_many(allowed.tolist())
+        metric = faiss.METRIC_INNER_PRODUCT if self.metric == "cosine" else faiss.METRIC_L2
+        distances, rows = faiss.knn(queries, vectors, k, metric=metric)
+        return distances, np.where(rows >= 0, allowed[np.maximum(rows, 0)], -1)
+    
+    def _query_vectors(self, queries: List[SearchQuery]) -> np.ndarray:
+        """Topic embeddings (one model call), blended with the user profile for personalized queries"""
+        vectors = np.zeros((len(queries), self.embedding_gen.embedding_dim), dtype='float32')
+        with_topics = [i for i, query in enumerate(queries) if query.topics and not self._lexical_only(query)]
+        if with_topics:
+            vectors[with_topics] = self._prepare_vectors(
+                self.embedding_gen.generate_query_embeddings([queries[i].topics for i in with_topics])
+            )
+        personalized = False
+        for i, query in enumerate(queries):
+            if query.item_id is not None:
+                with self._lock:
+                    vector = self.vectors.get(query.item_id)
+                if vector is not None:
+                    vectors[i] = vector
+                    personalized = True
+            elif query.profile is not None and query.profile.vector is not None:
+                weight = USER_PROFILE_WEIGHT if query.topics else 1.0
+                vectors[i] = (1.0 - weight) * vectors[i] + weight * query.profile.vector
+                personalized = True
+        return self._prepare_vectors(vectors) if personalized else vectors
+    
+    def has_item(self, content_id: int) -> bool:
+        with self._lock:
+            return self.vectors is not None and content_id in self.vectors
+    
+    def similar(self, content_id: int, k: int, payloads: bool = False) -> Optional[List[Tuple[Dict, float]]]:
+        """Up to k items most similar to an indexed item, read from the neighbour table.
+
+        Returns None when the table can't answer (disabled, no row for the
+        item, k above the table's K, or too many neighbours removed since the
+        row was computed); callers then search live with an `item_id` query.
+        """
+        lookup = self.contents.payload if payloads else self.contents.get
+        with self._lock:
+            entry = self.neighbours.get(content_id) if self.neighbours is not None and k <= self.neighbours.k else None
+            if entry is None:
+                return None
+            hits, complete = [], True
+            for neighbour, score in zip(entry[0].tolist(), entry[1].tolist()):
+                if neighbour < 0 or len(hits) == k:
+                    break
+                content = lookup(neighbour)
+                if content is None:
+                    complete = False
+                else:
+                    hits.append((content, score))
+        return hits if len(hits) == k or complete else None
+    
+    def _build_neighbours(self, index: AnnIndex, store: VectorStore) -> Optional[NeighbourTable]:
+        """Top-K table over the whole catalogue, from batched index searches"""
+        if self.neighbours_k <= 0:
+            return None
+        started = time.time()
+        
+        def search(vectors, k):
+            distances, ids = index.search(vectors, k)
+            return self._scores_from_distances(distances), ids
+        
+        table = NeighbourTable.build(store.ids, store.vectors, search, self.neighbours_k, batch_size=NEIGHBOURS_BATCH_SIZE)
+        logger.info(f"Built {self.neighbours_k}-neighbour table for {len(table)} items in {time.time() - started:.1f}s")
+        return table
+    
+    def _refresh_neighbours(self, ids: np.ndarray, embeddings: np.ndarray):
+        """Recompute the rows of changed items and offer them to the rows of their nearest items"""
+        k = self.neighbours.k
+        # Wider than k so changed items also reach items whose rows they now belong to
+        distances, neighbour_ids = self.index.search(embeddings, min(2 * k + 1, self.index.ntotal))
+        scores = self._scores_from_distances(distances)
+        for content_id, row_ids, row_scores in zip(ids.tolist(), neighbour_ids, scores):
+            self.neighbours.set(content_id, *drop_self(content_id, row_ids, row_scores, k))
+            valid = (row_ids >= 0) & (row_ids != content_id)
+            for other, score in zip(row_ids[valid].tolist(), row_scores[valid].tolist()):
+                self.neighbours.offer(other, content_id, score)
+    
+    def _repair_neighbours(self, removed: np.ndarray):
+        """Recompute the rows that listed a removed item"""
+        stale = [i for i in self.neighbours.referencing(removed.tolist()) if i in self.vectors]
+        if not stale or not self.index.ntotal:
+            return
+        k = self.neighbours.k
+        distances, neighbour_ids = self.index.search(self.vectors.get_many(stale), min(k + 1, self.index.ntotal))
+        scores = self._scores_from_distances(distances)
+        for content_id, row_ids, row_scores in zip(stale, neighbour_ids, scores):
+            self.neighbours.set(content_id, *drop_self(content_id, row_ids, row_scores, k))
+    
+    def item_vectors(self, content_ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, vectors) of the given items that are indexed, from the stored embeddings"""
+        with self._lock:
+            ids = np.array([i for i in content_ids if i in self.vectors], dtype='int64')
+            vectors = self.vectors.get_many(ids.tolist()) if len(ids) else np.empty((0, self.vectors.dimension), dtype='float32')
+        return ids, np.array(vectors, dtype='float32')
+    
+    def _prepare_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        """float32 copy of the vectors, L2-normalized for the cosine metric"""
+        vectors = np.array(vectors, dtype='float32')
+        if self.metric == "cosine":
+            faiss.normalize_L2(vectors)
+        return vectors
+    
+    def _scores_from_distances(self, distances: np.ndarray) -> np.ndarray:
+        """Per-pair similarity scores: cosine as-is, L2 distances mapped to (0, 1]"""
+        if self.metric == "cosine":
+            return distances
+        return 1.0 / (1.0 + distances)
+    
+    def _build_chunks(self, parents: List[np.ndarray], vectors: List[np.ndarray]) -> Optional[ChunkIndex]:
+        if not parents:
+            return None
+        started = time.time()
+        chunks = ChunkIndex.build(np.concatenate(parents), np.vstack(vectors), self.metric, self.index_params,
+                                  CHUNK_AGGREGATION, CHUNK_OVERFETCH)
+        logger.info(f"Built chunk index: {len(chunks)} chunks in {time.time() - started:.1f}s")
+        return chunks
+    
+    def _submit_item_embeddings(self, contents: List[Dict], texts: List[str], stats: Dict,
+                                show_progress_bar: bool = False) -> Callable:
+        """Start embedding items; the returned function waits for (item vectors, chunk vectors, chunks per item).
+
+        Without chunking items are embedded from their content `texts` and
+        there are no chunks. With it every chunk is embedded (through the
+        embedding cache, like whole texts) and an item's vector is the
+        normalized mean of its chunk vectors.
+        """
+        if not self.chunking:
+            resolve = self._submit_embeddings(texts, stats, show_progress_bar)
+            return lambda: (resolve(), None, None)
+        chunk_texts = [self.embedding_gen.create_chunk_texts(c) for c in contents]
+        counts = np.fromiter(map(len, chunk_texts), dtype='int64', count=len(chunk_texts))
+        resolve = self._submit_embeddings([text for chunks in chunk_texts for text in chunks], stats,
+                                          show_progress_bar)
+        
+        def wait():
+            chunk_vectors = resolve()
+            offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            means = np.add.reduceat(chunk_vectors, offsets, axis=0) / counts[:, None]
+            return self._prepare_vectors(means.astype('float32')), chunk_vectors, counts
+        return wait
+    
+    def _embed_contents(self, texts: List[str], stats: Dict) -> np.ndarray:
+        """Embed content texts, only running the model on texts missing from the embedding cache.
+
+        Cache hit/miss counts are added to `stats`.
+        """
+        return self._submit_embeddings(texts, stats)()
+    
+    def _submit_embeddings(self, texts: List[str], stats: Dict,
+                           show_progress_bar: bool = False) -> Callable[[], np.ndarray]:
+        """Start embedding content texts (see _embed_contents); the returned function waits for the vectors"""
+        if self.embedding_cache is None:
+            stats["cache_misses"] += len(texts)
+            pending = self.embedding_gen.submit_batch_embeddings(texts, show_progress_bar)
+            return lambda: self._prepare_vectors(pending.result())
+        
+        keys = [self.embedding_cache.key(t) for t in texts]
+        cached = self.embedding_cache.get_many(keys)
+        
+        # Encode each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        miss_keys = list(missing)
+        pending = (self.embedding_gen.submit_batch_embeddings([missing[k] for k in miss_keys], show_progress_bar)
+                   if missing else None)
+        
+        hits = len(texts) - len(missing)
+        stats["cache_hits"] += hits
+        stats["cache_misses"] += len(missing)
+        logger.debug(f"Embedding cache: {hits} hits, {len(missing)} misses")
+        
+        def resolve() -> np.ndarray:
+            if pending is not None:
+                vectors = pending.result().astype('float32')
+                self.embedding_cache.put_many(miss_keys, vectors)
+                cached.update(zip(miss_keys, vectors))
+            embeddings = np.empty((len(texts), self.embedding_gen.embedding_dim), dtype='float32')
+            for i, key in enumerate(keys):
+                embeddings[i] = cached[key]
+            return self._prepare_vectors(embeddings)
+        return resolve
+    
+    def _ensure_writable(self):
+        """Copy a memory-mapped snapshot index into RAM before mutating it"""
+        if self.read_only:
+            logger.info("Copying memory-mapped index into memory for updates")
+            self.index = self.index.clone()
+            self.read_only = False
+    
+    def save_snapshot(self, snapshot_dir: str, fingerprint: str, keep: int = 2) -> str:
+        """Persist index, embeddings and content mapping to a versioned snapshot"""
+        manifest = {
+            "model_name": self.embedding_gen.model_name,
+            "metric": self.metric,
+            "fingerprint": fingerprint,
+            "dimension": int(self.vectors.dimension),
+            "total_vectors": int(self.index.ntotal),
+            "index_params": self.index_params,
+            "chunking": self._chunking_params(),
+        }
+        with self._lock:
+            # Rows sorted by id, so loaded stores look ids up without building a dict
+            order = np.argsort(self.vectors.ids, kind='stable')
+            ids = self.vectors.ids[order]
+            embeddings = self.vectors.vectors[order]
+            contents = self.contents.freeze()
+            neighbours = self.neighbours.freeze().copy() if self.neighbours is not None else None
+            lexical = self.lexical.freeze().copy() if self.lexical is not None else None
+            chunks = self.chunks.copy() if self.chunks is not None else None
+            index = self.index.clone()
+            # Read with the state: a token newer than the saved vectors would skip changes after a restart
+            sync_token = self.sync_token
+        manifest["sync_token"] = json_util.dumps(sync_token) if sync_token is not None else None
+        # Disk writes happen outside the lock
+        return snapshot.write_snapshot(snapshot_dir, index, ids, embeddings, contents, manifest, keep=keep,
+                                       neighbours=neighbours, lexical=lexical, chunks=chunks)
+    
+    def _chunking_params(self) -> Optional[Dict]:
+        """Chunking settings baked into the item vectors (None when items are embedded whole)"""
+        if not self.chunking:
+            return None
+        return {"words": CHUNK_WORDS, "overlap": CHUNK_OVERLAP_WORDS, "max_per_item": CHUNK_MAX_PER_ITEM}
+    
+    def load_snapshot(self, snapshot_dir: str, fingerprint: Optional[str], mmap: bool = True,
+                      version: Optional[str] = None) -> bool:
+        """Load the current snapshot if it matches the model and catalogue fingerprint.
+
+        Returns False (leaving the recommender untouched) when the snapshot is
+        missing or stale, in which case the caller should rebuild. Serving
+        workers pass `fingerprint=None` to accept whatever the builder
+        published, and the `version` they saw in CURRENT.
+        """
+        if version is not None:
+            path = os.path.join(snapshot_dir, version)
+            path = path if os.path.isdir(path) else None
+        else:
+            path = snapshot.current_snapshot_path(snapshot_dir)
+        if path is None:
+            logger.info("No index snapshot found")
+            return False
+        
+        try:
+            manifest = snapshot.read_manifest(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable snapshot manifest in {path}: {e}")
+            return False
+        
+        if manifest.get("format") != snapshot.SNAPSHOT_FORMAT:
+            logger.info(f"Snapshot format {manifest.get('format')} is outdated")
+            return False
+        if manifest.get("model_name") != self.embedding_gen.model_name:
+            logger.info(f"Snapshot was built with {manifest.get('model_name')}, not {self.embedding_gen.model_name}")
+            return False
+        if manifest.get("metric") != self.metric:
+            logger.info(f"Snapshot uses the {manifest.get('metric')} metric, not {self.metric}")
+            return False
+        if manifest.get("index_params") != self.index_params:
+            logger.info("Snapshot was built with different index parameters")
+            return False
+        if manifest.get("chunking") != self._chunking_params():
+            logger.info("Snapshot was built with different chunking settings")
+            return False
+        if fingerprint is not None and manifest.get("fingerprint") != fingerprint:
+            logger.info("Snapshot is stale: catalogue fingerprint changed")
+            return False
+        
+        index, ids, embeddings, contents, neighbours, lexical, chunks, manifest = snapshot.load_snapshot(path, mmap=mmap)
+        if lexical is not None and (not LEXICAL_INDEX_ENABLED or len(lexical) != len(contents)):
+            lexical = None
+        if chunks is not None:
+            # Search-time settings follow the current config
+            chunks.aggregation, chunks.overfetch = CHUNK_AGGREGATION, CHUNK_OVERFETCH
+        if neighbours is not None and (neighbours.k != self.neighbours_k or len(neighbours) != len(contents)):
+            logger.info("Snapshot neighbour table doesn't match NEIGHBOURS_K; /api/similar will search live")
+            neighbours = None
+        if (index.ntotal != len(contents) or len(ids) != len(contents) or embeddings.shape[0] != len(contents)
+                or not np.array_equal(np.sort(ids), contents.ids)):
+            logger.warning(f"Snapshot {manifest['version']} is inconsistent, ignoring it")
+            return False
+        
+        with self._lock:
+            self.index = index
+            self.vectors = VectorStore(embeddings.shape[1], ids, embeddings)
+            self.contents = ContentStore(contents)
+            self.neighbours = neighbours
+            self.lexical = lexical
+            self.chunks = chunks if self.chunking else None
+            self.is_trained = True
+            self.read_only = mmap
+            self.snapshot_version = manifest["version"]
+            self.sync_token = json_util.loads(manifest["sync_token"]) if manifest.get("sync_token") else None
+            self._bump_version()
+        
+        logger.info(f"✅ Loaded snapshot {manifest['version']} ({index.ntotal} vectors)")
+        return True
+    
+    def _bump_version(self):
+        """Mark the index as changed; cached results of older versions are dropped"""
+        self.version = next(_index_versions)
+        self._filters = {}
+        if self.result_cache is not None:
+            self.result_cache.clear()
     
     def get_stats(self) -> Dict:
         """Get index statistics"""
@@ -105,5 +892,15 @@ class FAISSRecommender:
             "is_trained": self.is_trained,
             "total_vectors": self.index.ntotal if self.index else 0,
             "dimension": self.embedding_gen.embedding_dim,
-            "total_content": len(self.content_mapping)
+            "encoder": self.embedding_gen.get_stats(),
+            "total_content": len(self.contents),
+            "index_version": self.version,
+            "snapshot_version": self.snapshot_version,
+            "content_types": self.contents.value_counts("content_type"),
+            "content_store": self.contents.get_stats(),
+            "neighbours": self.neighbours.get_stats() if self.neighbours is not None else None,
+            "lexical": self.lexical.get_stats() if self.lexical is not None else None,
+            "chunks": self.chunks.get_stats() if self.chunks is not None else None,
+            "vectors": self.vectors.get_stats() if self.vectors is not None else None,
+            "index": self.index.describe() if self.index else None
         }
\ No newline at end of file
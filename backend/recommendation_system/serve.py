@@ -0,0 +1,161 @@
+"""Multi-process serving: one index builder plus N read-only workers.
+
+    python serve.py --workers 4 --port 8000
+
+The builder (SERVE_ROLE=builder, on 127.0.0.1:SERVE_BUILDER_PORT) loads or
+builds the index, keeps it in sync with MongoDB and publishes snapshots;
+/api/refresh-index is served there. Workers (SERVE_ROLE=worker) are forked
+from this process, share one listening socket, and serve /api/recommend
+from the memory-mapped snapshot, reloading whenever the builder publishes a
+new one. Index, embeddings and content columns are mapped from the same
+files in every worker, so memory stays about one copy while throughput
+scales with cores (check "mapped" in /api/stats: a faiss build without
+in-place mmap gives every worker a private copy of flat/HNSW indexes).
+
+With SERVE_PRELOAD_MODEL the embedding model is loaded here, before the
+fork, so workers share its weights copy-on-write. Forking after torch has
+started its OpenMP/MKL thread pools can deadlock the children (which is why
+EncoderPool spawns instead), so the model is loaded and run on a single
+torch thread here, and each worker sets its own thread count after the
+fork. ONNX Runtime sessions don't survive a fork, so that backend is always
+loaded by the workers themselves.
+
+SIGHUP is forwarded to all children: the builder publishes pending changes
+and the workers check for a new snapshot immediately. SIGTERM / SIGINT stop
+everything. Workers that die are restarted.
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Optional
+import logging
+
+# Set before main/config are imported: this process only ever hosts workers
+os.environ["SERVE_ROLE"] = "worker"
+
+from config import SERVE_WORKERS, SERVE_BUILDER_PORT, SERVE_PRELOAD_MODEL, EMBEDDING_BACKEND, EMBEDDING_THREADS
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_builder(port: int) -> subprocess.Popen:
+    env = dict(os.environ, SERVE_ROLE="builder")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=APP_DIR, env=env,
+    )
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def preload_model(app_module):
+    """Load the embedding model before forking, without starting torch's thread pools (see module docstring)"""
+    from embeddings import EmbeddingGenerator
+    app_module.embedding_gen = EmbeddingGenerator(query_cache=app_module.query_embedding_cache, threads=1)
+
+
+def fork_worker(app_module, sock: socket.socket, host: str, port: int, torch_threads: Optional[int] = None) -> int:
+    """Fork one worker; `torch_threads` is set in the child when the model was preloaded"""
+    pid = os.fork()
+    if pid:
+        return pid
+    # Child: drop the supervisor's handlers, uvicorn installs its own (and main.py handles SIGHUP)
+    code = 0
+    try:
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        if torch_threads:
+            import torch
+            torch.set_num_threads(torch_threads)
+            app_module.embedding_gen.threads = torch_threads
+        import uvicorn
+        server = uvicorn.Server(uvicorn.Config(app_module.app, host=host, port=port))
+        server.run(sockets=[sock])
+    except BaseException as e:
+        logger.error(f"Worker {os.getpid()} crashed: {e}")
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the recommender with one builder and N workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--builder-port", type=int, default=SERVE_BUILDER_PORT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    os.chdir(APP_DIR)
+    builder = start_builder(args.builder_port)
+    logger.info(f"🏗️  Builder started (pid {builder.pid}, port {args.builder_port})")
+
+    import main as app_module
+    torch_threads = None
+    if SERVE_PRELOAD_MODEL and EMBEDDING_BACKEND != "onnx":
+        # Loaded once here; forked workers share its weights copy-on-write
+        preload_model(app_module)
+        torch_threads = EMBEDDING_THREADS or max((os.cpu_count() or 1) // args.workers, 1)
+
+    sock = bind_socket(args.host, args.port)
+    workers = set()
+    stopping = False
+
+    def forward(signum, frame):
+        for pid in list(workers) + [builder.pid]:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        forward(signal.SIGTERM, frame)
+
+    signal.signal(signal.SIGHUP, forward)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        workers.add(fork_worker(app_module, sock, args.host, args.port, torch_threads))
+    logger.info(f"🚀 Serving on {args.host}:{args.port} with {args.workers} workers")
+
+    while workers or builder.poll() is None:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid == builder.pid:
+            builder.returncode = os.waitstatus_to_exitcode(status)
+            if not stopping:
+                logger.error(f"Builder exited ({builder.returncode}); restarting")
+                time.sleep(1)
+                builder = start_builder(args.builder_port)
+            continue
+        workers.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited ({os.waitstatus_to_exitcode(status)}); restarting")
+            time.sleep(1)
+            workers.add(fork_worker(app_module, sock, args.host, args.port, torch_threads))
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
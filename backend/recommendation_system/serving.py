@@ -0,0 +1,155 @@
+import threading
+from typing import Callable, Dict
+import logging
+import snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotPublisher:
+    """Builder side of multi-process serving.
+
+    Every `interval` seconds (or on `trigger()`), if the live recommender
+    changed since the last snapshot (incremental sync), `publish` writes a
+    new snapshot, which repoints CURRENT so workers pick it up. Snapshots
+    written elsewhere (startup, rebuilds) are reported via `mark_published`.
+    """
+
+    def __init__(self, get_recommender: Callable, publish: Callable, interval: float = 30.0):
+        self.get_recommender = get_recommender
+        self._publish = publish
+        self.interval = interval
+        self.published_version = None  # recommender version in the latest snapshot
+        self.published = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def trigger(self):
+        """Publish pending changes now (safe to call from a signal handler)"""
+        self._wake.set()
+
+    def mark_published(self, version: int):
+        """Record that recommender `version` is already on disk"""
+        with self._lock:
+            self.published_version = version
+
+    def publish(self, recommender) -> bool:
+        """Snapshot `recommender` unless its current version is already published"""
+        with self._lock:
+            version = recommender.version
+            if version == self.published_version:
+                return False
+            self._publish(recommender)
+            self.published_version = version
+            self.published += 1
+            return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            recommender = self.get_recommender()
+            if recommender is None or not recommender.is_trained:
+                continue
+            try:
+                self.publish(recommender)
+            except Exception as e:
+                logger.error(f"Snapshot publish failed: {e}")
+
+    def get_stats(self) -> Dict:
+        return {
+            "published": self.published,
+            "published_version": self.published_version,
+            "interval_seconds": self.interval,
+        }
+
+
+class SnapshotFollower:
+    """Worker side of multi-process serving.
+
+    Watches the snapshot directory's CURRENT pointer and, when the builder
+    publishes a new version, loads it memory-mapped through `load(version)`
+    (which returns a ready recommender, or None if the snapshot can't be used)
+    and hands it to `swap`. All workers map the same files, so the index and
+    content store occupy the page cache once however many workers run.
+    `trigger()` (wired to SIGHUP) checks immediately instead of waiting for
+    the next poll.
+    """
+
+    def __init__(self, snapshot_dir: str, load: Callable, swap: Callable, interval: float = 2.0):
+        self.snapshot_dir = snapshot_dir
+        self._load = load
+        self._swap = swap
+        self.interval = interval
+        self.version = None  # snapshot version currently served
+        self.reloads = 0
+        self.failed_version = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-follower", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def trigger(self):
+        """Check for a new snapshot now (safe to call from a signal handler)"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Snapshot reload failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def check(self) -> bool:
+        """Load and swap in the published snapshot if it is newer than the served one"""
+        version = snapshot.current_version(self.snapshot_dir)
+        if version is None or version == self.version or version == self.failed_version:
+            return False
+        recommender = self._load(version)
+        if recommender is None:
+            # Don't retry a broken snapshot until the builder publishes another
+            self.failed_version = version
+            return False
+        self._swap(recommender)
+        self.version = version
+        self.reloads += 1
+        logger.info(f"🔄 Now serving snapshot {version}")
+        return True
+
+    def get_stats(self) -> Dict:
+        return {
+            "snapshot_version": self.version,
+            "reloads": self.reloads,
+            "poll_interval_seconds": self.interval,
+        }
@@ -0,0 +1,166 @@
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, Optional, Tuple
+import logging
+from pymongo.errors import PyMongoError
+from index_factory import AnnIndex
+from content_store import ContentColumns
+from neighbours import NeighbourTable
+from lexical import LexicalIndex
+from chunks import ChunkIndex
+
+logger = logging.getLogger(__name__)
+
+# Bump when the on-disk layout changes so old snapshots are rebuilt
+SNAPSHOT_FORMAT = 8
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+IDS_FILE = "ids.npy"
+
+
+def catalogue_fingerprint(db, collections: Dict[str, str]) -> str:
+    """Cheap catalogue fingerprint: document count, newest _id and newest updatedAt per collection.
+
+    It catches inserts and deletes, but in-place edits only of documents that
+    carry `updatedAt`. The app's content has none, so a snapshot is reused
+    after such edits, stale until the index watcher or a rebuild catches up.
+    The newest-updatedAt lookup scans the collection unless `updatedAt` is
+    indexed (see ensure_updated_at_indexes).
+    """
+    digest = hashlib.sha256()
+    for content_type, coll_name in sorted(collections.items()):
+        if not coll_name:
+            continue
+        coll = db[coll_name]
+        count = coll.count_documents({})
+        newest = coll.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        updated = coll.find_one(
+            {"updatedAt": {"$exists": True}}, {"updatedAt": 1}, sort=[("updatedAt", -1)]
+        )
+        digest.update(
+            f"{content_type}:{count}:{newest['_id'] if newest else ''}:"
+            f"{updated['updatedAt'] if updated else ''}|".encode()
+        )
+    return digest.hexdigest()[:16]
+
+
+def ensure_updated_at_indexes(db, collections: Dict[str, str]):
+    """Create the `updatedAt` index behind catalogue_fingerprint and the index watcher's polling.
+
+    Opt-in (ENSURE_UPDATED_AT_INDEX), as the collections belong to the Node app.
+    A no-op when it exists; failures (e.g. a read-only database user) are
+    logged and leave those lookups as collection scans.
+    """
+    for coll_name in sorted(name for name in collections.values() if name):
+        try:
+            db[coll_name].create_index("updatedAt")
+        except PyMongoError as e:
+            logger.warning(f"Could not create updatedAt index on {coll_name}: {e}")
+
+
+def current_version(base_dir: str) -> Optional[str]:
+    """Version name CURRENT points at, or None if no snapshot was written yet"""
+    try:
+        with open(os.path.join(base_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_snapshot_path(base_dir: str) -> Optional[str]:
+    """Return the directory of the current snapshot, or None if there is none"""
+    version = current_version(base_dir)
+    if version is None:
+        return None
+    path = os.path.join(base_dir, version)
+    return path if os.path.isdir(path) else None
+
+
+def read_manifest(path: str) -> Dict:
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def write_snapshot(base_dir: str, index: AnnIndex, ids: np.ndarray, embeddings: np.ndarray,
+                   contents: ContentColumns, manifest: Dict, keep: int = 2,
+                   neighbours: Optional[NeighbourTable] = None, lexical: Optional[LexicalIndex] = None,
+                   chunks: Optional[ChunkIndex] = None) -> str:
+    """Write a new versioned snapshot and point CURRENT at it.
+
+    Files are written to a temporary directory first and renamed into place, so
+    readers never observe a half-written snapshot.
+    """
+    os.makedirs(base_dir, exist_ok=True)
+    version = f"{time.strftime('%Y%m%dT%H%M%S')}-{manifest.get('fingerprint', 'none')[:8]}"
+    suffix = 0
+    while os.path.exists(os.path.join(base_dir, version if not suffix else f"{version}.{suffix}")):
+        suffix += 1
+    if suffix:
+        version = f"{version}.{suffix}"
+
+    tmp_path = os.path.join(base_dir, f".tmp-{version}")
+    os.makedirs(tmp_path)
+    index.write(tmp_path)
+    np.save(os.path.join(tmp_path, IDS_FILE), np.ascontiguousarray(ids, dtype='int64'))
+    np.save(os.path.join(tmp_path, EMBEDDINGS_FILE), np.ascontiguousarray(embeddings, dtype='float32'))
+    contents.write(tmp_path)
+    if neighbours is not None:
+        neighbours.write(tmp_path)
+    if lexical is not None:
+        lexical.write(tmp_path)
+    if chunks is not None:
+        chunks.write(tmp_path)
+    manifest = dict(manifest, format=SNAPSHOT_FORMAT, version=version, created_at=time.time())
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    path = os.path.join(base_dir, version)
+    os.rename(tmp_path, path)
+
+    # Atomically repoint CURRENT
+    current_tmp = os.path.join(base_dir, f".{CURRENT_FILE}.tmp")
+    with open(current_tmp, "w") as f:
+        f.write(version)
+    os.replace(current_tmp, os.path.join(base_dir, CURRENT_FILE))
+
+    _prune_snapshots(base_dir, keep=keep, current=version)
+    logger.info(f"💾 Snapshot {version} written to {path}")
+    return path
+
+
+def load_snapshot(path: str, mmap: bool = True) -> Tuple[AnnIndex, np.ndarray, np.ndarray, ContentColumns,
+                                                         Optional[NeighbourTable], Optional[LexicalIndex],
+                                                         Optional[ChunkIndex], Dict]:
+    """Load index, content ids, embedding matrix, contents, neighbour table, lexical and chunk indexes (if any)
+    and manifest.
+
+    With mmap=True the FAISS indexes, the embedding matrices, the content
+    columns, the neighbour table and the postings are memory-mapped
+    read-only instead of being copied into RAM.
+    """
+    manifest = read_manifest(path)
+    index = AnnIndex.read(path, mmap=mmap)
+    ids = np.load(os.path.join(path, IDS_FILE), mmap_mode='r' if mmap else None)
+    embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode='r' if mmap else None)
+    contents = ContentColumns.load(path, mmap=mmap)
+    neighbours = NeighbourTable.load(path, mmap=mmap)
+    lexical = LexicalIndex.load(path, mmap=mmap)
+    chunks = ChunkIndex.load(path, mmap=mmap)
+    return index, ids, embeddings, contents, neighbours, lexical, chunks, manifest
+
+
+def _prune_snapshots(base_dir: str, keep: int, current: str):
+    """Delete all but the `keep` most recent snapshot directories"""
+    versions = sorted(
+        name for name in os.listdir(base_dir)
+        if not name.startswith(".") and os.path.isdir(os.path.join(base_dir, name))
+    )
+    for name in versions[:-keep] if keep > 0 else []:
+        if name != current:
+            shutil.rmtree(os.path.join(base_dir, name), ignore_errors=True)
@@ -0,0 +1,330 @@
+import time
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from benchmark import StubEmbeddingGenerator
+from index_factory import default_index_params
+from index_sync import IndexWatcher
+from recommender import FAISSRecommender
+from vector_store import stable_content_id
+
+COLLECTIONS = {"blog": "blogs", "course": "courses"}
+
+
+class FakeRecommender:
+    """Records the changes the watcher applies"""
+
+    def __init__(self, indexed=None):
+        self.is_trained = True
+        self.sync_token = None
+        self.indexed = indexed or {}  # content_type -> [_id]
+        self.upserts = []
+        self.deletes = []
+
+    def update_index(self, docs):
+        self.upserts.extend(docs)
+
+    def remove_from_index(self, object_ids):
+        self.deletes.extend(object_ids)
+
+    def object_ids_for_type(self, content_type):
+        return list(self.indexed.get(content_type, []))
+
+
+class StubStream:
+    """Change stream serving a fixed list of events, one resume token per event"""
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def alive(self):
+        return bool(self.events)
+
+    def try_next(self):
+        if not self.events:
+            return None
+        event = self.events.pop(0)
+        self.resume_token = event["_id"]
+        return event
+
+
+class StubDatabase:
+    """mongomock database with a scripted `watch`"""
+
+    def __init__(self, db, streams):
+        self.db = db
+        self.streams = list(streams)
+        self.watch_calls = []
+
+    def __getitem__(self, name):
+        return self.db[name]
+
+    def watch(self, pipeline, **kwargs):
+        self.watch_calls.append(kwargs)
+        if not self.streams:
+            return StubStream([])
+        stream = self.streams.pop(0)
+        if isinstance(stream, Exception):
+            raise stream
+        return stream
+
+
+def event(n, operation, coll, object_id, full_document=None):
+    doc = {"_id": {"_data": f"token-{n}"}, "operationType": operation,
+           "ns": {"db": "test", "coll": coll}, "documentKey": {"_id": object_id}}
+    if operation != "delete":
+        doc["fullDocument"] = full_document
+    return doc
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def watcher_for(db):
+    watchers = []
+
+    def make(recommender, database=None, **kwargs):
+        kwargs.setdefault("poll_interval", 0.05)
+        kwargs.setdefault("batch_window", 0.05)
+        watcher = IndexWatcher(database if database is not None else db, COLLECTIONS,
+                               lambda: recommender, **kwargs)
+        watchers.append(watcher)
+        return watcher
+
+    yield make
+    for watcher in watchers:
+        watcher.stop()
+
+
+def test_polling_picks_up_inserts(db, watcher_for):
+    recommender = FakeRecommender()
+    watcher = watcher_for(recommender, sweep_interval=3600)
+    watcher.start()
+
+    course_id = db.courses.insert_one({"title": "New course"}).inserted_id
+    blog_id = db.blogs.insert_one({"title": "New blog"}).inserted_id
+    assert wait_for(lambda: {course_id, blog_id} <= {doc["_id"] for doc in recommender.upserts})
+    assert watcher.mode == "polling"
+
+    by_id = {doc["_id"]: doc for doc in recommender.upserts}
+    assert by_id[course_id]["content_type"] == "course"
+    assert by_id[blog_id]["content_type"] == "blog"
+    assert recommender.deletes == []
+
+
+def test_polling_misses_edits_without_updated_at(db, watcher_for):
+    # Documents as the app writes them: no updatedAt
+    old_id = db.blogs.insert_one({"title": "Old"}).inserted_id
+    recommender = FakeRecommender()
+    watcher = watcher_for(recommender, sweep_interval=3600)
+    watcher.start()
+
+    db.blogs.update_one({"_id": old_id}, {"$set": {"title": "Edited"}})
+    marker_id = db.blogs.insert_one({"title": "Marker"}).inserted_id
+    assert wait_for(lambda: any(doc["_id"] == marker_id for doc in recommender.upserts))
+    time.sleep(0.2)
+    assert old_id not in {doc["_id"] for doc in recommender.upserts}
+
+
+def test_polling_picks_up_edits_that_set_updated_at(db, watcher_for):
+    old_id = db.blogs.insert_one({"title": "Old", "updatedAt": datetime.utcnow() - timedelta(days=1)}).inserted_id
+    recommender = FakeRecommender()
+    watcher = watcher_for(recommender, sweep_interval=3600)
+    watcher.start()
+
+    db.blogs.update_one({"_id": old_id}, {"$set": {"title": "Edited", "updatedAt": datetime.utcnow()}})
+    assert wait_for(lambda: any(doc["_id"] == old_id for doc in recommender.upserts))
+    assert {doc["title"] for doc in recommender.upserts if doc["_id"] == old_id} == {"Edited"}
+
+
+def test_polling_baseline_skips_existing_documents(db, watcher_for):
+    db.blogs.insert_many([{"title": f"Blog {i}"} for i in range(3)])
+    recommender = FakeRecommender()
+    watcher = watcher_for(recommender, sweep_interval=3600)
+    watcher.start()
+    new_id = db.blogs.insert_one({"title": "Fresh"}).inserted_id
+
+    assert wait_for(lambda: recommender.upserts)
+    time.sleep(0.2)
+    assert [doc["_id"] for doc in recommender.upserts] == [new_id]
+
+
+def test_sweep_removes_deleted_documents(db, watcher_for):
+    kept, gone = db.blogs.insert_many([{"title": "Kept"}, {"title": "Gone"}]).inserted_ids
+    recommender = FakeRecommender(indexed={"blog": [kept, gone], "course": [ObjectId()]})
+    stale_course = recommender.indexed["course"][0]
+    watcher = watcher_for(recommender, sweep_interval=0)
+    watcher.start()
+    db.blogs.delete_one({"_id": gone})
+
+    assert wait_for(lambda: {gone, stale_course} <= set(recommender.deletes))
+    assert kept not in recommender.deletes
+
+
+def test_sweep_skipped_until_recommender_is_trained(db):
+    db.blogs.insert_one({"title": "Kept"})
+    recommender = FakeRecommender(indexed={"blog": [ObjectId()]})
+    recommender.is_trained = False
+    watcher = IndexWatcher(db, COLLECTIONS, lambda: recommender)
+    assert watcher._sweep_deleted() == []
+
+
+def test_change_stream_applies_events_and_stamps_position(db, watcher_for):
+    blog_id, course_id, gone_id, late_id = ObjectId(), ObjectId(), ObjectId(), ObjectId()
+    stream = StubStream([
+        event(1, "insert", "blogs", blog_id, {"_id": blog_id, "title": "First"}),
+        event(2, "update", "blogs", blog_id, {"_id": blog_id, "title": "Second"}),
+        event(3, "insert", "courses", course_id, {"_id": course_id, "title": "Course"}),
+        event(4, "insert", "blogs", gone_id, {"_id": gone_id, "title": "Short-lived"}),
+        event(5, "delete", "blogs", gone_id),
+        # Deleted before the update lookup ran
+        event(6, "update", "courses", late_id, None),
+    ])
+    database = StubDatabase(db, [stream])
+    recommender = FakeRecommender()
+    watcher = watcher_for(recommender, database=database)
+    watcher.start()
+
+    assert wait_for(lambda: watcher.applied_changes == 4)
+    assert watcher.mode == "change_stream"
+    assert database.watch_calls[0]["resume_after"] is None
+    assert database.watch_calls[0]["full_document"] == "updateLookup"
+    assert recommender.sync_token == {"_data": "token-6"}
+
+    by_id = {doc["_id"]: doc for doc in recommender.upserts}
+    assert set(by_id) == {blog_id, course_id}
+    assert by_id[blog_id]["title"] == "Second"
+    assert by_id[blog_id]["content_type"] == "blog"
+    assert by_id[course_id]["content_type"] == "course"
+    assert set(recommender.deletes) == {gone_id, late_id}
+
+
+def test_watcher_resumes_from_the_served_index_position(db, watcher_for):
+    recommender = FakeRecommender()
+    recommender.sync_token = {"_data": "token-3"}
+    database = StubDatabase(db, [])
+    watcher = watcher_for(recommender, database=database)
+    watcher.start()
+
+    assert wait_for(lambda: database.watch_calls)
+    assert database.watch_calls[0]["resume_after"] == {"_data": "token-3"}
+
+
+def test_restart_replays_changes_missing_from_the_snapshot(db, watcher_for, tmp_path):
+    gen = StubEmbeddingGenerator(32)
+    params = dict(default_index_params(), index_type="flat")
+    docs = [{"_id": ObjectId(), "content_type": "course", "title": f"Python course {i}"} for i in range(5)]
+    edited = dict(docs[0], title="Rust course")
+    edit = event(1, "update", "courses", edited["_id"], dict(edited))
+
+    rec = FAISSRecommender(gen, index_params=params, chunking=False, neighbours_k=0)
+    rec.build_index(docs)
+    rec.sync_token = {"_data": "token-0"}  # position captured before the build read the catalogue
+    rec.save_snapshot(str(tmp_path), "catalogue")
+
+    # The edit reaches the live index, but no snapshot is written before the restart
+    watcher = watcher_for(rec, database=StubDatabase(db, [StubStream([edit])]))
+    watcher.start()
+    assert wait_for(lambda: rec.sync_token == {"_data": "token-1"})
+    watcher.stop()
+
+    restarted = FAISSRecommender(gen, index_params=params, chunking=False, neighbours_k=0)
+    assert restarted.load_snapshot(str(tmp_path), "catalogue", mmap=False)
+    assert restarted.sync_token == {"_data": "token-0"}
+    item_id = stable_content_id(edited)
+    assert restarted.contents.get(item_id)["title"] == "Python course 0"
+
+    database = StubDatabase(db, [StubStream([dict(edit)])])
+    watcher = watcher_for(restarted, database=database)
+    watcher.start()
+    assert wait_for(lambda: restarted.contents.get(item_id)["title"] == "Rust course")
+    assert database.watch_calls[0]["resume_after"] == {"_data": "token-0"}
+
+    # A snapshot written now carries the position of the changes it contains
+    restarted.save_snapshot(str(tmp_path), "catalogue")
+    reloaded = FAISSRecommender(gen, index_params=params, chunking=False, neighbours_k=0)
+    assert reloaded.load_snapshot(str(tmp_path), "catalogue", mmap=False)
+    assert reloaded.sync_token == {"_data": "token-1"}
+    assert reloaded.contents.get(item_id)["title"] == "Rust course"
+
+
+def test_falls_back_to_polling_without_change_streams(db, watcher_for):
+    database = StubDatabase(db, [OperationFailure("The $changeStream stage is only supported on replica sets")])
+    recommender = FakeRecommender()
+    watcher = watcher_for(recommender, database=database, sweep_interval=3600)
+    watcher.start()
+
+    new_id = db.blogs.insert_one({"title": "Polled"}).inserted_id
+    assert wait_for(lambda: any(doc["_id"] == new_id for doc in recommender.upserts))
+    assert watcher.mode == "polling"
+
+
+def test_lost_position_marks_index_stale_until_rebuilt(db, watcher_for):
+    blog_id = ObjectId()
+    recommender = FakeRecommender()
+    recommender.sync_token = {"_data": "expired"}
+    database = StubDatabase(db, [
+        OperationFailure("resume token was not found"),
+        StubStream([event(1, "insert", "blogs", blog_id, {"_id": blog_id, "title": "Blog"})]),
+    ])
+    rebuilds = []
+    watcher = watcher_for(recommender, database=database, on_stale=lambda: rebuilds.append(len(database.watch_calls)))
+    watcher.start()
+
+    assert wait_for(lambda: watcher.applied_changes == 1)
+    assert database.watch_calls[0]["resume_after"] == {"_data": "expired"}
+    assert database.watch_calls[1]["resume_after"] is None
+    # Requested once the new stream is open, so the rebuild can't miss changes in between
+    assert rebuilds == [2]
+    # The change is applied, but the stale index doesn't claim to be at its position
+    assert [doc["_id"] for doc in recommender.upserts] == [blog_id]
+    assert recommender.sync_token is None
+
+    rebuilt = FakeRecommender()
+    watcher.start_recording()
+    watcher.replay_and_swap(rebuilt, lambda new: None)
+    assert rebuilt.sync_token == {"_data": "token-1"}
+
+
+def test_recorded_changes_replay_onto_rebuilt_index(db):
+    old, new = FakeRecommender(), FakeRecommender()
+    current = [old]
+    watcher = IndexWatcher(db, COLLECTIONS, lambda: current[0])
+    kept_id, deleted_id = ObjectId(), ObjectId()
+
+    watcher.start_recording()
+    watcher._apply([{"_id": deleted_id, "title": "Soon gone"}], [])
+    watcher._apply([{"_id": kept_id, "title": "Kept"}], [deleted_id])
+    watcher.replay_and_swap(new, lambda recommender: current.__setitem__(0, recommender))
+
+    assert current[0] is new
+    assert [doc["_id"] for doc in new.upserts] == [kept_id]
+    assert new.deletes == [deleted_id]
+    # Recording stops with the swap
+    watcher._apply([{"_id": ObjectId(), "title": "After"}], [])
+    assert watcher._recorded is None
+    assert len(new.upserts) == 2
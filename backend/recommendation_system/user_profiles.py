@@ -0,0 +1,245 @@
+import itertools
+import threading
+import time
+import numpy as np
+from typing import Callable, Dict, Iterable, Optional, Tuple
+import logging
+from bson import ObjectId
+from bson.errors import InvalidId
+from query_cache import TTLCache
+from vector_store import object_id_to_int
+
+logger = logging.getLogger(__name__)
+
+# How much an enrolled course pulls the profile, by enrollment status
+STATUS_WEIGHTS = {"completed": 1.0, "in_progress": 0.6, "paused": 0.4, "not_started": 0.2}
+
+USER_PROJECTION = {
+    "interests": 1, "updatedAt": 1,
+    "enrolledCourses.courseId": 1, "enrolledCourses.status": 1, "enrolledCourses.progress": 1,
+}
+
+_revisions = itertools.count(1)
+
+
+class UserProfile:
+    """A user's taste vector plus the items they have already seen.
+
+    `vector` is the weighted mean of the stored embeddings of the user's
+    enrolled courses (None when none of them are indexed); `seen` holds the
+    sorted content ids of every enrolled course, for exclusion. The profile
+    keeps the per-item weights and the weighted sum, so an edit to the user
+    document only touches the items that changed. The sum is only valid for
+    the item vectors it was built from: once the index version moves (items
+    may have been re-embedded) it is recomputed instead of patched.
+    """
+    __slots__ = ("user_id", "interests", "seen", "vector", "revision", "updated_at", "index_version",
+                 "_weights", "_sum", "_total")
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.interests = []
+        self.seen = np.empty(0, dtype='int64')
+        self.vector = None
+        self.revision = 0
+        self.updated_at = None  # user document's updatedAt the profile reflects
+        self.index_version = None  # recommender version whose item vectors the sum is built from
+        self._weights = {}  # content id -> weight, for items with an indexed vector
+        self._sum = None
+        self._total = 0.0
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        """Identifies this exact profile state in result cache keys"""
+        return (self.user_id, self.revision)
+
+    def apply(self, user: Dict, item_vectors: Callable, normalize: bool, index_version: Optional[int] = None):
+        """Bring the profile up to date with a user document and the item vectors of `index_version`"""
+        weights = enrollment_weights(user)
+        self.interests = [t for t in user.get("interests") or [] if isinstance(t, str) and t.strip()]
+        self.seen = np.array(sorted(weights), dtype='int64')
+        self.updated_at = user.get("updatedAt")
+        if index_version != self.index_version:
+            # Subtracting an item's current vector wouldn't remove the one that was added
+            self._weights, self._sum, self._total = {}, None, 0.0
+            self.index_version = index_version
+
+        # Only items that were added, dropped or re-weighted touch the sum
+        changed = {i for i in weights if self._weights.get(i) != weights[i]} | (set(self._weights) - set(weights))
+        if changed:
+            ids, vectors = item_vectors(sorted(changed))
+            found = dict(zip(ids.tolist(), vectors))
+            if any(i in self._weights and i not in found for i in changed):
+                # A counted item left the index, so its share can't be subtracted: start over
+                self._weights, self._sum, self._total = {}, None, 0.0
+                ids, vectors = item_vectors(sorted(weights))
+                found, changed = dict(zip(ids.tolist(), vectors)), set(weights)
+            for content_id in changed:
+                old = self._weights.pop(content_id, None)
+                vector = found.get(content_id)
+                if vector is None:
+                    continue
+                if self._sum is None:
+                    self._sum = np.zeros_like(vector, dtype='float32')
+                if old is not None:
+                    self._sum -= old * vector
+                    self._total -= old
+                new = weights.get(content_id)
+                if new is not None:
+                    self._sum += new * vector
+                    self._total += new
+                    self._weights[content_id] = new
+
+        if self._weights and self._total > 0:
+            vector = (self._sum / self._total).astype('float32')
+            if normalize:
+                vector /= max(float(np.linalg.norm(vector)), 1e-12)
+            self.vector = vector
+        else:
+            self.vector = None
+        self.revision = next(_revisions)
+
+
+def enrollment_weights(user: Dict) -> Dict[int, float]:
+    """Content id -> profile weight for each enrolled course"""
+    weights = {}
+    for enrollment in user.get("enrolledCourses") or []:
+        course_id = enrollment.get("courseId")
+        if not course_id:
+            continue
+        status = enrollment.get("status") or "in_progress"
+        weight = STATUS_WEIGHTS.get(status, STATUS_WEIGHTS["in_progress"])
+        if status == "in_progress":
+            # Further along = stronger signal
+            progress = min(max(float(enrollment.get("progress") or 0), 0.0), 100.0)
+            weight *= 0.5 + progress / 200.0
+        content_id = object_id_to_int(course_id)
+        weights[content_id] = max(weight, weights.get(content_id, 0.0))
+    return weights
+
+
+def _unchanged(user: Dict, profile: UserProfile) -> bool:
+    """Whether the user document is the one the profile was built from"""
+    return user.get("updatedAt") is not None and user.get("updatedAt") == profile.updated_at
+
+
+class UserProfileStore:
+    """Builds and caches UserProfiles from the users collection.
+
+    Profiles are built from the item embeddings already held by the
+    recommender (nothing is re-encoded). A cached profile is served as is
+    for `refresh_interval` seconds; after that only the user's `updatedAt`
+    is read back, and the profile is updated in place if it moved or the
+    index changed since it was built. Unused profiles are evicted after
+    `ttl` seconds.
+    """
+
+    def __init__(self, db, users_coll: str, get_recommender: Callable, maxsize: int = 10000,
+                 ttl: float = 3600.0, refresh_interval: float = 30.0):
+        self.db = db
+        self.users_coll = users_coll
+        self.get_recommender = get_recommender
+        self.refresh_interval = refresh_interval
+        self._cache = TTLCache(maxsize, ttl)  # user_id -> (profile, checked_at)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self.builds = 0
+        self.updates = 0
+
+    def get(self, user_id: str) -> Optional[UserProfile]:
+        """Up-to-date profile for `user_id`, or None if there is no such user"""
+        try:
+            object_id = ObjectId(user_id)
+        except (InvalidId, TypeError):
+            return None
+        cached = self._cache.get(user_id)
+        if cached is not None and time.monotonic() - cached[1] < self.refresh_interval:
+            return cached[0]
+
+        with self._user_lock(user_id):
+            cached = self._cache.get(user_id)
+            if cached is not None and time.monotonic() - cached[1] < self.refresh_interval:
+                return cached[0]
+            coll = self.db[self.users_coll]
+            recommender = self.get_recommender()
+            profile = cached[0] if cached is not None else None
+            if profile is not None and profile.index_version == recommender.version:
+                stamp = coll.find_one({"_id": object_id}, {"updatedAt": 1})
+                if stamp is None:
+                    self.invalidate(user_id)
+                    return None
+                if _unchanged(stamp, profile):
+                    self._cache.set(user_id, (profile, time.monotonic()))
+                    return profile
+
+            user = coll.find_one({"_id": object_id}, USER_PROJECTION)
+            if user is None:
+                self.invalidate(user_id)
+                return None
+            return self._apply(user_id, profile, user, recommender)
+    
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, UserProfile]:
+        """Up-to-date profiles for many users, reading all stale ones in a single query.
+
+        Unknown or invalid ids are left out of the result.
+        """
+        profiles, stale = {}, {}  # stale: ObjectId -> user ids spelling it
+        now = time.monotonic()
+        for user_id in user_ids:
+            if user_id in profiles:
+                continue
+            cached = self._cache.get(user_id)
+            if cached is not None and now - cached[1] < self.refresh_interval:
+                profiles[user_id] = cached[0]
+                continue
+            try:
+                stale.setdefault(ObjectId(user_id), []).append(user_id)
+            except (InvalidId, TypeError):
+                continue
+        if not stale:
+            return profiles
+        
+        recommender = self.get_recommender()
+        for user in self.db[self.users_coll].find({"_id": {"$in": list(stale)}}, USER_PROJECTION):
+            for user_id in stale.pop(user["_id"], []):
+                with self._user_lock(user_id):
+                    cached = self._cache.get(user_id)
+                    profile = cached[0] if cached is not None else None
+                    if profile is not None and profile.index_version == recommender.version and _unchanged(user, profile):
+                        self._cache.set(user_id, (profile, time.monotonic()))
+                    else:
+                        profile = self._apply(user_id, profile, user, recommender)
+                profiles[user_id] = profile
+        for user_ids_left in stale.values():
+            for user_id in user_ids_left:
+                self.invalidate(user_id)
+        return profiles
+    
+    def _apply(self, user_id: str, profile: Optional[UserProfile], user: Dict, recommender) -> UserProfile:
+        """Build or update `user_id`'s profile from their user document and cache it"""
+        if profile is None:
+            profile = UserProfile(user_id)
+            self.builds += 1
+        else:
+            self.updates += 1
+        profile.apply(user, recommender.item_vectors, normalize=recommender.metric == "cosine",
+                      index_version=recommender.version)
+        self._cache.set(user_id, (profile, time.monotonic()))
+        return profile
+
+    def invalidate(self, user_id: str):
+        self._cache.pop(user_id)
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._locks_guard:
+            if len(self._locks) > 4 * max(self._cache.maxsize, 1):
+                self._locks.clear()
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def get_stats(self) -> Dict:
+        return {
+            "cache": self._cache.get_stats(),
+            "builds": self.builds,
+            "incremental_updates": self.updates,
+            "refresh_interval_seconds": self.refresh_interval,
+        }
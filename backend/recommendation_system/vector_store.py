@@ -0,0 +1,151 @@
+import hashlib
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+
+
+def stable_content_id(content: Dict) -> int:
+    """Stable positive int64 id for a content document, derived from its Mongo _id.
+
+    FAISS ids are int64 while ObjectIds are 96 bits, so the id is a 63-bit hash.
+    Documents without an _id (sample data) fall back to type + title.
+    """
+    raw = content.get('_id')
+    if raw is None:
+        raw = f"{content.get('content_type', '')}:{content.get('title', '')}"
+    return object_id_to_int(raw)
+
+
+def object_id_to_int(object_id) -> int:
+    digest = hashlib.blake2b(str(object_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & 0x7FFF_FFFF_FFFF_FFFF
+
+
+class VectorStore:
+    """Row-aligned float32 embedding matrix addressable by stable content id.
+
+    Keeps a copy of every indexed vector so items can be re-read without
+    reconstructing them from (possibly lossy) FAISS indexes. Deletes swap the
+    last row into the hole so the matrix stays dense.
+
+    Snapshots store the rows sorted by id, so a loaded (memory-mapped) store
+    finds ids by binary search over the shared id column: serving workers
+    keep no per-process id map. The id -> row dict is only built once the
+    store is modified.
+    """
+
+    def __init__(self, dimension: int, ids: Optional[np.ndarray] = None,
+                 vectors: Optional[np.ndarray] = None):
+        self.dimension = dimension
+        if ids is None:
+            ids = np.empty(0, dtype='int64')
+            vectors = np.empty((0, dimension), dtype='float32')
+        self._ids = ids
+        self._vectors = vectors
+        self._size = len(ids)
+        self._row_of = None if bool(np.all(ids[1:] > ids[:-1])) else self._index_rows()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, content_id: int) -> bool:
+        return self.row(content_id) is not None
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:self._size]
+
+    @property
+    def mapped(self) -> bool:
+        """True while the matrix is a read-only memory map shared with other processes"""
+        return isinstance(self._vectors, np.memmap)
+
+    def rows(self, content_ids: Iterable[int]) -> np.ndarray:
+        """Row of each content id, -1 where it isn't stored"""
+        if self._row_of is not None:
+            return np.array([self._row_of.get(i, -1) for i in content_ids], dtype='int64')
+        content_ids = np.asarray(content_ids if isinstance(content_ids, np.ndarray) else list(content_ids),
+                                 dtype='int64')
+        ids = self.ids
+        if not len(ids):
+            return np.full(len(content_ids), -1, dtype='int64')
+        rows = np.minimum(np.searchsorted(ids, content_ids), len(ids) - 1)
+        return np.where(ids[rows] == content_ids, rows, -1)
+
+    def row(self, content_id: int) -> Optional[int]:
+        if self._row_of is not None:
+            return self._row_of.get(content_id)
+        row = int(self.rows(np.array([content_id], dtype='int64'))[0])
+        return None if row < 0 else row
+
+    def get(self, content_id: int) -> Optional[np.ndarray]:
+        row = self.row(content_id)
+        return None if row is None else self._vectors[row]
+
+    def get_many(self, content_ids: Iterable[int]) -> np.ndarray:
+        rows = self.rows(content_ids)
+        if len(rows) and rows.min() < 0:
+            raise KeyError("Content id not in the vector store")
+        return self._vectors[rows]
+
+    def upsert(self, ids: List[int], vectors: np.ndarray):
+        self._make_writable()
+        for content_id, vector in zip(ids, vectors):
+            row = self._row_of.get(content_id)
+            if row is None:
+                self._grow(self._size + 1)
+                row = self._size
+                self._ids[row] = content_id
+                self._row_of[content_id] = row
+                self._size += 1
+            self._vectors[row] = vector
+
+    def remove(self, ids: Iterable[int]) -> int:
+        self._make_writable()
+        removed = 0
+        for content_id in ids:
+            row = self._row_of.pop(content_id, None)
+            if row is None:
+                continue
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._ids[row] = moved_id
+                self._vectors[row] = self._vectors[last]
+                self._row_of[moved_id] = row
+            self._size -= 1
+            removed += 1
+        return removed
+
+    def get_stats(self) -> Dict:
+        return {
+            "vectors": self._size,
+            "bytes": int(self._ids.nbytes + self._vectors.nbytes),
+            "mapped": self.mapped,
+            "id_lookup": "sorted" if self._row_of is None else "dict",
+        }
+
+    def _index_rows(self) -> Dict[int, int]:
+        return {int(i): row for row, i in enumerate(self.ids.tolist())}
+
+    def _grow(self, needed: int):
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        ids = np.empty(capacity, dtype='int64')
+        vectors = np.empty((capacity, self.dimension), dtype='float32')
+        ids[:self._size] = self._ids[:self._size]
+        vectors[:self._size] = self._vectors[:self._size]
+        self._ids, self._vectors = ids, vectors
+
+    def _make_writable(self):
+        # Snapshot arrays may be read-only memory maps; updates also need the id -> row dict
+        if not self._ids.flags.writeable or not self._vectors.flags.writeable:
+            self._ids = np.array(self._ids[:self._size])
+            self._vectors = np.array(self._vectors[:self._size])
+        if self._row_of is None:
+            self._row_of = self._index_rows()